@@ -15,5 +15,18 @@ app.conf.beat_schedule = {
         'task': 'notifications.tasks.process_notification_queue',
         'schedule': crontab(minute='*/1'),
     },
+    # safety net, submissions normally schedule their own drain
+    'drain-form-submission-queue': {
+        'task': 'forms.tasks.drain_submission_queue',
+        'schedule': crontab(minute='*/1'),
+    },
+    'maintain-response-partitions': {
+        'task': 'forms.tasks.maintain_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'archive-old-responses': {
+        'task': 'forms.tasks.archive_old_responses',
+        'schedule': crontab(day_of_month=1, hour=4, minute=0),
+    },
 }
 app.autodiscover_tasks()
@@ -49,6 +49,7 @@ INSTALLED_APPS = [
     'corsheaders',
     'import_export',
     'auditlog',
+    'channels',
     'core',
     'forms',
 ]
@@ -67,6 +68,7 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'config.urls'
+ASGI_APPLICATION = 'config.asgi.application'
 
 TEMPLATES = [
     {
@@ -126,7 +128,8 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny'],
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
     'DEFAULT_RENDERER_CLASSES': [
-        'core.exceptions.CustomJSONRenderer',
+        # core.exceptions.FastJSONRenderer is a drop-in replacement encoding through orjson
+        os.getenv("JSON_RENDERER", 'core.exceptions.CustomJSONRenderer'),
         'rest_framework.renderers.BrowsableAPIRenderer',
     ],
     'DEFAULT_THROTTLE_CLASSES': [
@@ -170,6 +173,60 @@ CACHES = {
         }
     }
 }
+# channel layer of live form results (forms.live): redis shares it between processes, 'memory' for tests / a single process
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "CONFIG": {"hosts": [os.getenv("REDIS_URL")]},
+    } if os.getenv("CHANNEL_LAYER", "redis") == "redis" else {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    }
+}
+# live form results send at most one update per form per this many seconds
+FORMS_LIVE_WINDOW = float(os.getenv("FORMS_LIVE_WINDOW", 1))
+# compiled form schemas are versioned, this only bounds how long stale versions linger
+FORM_SCHEMA_CACHE_TIMEOUT = int(os.getenv("FORM_SCHEMA_CACHE_TIMEOUT", 60 * 60 * 24))
+# s-maxage a reverse proxy may serve form definitions for before revalidating with the ETag
+FORM_SCHEMA_PROXY_MAX_AGE = int(os.getenv("FORM_SCHEMA_PROXY_MAX_AGE", 0))
+# build form definitions (public and admin retrieve) as JSON text in one PostgreSQL query (utils.jsonsql)
+FORM_SCHEMA_DATABASE_JSON = os.getenv("FORM_SCHEMA_DATABASE_JSON", "False").lower() in ("true", "1", "yes")
+
+# buffered submission ingestion (forms.ingestion), opt in per form type, e.g. "DAILY_CHECK"
+FORMS_ASYNC_INGESTION_TYPES = [t for t in os.getenv("FORMS_ASYNC_INGESTION_TYPES", "").split(",") if t]
+# forms.ingestion.RedisStreamQueue, or forms.ingestion.FileQueue for tests / single host development
+FORMS_INGESTION_QUEUE = os.getenv("FORMS_INGESTION_QUEUE", 'forms.ingestion.RedisStreamQueue')
+FORMS_INGESTION_FILE = os.getenv("FORMS_INGESTION_FILE", os.path.join(BASE_DIR, 'var', 'submissions.jsonl'))
+FORMS_INGESTION_BATCH_SIZE = int(os.getenv("FORMS_INGESTION_BATCH_SIZE", 500))
+FORMS_INGESTION_DRAIN_DELAY = int(os.getenv("FORMS_INGESTION_DRAIN_DELAY", 2))
+FORMS_INGESTION_RECEIPT_TIMEOUT = int(os.getenv("FORMS_INGESTION_RECEIPT_TIMEOUT", 60 * 60 * 24))
+# deliveries of an entry that keeps failing with its batch before it is moved to the dead letters
+FORMS_INGESTION_MAX_DELIVERIES = int(os.getenv("FORMS_INGESTION_MAX_DELIVERIES", 5))
+# largest offline upload accepted by response/batch/
+FORMS_BATCH_MAX_SIZE = int(os.getenv("FORMS_BATCH_MAX_SIZE", 500))
+# where response answers are written: 'rows' (answers table) or 'document' (Response.answers_document)
+FORMS_ANSWER_STORAGE = os.getenv("FORMS_ANSWER_STORAGE", 'rows')
+# PostgreSQL text search configuration of answer search (forms.search)
+FORMS_SEARCH_CONFIG = os.getenv("FORMS_SEARCH_CONFIG", 'simple')
+# monthly partitions of response/answers (partition_tables, maintain_partitions): created ahead, kept attached (0 = all)
+FORMS_PARTITION_MONTHS_AHEAD = int(os.getenv("FORMS_PARTITION_MONTHS_AHEAD", 3))
+FORMS_PARTITION_RETAIN_MONTHS = int(os.getenv("FORMS_PARTITION_RETAIN_MONTHS", 0))
+# form analytics (forms.analytics): results cache lifetime, answers above which the process pool loads a form
+# (0 never; measure first), its size (one pool per server process)
+FORMS_ANALYTICS_CACHE_TIMEOUT = int(os.getenv("FORMS_ANALYTICS_CACHE_TIMEOUT", 60 * 60 * 24))
+FORMS_ANALYTICS_PARALLEL_ANSWERS = int(os.getenv("FORMS_ANALYTICS_PARALLEL_ANSWERS", 0))
+FORMS_ANALYTICS_WORKERS = int(os.getenv("FORMS_ANALYTICS_WORKERS", 0)) or None
+# cold archive of old responses (forms.archive, archive_responses): Parquet files directory, months kept in the database
+FORMS_ARCHIVE_DIR = os.getenv("FORMS_ARCHIVE_DIR", os.path.join(BASE_DIR, 'var', 'archive'))
+FORMS_ARCHIVE_AFTER_MONTHS = int(os.getenv("FORMS_ARCHIVE_AFTER_MONTHS", 12))
+# GenericModel primary keys: time-ordered uuid7 instead of random uuid4 (utils.identifiers), ids then reveal creation time
+TIME_ORDERED_IDS = os.getenv("TIME_ORDERED_IDS", "False").lower() in ("true", "1", "yes")
+# share of requests whose filtered/ordered queries are logged for advise_indexes (utils.query_patterns), 0 = off
+QUERY_PATTERN_SAMPLE_RATE = float(os.getenv("QUERY_PATTERN_SAMPLE_RATE", 0))
+QUERY_PATTERN_LOG = os.getenv("QUERY_PATTERN_LOG", os.path.join(BASE_DIR, 'var', 'query_patterns.jsonl'))
+if QUERY_PATTERN_SAMPLE_RATE:
+    MIDDLEWARE.append('utils.query_patterns.QueryPatternMiddleware')
+# Idempotency-Key header (utils.idempotency): how long results are replayed
+IDEMPOTENCY_KEY_TTL = int(os.getenv("IDEMPOTENCY_KEY_TTL", 60 * 60 * 24))
 
 # Celery
 CELERY_BROKER_URL = os.getenv("CELERY_URL")
@@ -1,12 +1,15 @@
 from rest_framework.renderers import JSONRenderer
 from rest_framework.views import exception_handler as drf_exception_handler
+from rest_framework import status
 from rest_framework.exceptions import (
-    NotFound, PermissionDenied, AuthenticationFailed, NotAuthenticated,
+    APIException, NotFound, PermissionDenied, AuthenticationFailed, NotAuthenticated,
     ValidationError, ParseError, MethodNotAllowed, Throttled, NotAcceptable,
     UnsupportedMediaType
 )
 from rest_framework.response import Response
 from core.messages import get_error_message
+from core.renderers import EncodedJSON, OrjsonRenderer
+import json
 import logging
 
 logger = logging.getLogger(__name__)
@@ -24,6 +27,12 @@ class CustomJSONRenderer(JSONRenderer):
                 'errors': {}
             }, accepted_media_type, renderer_context)
 
+        # pre-encoded payload (cached form schema ...), skip the dict -> JSON round trip
+        if isinstance(data, EncodedJSON):
+            if self.get_indent(accepted_media_type, renderer_context) is None:
+                return bytes(data)
+            data = json.loads(data)
+
         # status ok
         if 200 <= response.status_code < 300:
             return super().render(data, accepted_media_type, renderer_context)
@@ -32,6 +41,16 @@ class CustomJSONRenderer(JSONRenderer):
         return super().render(data, accepted_media_type, renderer_context)
 
 
+class FastJSONRenderer(CustomJSONRenderer, OrjsonRenderer):
+    """CustomJSONRenderer encoding through orjson, see core.renderers.OrjsonRenderer."""
+
+
+class Conflict(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'The request conflicts with the current state of the resource.'
+    default_code = 'conflict'
+
+
 def custom_exception_handler(exc, context):
     exception_map = {
         NotFound: 'not_found',
@@ -44,6 +63,7 @@ def custom_exception_handler(exc, context):
         Throttled: 'throttled',
         NotAcceptable: 'not_acceptable',
         UnsupportedMediaType: 'unsupported_media_type',
+        Conflict: 'conflict',
     }
 
     error_key = next((key for exc_type, key in exception_map.items() if isinstance(exc, exc_type)), None)
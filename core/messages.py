@@ -62,6 +62,11 @@ ERROR_MAP = {
         'message': 'نوع رسانه پشتیبانی نمی‌شود.',
         'status': status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
     },
+    'conflict': {
+        'code': 'conflict',
+        'message': 'درخواست با وضعیت فعلی در تعارض است. لطفاً کمی بعد دوباره تلاش کنید.',
+        'status': status.HTTP_409_CONFLICT
+    },
     'server_error': {
         'code': 'server_error',
         'message': 'خطای داخلی سرور.',
@@ -8,6 +8,7 @@ from django_currentuser.db.models import CurrentUserField
 from utils.format import common_datetime_str
 from django.contrib.auth.base_user import BaseUserManager
 from utils.format import upload_to_by_date
+from utils.identifiers import generate_id
 from auditlog.registry import auditlog
 from django.db.models.base import ModelBase
 
@@ -29,7 +30,7 @@ class GenericModel(models.Model, metaclass=AuditLogModelBase):
         primary_key=True,
         unique=True,
         null=False,
-        default=uuid4,
+        default=generate_id,
         editable=False
     )
     _created_by = CurrentUserField(
@@ -55,6 +56,13 @@ class GenericModel(models.Model, metaclass=AuditLogModelBase):
         indexes = (
             models.Index(fields=['id'], name='%(class)s_id_idx'),
         )
+
+    # relations read by the display properties below, used by utils.queryset to plan joins
+    property_relations = {
+        'created_by': '_created_by',
+        'updated_by': '_updated_by',
+    }
+
     @property
     def created_by(self):
         if self._created_by:
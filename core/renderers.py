@@ -0,0 +1,47 @@
+import re
+
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # optional, OrjsonRenderer falls back to the stdlib encoder
+    orjson = None
+
+
+# numbers orjson writes unlike json: exponent form (1e-7 vs 1e-07) and below 1e-4 (0.00001 vs 1e-05)
+UNLIKE_JSON_NUMBER = re.compile(rb'(?:^|[:,\[])-?(?:0\.0000|[0-9.]+e)')
+
+
+class EncodedJSON(bytes):
+    """JSON that is already encoded, CustomJSONRenderer writes it to the response as-is."""
+
+    @classmethod
+    def encode(cls, data):
+        return cls(JSONRenderer().render(data))
+
+
+class OrjsonRenderer(JSONRenderer):
+    """
+    JSONRenderer backed by orjson, which encodes UUIDs and datetimes natively instead of going
+    through JSONEncoder.default. Output is byte-identical to JSONRenderer for finite floats:
+    a payload with numbers orjson writes differently (exponent form, below 1e-4) is rendered
+    again by JSONRenderer. The exceptions are non-finite floats, written as null where
+    JSONRenderer refuses them, and datetimes whose UTC offset has seconds (pre-1946 local mean
+    times). Anything orjson refuses (ints beyond 64 bits, non-str dict keys, lone surrogates
+    ...) and indented/ASCII/non-compact output are rendered by JSONRenderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if (orjson is None or data is None or self.ensure_ascii or not self.compact
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        try:
+            ret = orjson.dumps(data, default=self.encoder_class().default, option=orjson.OPT_UTC_Z)
+        except TypeError:
+            return super().render(data, accepted_media_type, renderer_context)
+        if UNLIKE_JSON_NUMBER.search(ret):
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # JSONRenderer escapes these two for JavaScript compatibility
+        return ret.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
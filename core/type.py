@@ -53,6 +53,7 @@ class QuestionType(models.TextChoices):
     DESCRIPTION = 'DESCRIPTION', 'Description'
     BOOL = 'BOOL', 'Boolean'
     RADIO = 'RADIO', 'Radio'
+    DATE = 'DATE', 'Date'
 
 class TaskStatus(models.TextChoices):
     PENDING = 'P', 'pending'
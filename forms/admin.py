@@ -1,7 +1,12 @@
 from django.contrib import admin
-from .models import Form, Question, Option, Attendance, Answer, Response, Guest
+from .models import Form, Question, Option, Attendance, Answer, Response, Guest, FormSnapshot
 from import_export.admin import ImportExportModelAdmin
 from import_export import resources
+from datetime import datetime, time
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from utils.partitions import add_months
+from .archive import archived_months, read_archived_responses
 
 class OptionResource(resources.ModelResource):
     class Meta:
@@ -75,7 +80,28 @@ class ResponseResourceAdmin(ImportExportModelAdmin):
     list_display = ['form__title', 'user__first_name','user__last_name','_created_by','_created_at']
     ordering = ('-_created_at',)
     search_fields = ['form__title','user__first_name','user__last_name']
-    list_filter = ['form__title',]
+    list_filter = ['form__title', '_created_at']
+
+    def get_data_for_export(self, request, queryset, **kwargs):
+        # a date range reaching back into the cold archive (forms.archive) exports those responses too
+        start = _parse_bound(request.GET.get('_created_at__gte'))
+        months = archived_months()
+        if start is not None and months and start < add_months(months[-1], 1):
+            archived = read_archived_responses(start, _parse_bound(request.GET.get('_created_at__lt')))
+            if request.GET.get('form__title'):
+                # by id, the form of an archived response may have been deleted since
+                form_ids = set(Form.objects.filter(title=request.GET['form__title']).values_list('pk', flat=True))
+                archived = [response for response in archived if response.form_id in form_ids]
+            queryset = [*queryset, *archived]
+        return super().get_data_for_export(request, queryset, **kwargs)
+
+def _parse_bound(value):
+    if not value:
+        return None
+    parsed = parse_datetime(value)
+    if parsed is None:
+        parsed = datetime.combine(parse_date(value), time())
+    return parsed if timezone.is_aware(parsed) else timezone.make_aware(parsed)
 
 class GuestResource(resources.ModelResource):
     class Meta:
@@ -84,3 +110,13 @@ class GuestResource(resources.ModelResource):
 @admin.register(Guest)
 class GuestResourceAdmin(ImportExportModelAdmin):
     resource_class = GuestResource
+
+
+@admin.register(FormSnapshot)
+class FormSnapshotAdmin(admin.ModelAdmin):
+    list_display = ['form', 'version', '_created_at']
+    list_filter = ['form']
+    readonly_fields = ['form', 'version', 'schema']
+
+    def has_change_permission(self, request, obj=None):
+        return False
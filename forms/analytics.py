@@ -0,0 +1,299 @@
+import json
+import math
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from itertools import islice
+from uuid import UUID
+
+import django
+import numpy as np
+import pandas as pd
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, Max, Min
+
+from utils.conditional import make_etag
+from .archive import archived_frames
+from .documents import document_entries
+from .models import Answer, Option, Question, Response
+from .validation import CHOICE_TYPES, NUMERIC_TYPES
+
+#------------------------------------------------------------------------------------------------------------#
+# Form analytics
+#
+# A form's results are streamed from the database in chunks (values_list over one server-side
+# cursor) into pandas frames: one row per response (created_at, day, user) and one per answer,
+# rows and answer documents alike. Numeric answers are pivoted to one column per question.
+# Cross-tabs, percentiles, correlations and per-day trends are computed on those frames with
+# vectorized operations. Archived responses (forms.archive) are read from their Parquet files
+# into the same frames, so analytics cover what the statistics count. Results are cached by
+# form version and by the responses' high-water mark (count and last update). With
+# FORMS_ANALYTICS_PARALLEL_ANSWERS set, a larger form is loaded by the process's one pool of
+# FORMS_ANALYTICS_WORKERS, one slice of its responses' creation time per worker; concurrent
+# requests queue for the same workers. Off by default: the frames travel back pickled, which on
+# one core made a 500k answers load 2.3x slower than reading it in the request.
+#------------------------------------------------------------------------------------------------------------#
+CHUNK_SIZE = 20000
+ANALYSES = ('crosstab', 'percentiles', 'correlations', 'trend')
+PERCENTILES = (5, 25, 50, 75, 95)
+RESPONSE_FIELDS = {'response': 'id', 'created_at': '_created_at', 'day': 'day_id', 'user': 'user_id'}
+ANSWER_FIELDS = {'response': 'response_id', 'question': 'question_id', 'option': 'option_id', 'value': 'value',
+                 'number': 'value_number'}
+
+
+def _responses(form_id, day=None, cohort=None, start=None, end=None):
+    responses = Response.objects.filter(form_id=form_id)
+    if day is not None:
+        responses = responses.filter(day_id=day)
+    if cohort is not None:
+        # imported here, forms loads before the user app's models
+        from user.models import GroupStudent
+        responses = responses.filter(user_id__in=GroupStudent.objects.filter(group_id=cohort).values('student_id'))
+    if start is not None:
+        responses = responses.filter(_created_at__gte=start)
+    if end is not None:
+        responses = responses.filter(_created_at__lt=end)
+    return responses
+
+
+def _stream(queryset, fields):
+    """``queryset`` as frames of CHUNK_SIZE rows, columns named by ``fields`` ({column: field})."""
+    rows = queryset.order_by().values_list(*fields.values()).iterator(chunk_size=CHUNK_SIZE)
+    while chunk := list(islice(rows, CHUNK_SIZE)):
+        yield pd.DataFrame.from_records(chunk, columns=list(fields))
+
+
+def _document_frames(documents):
+    # answers kept as documents (forms.documents) become the same rows, without typed numbers
+    rows = (
+        (response_id, UUID(question_id), UUID(answer['option']) if answer['option'] else None, answer['value'])
+        for response_id, document in documents
+        for question_id, answer in document_entries(document)
+    )
+    while chunk := list(islice(rows, CHUNK_SIZE)):
+        yield pd.DataFrame.from_records(chunk, columns=['response', 'question', 'option', 'value'])
+
+
+def _frames(response_frames, answer_frames):
+    return (
+        pd.concat(response_frames, ignore_index=True) if response_frames else pd.DataFrame(columns=list(RESPONSE_FIELDS)),
+        pd.concat(answer_frames, ignore_index=True).reindex(columns=list(ANSWER_FIELDS)) if answer_frames
+        else pd.DataFrame(columns=list(ANSWER_FIELDS)),
+    )
+
+
+def _load(form_id, filters, start=None, end=None):
+    responses = _responses(form_id, start=start, end=end, **filters)
+    response_frames = list(_stream(responses, RESPONSE_FIELDS))
+    answer_frames = list(_stream(Answer.objects.filter(response__in=responses), ANSWER_FIELDS))
+    documents = responses.filter(answers_document__isnull=False).values_list('id', 'answers_document')
+    answer_frames.extend(_document_frames(documents.iterator(chunk_size=CHUNK_SIZE)))
+    return _frames(response_frames, answer_frames)
+
+
+def _uuids(column):
+    return column.map(lambda value: None if value is None or value != value else UUID(value))
+
+
+def _load_archived(form_id, day=None, cohort=None):
+    """The form's archived responses as the frames of _load."""
+    filters = {'form_id': form_id}
+    if day is not None:
+        filters['day_id'] = day
+    if cohort is not None:
+        # imported here, forms loads before the user app's models
+        from user.models import GroupStudent
+        filters['user_id'] = list(GroupStudent.objects.filter(group_id=cohort).values_list('student_id', flat=True))
+        if not filters['user_id']:
+            return _frames([], [])
+
+    response_frames, answer_frames = [], []
+    for responses, answers in archived_frames(**filters):
+        response_frames.append(pd.DataFrame({
+            column: _uuids(responses[field]) if column != 'created_at' else responses[field]
+            for column, field in RESPONSE_FIELDS.items()
+        }))
+        if not answers.empty:
+            answer_frames.append(pd.DataFrame({
+                column: answers[field] if column in ('value', 'number') else _uuids(answers[field])
+                for column, field in ANSWER_FIELDS.items()
+            }))
+        documents = responses.loc[responses['answers_document'].notna(), ['id', 'answers_document']]
+        answer_frames.extend(_document_frames(
+            (UUID(response_id), json.loads(document)) for response_id, document in documents.itertuples(index=False)
+        ))
+    return _frames(response_frames, answer_frames)
+
+
+def _load_slice(arguments):
+    return _load(*arguments)
+
+
+def _workers():
+    return getattr(settings, 'FORMS_ANALYTICS_WORKERS', None) or os.cpu_count() or 1
+
+
+_pool, _pool_lock = None, threading.Lock()
+
+
+def _executor():
+    """The process pool shared by this process's requests, started on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawned workers set Django up and open their own connections, none inherited from here
+            _pool = ProcessPoolExecutor(max_workers=_workers(), mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=django.setup)
+        return _pool
+
+
+def _slices(form, filters, questions):
+    """Creation time ranges splitting the responses between the pool's workers; one range is no pool."""
+    threshold = getattr(settings, 'FORMS_ANALYTICS_PARALLEL_ANSWERS', 0)
+    bounds = _responses(form.pk, **filters).aggregate(count=Count('pk'), first=Min('_created_at'),
+                                                      last=Max('_created_at'))
+    # an estimate, counting answers would cost a scan of them
+    answers = bounds['count'] * max(questions, 1)
+    workers = min(_workers(), math.ceil(answers / threshold) if threshold else 1)
+    if workers <= 1 or bounds['first'] == bounds['last']:
+        return [(None, None)]
+    step = (bounds['last'] - bounds['first']) / workers
+    edges = [None, *(bounds['first'] + step * index for index in range(1, workers)), None]
+    return list(zip(edges, edges[1:]))
+
+
+def _load_parallel(form_id, filters, slices):
+    global _pool
+    try:
+        parts = list(_executor().map(_load_slice, [(form_id, filters, start, end) for start, end in slices]))
+    except BrokenProcessPool:
+        # a worker died (killed, out of memory); the next request starts a new pool
+        with _pool_lock:
+            _pool = None
+        return _load(form_id, filters)
+    return _frames([part[0] for part in parts], [part[1] for part in parts])
+
+
+def load_form_analytics(form, day=None, cohort=None):
+    questions = list(Question.objects.filter(form=form))
+    options = {option.pk: option.text for option in Option.objects.filter(question__form=form)}
+    filters = {'day': day, 'cohort': cohort}
+
+    slices = _slices(form, filters, len(questions))
+    if len(slices) == 1:
+        responses, answers = _load(form.pk, filters)
+    else:
+        responses, answers = _load_parallel(form.pk, filters, slices)
+    archived_responses, archived_answers = _load_archived(form.pk, **filters)
+    if not archived_responses.empty:
+        responses, answers = _frames([frame for frame in (responses, archived_responses) if not frame.empty],
+                                     [frame for frame in (answers, archived_answers) if not frame.empty])
+    return FormAnalytics(questions, options, responses, answers)
+
+
+#------------------------------------------------------------------------------------------------------------#
+def _table(frame):
+    # JSON friendly, without NaN
+    return {
+        'rows': [str(label) for label in frame.index],
+        'columns': [str(label) for label in frame.columns],
+        'values': frame.astype(object).where(frame.notna(), None).values.tolist(),
+    }
+
+
+class FormAnalytics:
+    def __init__(self, questions, options, responses, answers):
+        self.questions = {question.pk: question for question in questions}
+        answers = answers[answers['question'].isin(self.questions.keys())]
+        types = answers['question'].map({pk: question.question_type for pk, question in self.questions.items()})
+        numeric, choice = types.isin(NUMERIC_TYPES), types.isin(CHOICE_TYPES)
+
+        # document answers have no typed column, their numbers are parsed here
+        numbers = pd.to_numeric(answers['number'], errors='coerce')
+        numbers = numbers.fillna(pd.to_numeric(answers['value'], errors='coerce'))
+        answers = answers.assign(
+            number=numbers.where(numeric),
+            label=answers['option'].map(options).where(choice, answers['value'].where(~numeric, numbers)),
+        )
+        self.answers = answers
+        self.responses = responses.set_index('response')
+        self.numbers = self.answers[numeric].pivot_table(index='response', columns='question', values='number',
+                                                          aggfunc='first')
+
+    def _question(self, question_id, types=None):
+        question = self.questions.get(question_id)
+        if question is None or (types is not None and question.question_type not in types):
+            return None
+        return question
+
+    def _labels(self, question_id):
+        return self.answers.loc[self.answers['question'] == question_id, ['response', 'label']].dropna()
+
+    def _days(self):
+        created_at = pd.to_datetime(self.responses['created_at'], utc=True).dt.tz_convert(settings.TIME_ZONE)
+        return created_at.dt.date.rename('day')
+
+    def crosstab(self, question_id, by_id):
+        """Answer counts of ``question_id`` against ``by_id``, over the responses answering both."""
+        if self._question(question_id) is None or self._question(by_id) is None:
+            return None
+        pairs = self._labels(question_id).merge(self._labels(by_id), on='response', suffixes=('', '_by'))
+        return _table(pd.crosstab(pairs['label'], pairs['label_by']))
+
+    def percentiles(self, question_id):
+        if self._question(question_id, NUMERIC_TYPES) is None:
+            return None
+        values = self.numbers[question_id].dropna().to_numpy() if question_id in self.numbers else np.array([])
+        if not values.size:
+            return {'count': 0, 'mean': None, 'std': None, 'percentiles': {}}
+        return {
+            'count': int(values.size),
+            'mean': float(values.mean()),
+            'std': float(values.std()),
+            'percentiles': dict(zip(map(str, PERCENTILES), np.percentile(values, PERCENTILES).tolist())),
+        }
+
+    def correlations(self):
+        """Pearson correlations between the numeric questions, over the responses answering both."""
+        return _table(self.numbers.corr())
+
+    def trend(self, question_id=None):
+        """Responses per day; with a question, its daily mean (numeric) or answer counts (others)."""
+        days = self._days()
+        if question_id is None:
+            return _table(days.value_counts().sort_index().to_frame('responses'))
+        question = self._question(question_id)
+        if question is None:
+            return None
+        if question.question_type in NUMERIC_TYPES:
+            values = self.numbers[question_id] if question_id in self.numbers else pd.Series(dtype=float)
+            daily = pd.concat([days, values.rename('value')], axis=1, join='inner').groupby('day')['value']
+            return _table(daily.agg(['count', 'mean', 'median']))
+        labels = self._labels(question_id).join(days, on='response')
+        return _table(pd.crosstab(labels['day'], labels['label']))
+
+
+def analyze(form, analysis, question=None, by=None, day=None, cohort=None):
+    """The result of one of ANALYSES of ``form``, cached until the form or its responses change."""
+    high_water = Response.objects.filter(form=form).aggregate(count=Count('pk'), last=Max('_updated_at'))
+    key = 'form_analytics:{}:v{}:{}'.format(form.pk, form.version, make_etag(
+        high_water['count'], high_water['last'], analysis, question, by, day, cohort))
+    result = cache.get(key)
+    if result is not None:
+        return result
+
+    engine = load_form_analytics(form, day=day, cohort=cohort)
+    if analysis == 'crosstab':
+        result = engine.crosstab(question, by)
+    elif analysis == 'percentiles':
+        result = engine.percentiles(question)
+    elif analysis == 'correlations':
+        result = engine.correlations()
+    else:
+        result = engine.trend(question)
+    if result is not None:
+        cache.set(key, result, getattr(settings, 'FORMS_ANALYTICS_CACHE_TIMEOUT', 60 * 60 * 24))
+    return result
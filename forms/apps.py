@@ -4,4 +4,7 @@ from django.apps import AppConfig
 class FormsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'forms'
-    verbose_name = "3-form"
\ No newline at end of file
+    verbose_name = "3-form"
+
+    def ready(self):
+        from forms import signals  # noqa: F401
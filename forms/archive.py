@@ -0,0 +1,368 @@
+import heapq
+import json
+import math
+import os
+from datetime import datetime
+from itertools import islice
+from uuid import UUID
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, models, transaction
+from django.utils import timezone
+
+from utils.identifiers import uuid7_time
+from utils.partitions import add_months, month_start
+from .models import Answer, Form, Response
+
+#------------------------------------------------------------------------------------------------------------#
+# Cold archive
+#
+# Whole months of responses older than FORMS_ARCHIVE_AFTER_MONTHS are moved out of PostgreSQL
+# into zstd-compressed Parquet files, FORMS_ARCHIVE_DIR/{responses,answers}/YYYY-MM.parquet
+# (months in TIME_ZONE, like the table partitions). read_archived_responses turns them back into
+# unsaved Response instances with their answers attached, so serializers render them unchanged.
+# The archive is read-only: archived responses can be listed, retrieved and exported only.
+#
+# A month is written ROW_GROUP_SIZE responses at a time, one Parquet row group each, so it is
+# never held in memory whole. FORMS_ARCHIVE_DIR/index.parquet maps every archived response id
+# to its month, sorted by id so a lookup reads one row group; find_archived_response tries the
+# month of a uuid7 id first and only reads the index for other ids, or when that misses
+# (archive_responses --reindex builds it for months archived before it existed).
+#------------------------------------------------------------------------------------------------------------#
+# derived columns that are not worth keeping cold
+SKIPPED_FIELDS = ('search_vector',)
+COMPRESSION = 'zstd'
+ROW_GROUP_SIZE = 10000
+# Parquet types of the model fields (by internal type, of the target for foreign keys); others are strings
+ARROW_TYPES = {
+    'DateTimeField': pa.timestamp('ns', tz='UTC'),
+    'DateField': pa.date32(),
+    'BooleanField': pa.bool_(),
+    'FloatField': pa.float64(),
+    'IntegerField': pa.int64(),
+    'BigIntegerField': pa.int64(),
+    'PositiveIntegerField': pa.int64(),
+    'SmallIntegerField': pa.int64(),
+}
+INDEX_SCHEMA = pa.schema([('id', pa.string()), ('month', pa.string())])
+
+
+def archive_dir():
+    return getattr(settings, 'FORMS_ARCHIVE_DIR', os.path.join(settings.BASE_DIR, 'var', 'archive'))
+
+
+def _path(kind, month):
+    return os.path.join(archive_dir(), kind, f'{month:%Y-%m}.parquet')
+
+
+def archived_months():
+    directory = os.path.join(archive_dir(), 'responses')
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        timezone.make_aware(datetime.strptime(name[:-len('.parquet')], '%Y-%m'))
+        for name in os.listdir(directory) if name.endswith('.parquet')
+    )
+
+
+def _fields(model):
+    return [field for field in model._meta.concrete_fields if field.name not in SKIPPED_FIELDS]
+
+
+def _schema(model):
+    return pa.schema([
+        (field.attname, ARROW_TYPES.get((field.target_field if field.is_relation else field).get_internal_type(), pa.string()))
+        for field in _fields(model)
+    ])
+
+
+def _cell(field, value):
+    if value is None:
+        return None
+    if isinstance(field, models.JSONField):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    # uuids have no Parquet type
+    return str(value) if isinstance(value, UUID) else value
+
+
+def _batch(model, schema, rows):
+    columns = list(zip(*rows)) if rows else [()] * len(schema)
+    return pa.RecordBatch.from_arrays([
+        pa.array([_cell(field, value) for value in column], type=schema.field(field.attname).type)
+        for field, column in zip(_fields(model), columns)
+    ], schema=schema)
+
+
+class _MonthWriter:
+    """
+    Writes the new rows of a month's file batch by batch, then, on close, the rows of the file it
+    replaces that were not written again (a month archived again, for rows that arrived late).
+    """
+
+    def __init__(self, kind, month, model):
+        self.path, self.model, self.schema = _path(kind, month), model, _schema(model)
+        self.temporary = f'{self.path}.tmp'
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.writer = pq.ParquetWriter(self.temporary, self.schema, compression=COMPRESSION)
+        self.ids = set()
+
+    def write(self, rows):
+        if rows:
+            self.writer.write_batch(_batch(self.model, self.schema, rows), row_group_size=ROW_GROUP_SIZE)
+            self.ids.update(str(row[0]) for row in rows)
+
+    def close(self):
+        if os.path.exists(self.path):
+            for batch in pq.ParquetFile(self.path).iter_batches(batch_size=ROW_GROUP_SIZE):
+                table = pa.Table.from_batches([batch]).select(self.schema.names).cast(self.schema)
+                kept = table.filter(pc.invert(pc.is_in(table['id'], pa.array(self.ids, pa.string()))))
+                if kept.num_rows:
+                    self.writer.write_table(kept, row_group_size=ROW_GROUP_SIZE)
+        self.writer.close()
+        os.replace(self.temporary, self.path)
+
+    def discard(self):
+        self.writer.close()
+        os.remove(self.temporary)
+
+
+def _index_path():
+    return os.path.join(archive_dir(), 'index.parquet')
+
+
+def _index_rows(path, skipped):
+    if not os.path.exists(path):
+        return
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=ROW_GROUP_SIZE):
+        for pk, month in zip(batch.column('id').to_pylist(), batch.column('month').to_pylist()):
+            if pk not in skipped:
+                yield pk, month
+
+
+def _update_index(ids, month):
+    """Merge the ``ids`` archived in ``month`` into the sorted id index, a row group at a time."""
+    path, label = _index_path(), f'{month:%Y-%m}'
+    temporary = f'{path}.tmp'
+    rows = heapq.merge(_index_rows(path, ids), ((pk, label) for pk in sorted(ids)))
+    with pq.ParquetWriter(temporary, INDEX_SCHEMA, compression=COMPRESSION) as writer:
+        while chunk := list(islice(rows, ROW_GROUP_SIZE)):
+            writer.write_table(pa.Table.from_pylist([{'id': pk, 'month': month} for pk, month in chunk], INDEX_SCHEMA))
+    os.replace(temporary, path)
+
+
+def index_archived_month(month):
+    """Add the ids of an archived month to the id index (for months archived before it existed)."""
+    ids = set()
+    for batch in pq.ParquetFile(_path('responses', month)).iter_batches(batch_size=ROW_GROUP_SIZE, columns=['id']):
+        ids.update(batch.column('id').to_pylist())
+    _update_index(ids, month)
+    return len(ids)
+
+
+def archive_month(month):
+    """Move the responses created in ``month`` and their answers to the archive; returns their count."""
+    end = add_months(month, 1)
+    response_columns = [field.attname for field in _fields(Response)]
+    answer_columns = [field.attname for field in _fields(Answer)]
+    with transaction.atomic():
+        responses = Response.objects.filter(_created_at__gte=month, _created_at__lt=end).order_by('pk')
+        if not responses.exists():
+            return 0
+        response_writer, answer_writer = _MonthWriter('responses', month, Response), _MonthWriter('answers', month, Answer)
+        try:
+            rows = responses.values_list(*response_columns).iterator(chunk_size=ROW_GROUP_SIZE)
+            while chunk := list(islice(rows, ROW_GROUP_SIZE)):
+                ids = [row[0] for row in chunk]
+                answer_writer.write(list(Answer.objects.filter(response_id__in=ids).values_list(*answer_columns)))
+                response_writer.write(chunk)
+                # exactly the rows written, not whatever arrived for that month meanwhile
+                with connection.cursor() as cursor:
+                    cursor.execute(f"DELETE FROM {Answer._meta.db_table} WHERE response_id = ANY(%s::uuid[])", [ids])
+                    cursor.execute(f"DELETE FROM {Response._meta.db_table} WHERE id = ANY(%s::uuid[])", [ids])
+        except BaseException:
+            response_writer.discard()
+            answer_writer.discard()
+            raise
+        # answers first: a month is listed by its responses file
+        answer_writer.close()
+        response_writer.close()
+        _update_index(response_writer.ids, month)
+    return len(response_writer.ids)
+
+
+#------------------------------------------------------------------------------------------------------------#
+def _blank(value):
+    return value is None or value is pd.NaT or (isinstance(value, float) and math.isnan(value))
+
+
+def _instances(model, frame):
+    fields = {field.attname: field for field in _fields(model)}
+    instances = []
+    for record in frame.to_dict('records'):
+        values = {}
+        for attname, value in record.items():
+            field = fields.get(attname)
+            if field is None:
+                continue
+            if _blank(value):
+                value = None
+            elif isinstance(field, models.JSONField):
+                value = json.loads(value)
+            else:
+                if isinstance(value, pd.Timestamp):
+                    value = value.to_pydatetime()
+                value = field.to_python(value)
+            values[attname] = value
+        instance = model(**values)
+        instance._state.adding = False
+        instance._state.db = 'default'
+        instances.append(instance)
+    return instances
+
+
+def _read(kind, month, filters):
+    path = _path(kind, month)
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_parquet(path, filters=filters or None)
+
+
+def _timestamp(value):
+    # the column is stored as UTC nanoseconds, and arrow compares only identical timestamp types
+    return pd.Timestamp(value).tz_convert('UTC').as_unit('ns')
+
+
+def archived_frames(start=None, end=None, **filters):
+    """
+    (responses, answers) frames, month by month, of the archived responses created in
+    [start, end) (either may be None) whose columns equal ``filters`` (attname: value, or a list
+    of values). Columns are the models' attnames, ids as strings.
+    """
+    conditions = [
+        (attname, 'in', [str(item) for item in value]) if isinstance(value, (list, tuple, set)) else (attname, '==', str(value))
+        for attname, value in filters.items()
+    ]
+    if start is not None:
+        conditions.append(('_created_at', '>=', _timestamp(start)))
+    if end is not None:
+        conditions.append(('_created_at', '<', _timestamp(end)))
+
+    for month in archived_months():
+        if (start is not None and add_months(month, 1) <= start) or (end is not None and month >= end):
+            continue
+        frames = _month_frames(month, conditions)
+        if frames is not None:
+            yield frames
+
+
+def _month_frames(month, conditions):
+    response_frame = _read('responses', month, conditions)
+    if response_frame.empty:
+        return None
+    return response_frame, _read('answers', month, [('response_id', 'in', list(response_frame['id']))])
+
+
+def _responses(frames):
+    responses = []
+    for response_frame, answer_frame in frames:
+        month_responses = _instances(Response, response_frame)
+        answers = {}
+        for answer in _instances(Answer, answer_frame):
+            answers.setdefault(answer.response_id, []).append(answer)
+        for response in month_responses:
+            _attach_answers(response, answers.get(response.pk, []))
+        responses.extend(month_responses)
+
+    forms = Form.objects.in_bulk({response.form_id for response in responses if response.form_id})
+    for response in responses:
+        if response.form_id in forms:
+            response.form = forms[response.form_id]
+    return responses
+
+
+def read_archived_responses(start=None, end=None, **filters):
+    """
+    Archived responses created in [start, end) (either may be None) whose columns equal
+    ``filters`` (attname: value, or a list of values), with answers attached.
+    """
+    return _responses(archived_frames(start, end, **filters))
+
+
+def _attach_answers(response, answers):
+    # what prefetch_related would leave behind, so response.answers.all() needs no query
+    for answer in answers:
+        answer.response = response
+    queryset = response.answers.all()
+    queryset._result_cache = answers
+    queryset._prefetch_done = True
+    response._prefetched_objects_cache = {'answers': queryset}
+
+
+def _indexed_month(pk):
+    path = _index_path()
+    if not os.path.exists(path):
+        return None
+    months = pq.read_table(path, columns=['month'], filters=[('id', '==', pk)]).column('month').to_pylist()
+    return timezone.make_aware(datetime.strptime(months[0], '%Y-%m')) if months else None
+
+
+def _find_in_month(month, pk):
+    frames = _month_frames(month, [('id', '==', pk)])
+    return _responses([frames])[0] if frames is not None else None
+
+
+def find_archived_response(pk):
+    """The archived response ``pk``, read from its month's file only, or None."""
+    try:
+        pk = str(UUID(str(pk)))
+    except ValueError:
+        return None
+    # a uuid7 id is made with its response, its month is almost always the response's
+    created = uuid7_time(pk)
+    guess = month_start(created) if created is not None else None
+    if guess is not None:
+        response = _find_in_month(guess, pk)
+        if response is not None:
+            return response
+    month = _indexed_month(pk)
+    return _find_in_month(month, pk) if month is not None and month != guess else None
+
+
+class MergedResponses:
+    """
+    Database responses (a queryset) and archived ones as one sequence in ``ordering``, for the
+    paginator: a page reads its offset + limit first rows from each source, not all of them.
+    """
+
+    def __init__(self, queryset, archived, ordering):
+        self.field, self.reverse = ordering.lstrip('-'), ordering.startswith('-')
+        self.queryset = queryset.order_by(ordering, 'pk')
+        self.archived = sorted(archived, key=self._key, reverse=self.reverse)
+
+    def _key(self, response):
+        return getattr(response, self.field)
+
+    def _merge(self, queryset, archived):
+        return heapq.merge(queryset, archived, key=self._key, reverse=self.reverse)
+
+    def count(self):
+        return self.queryset.count() + len(self.archived)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        return self._merge(self.queryset.iterator(), self.archived)
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            raise TypeError("MergedResponses only supports slicing.")
+        if index.stop is None:
+            return list(islice(self, index.start, None))
+        return list(islice(self._merge(self.queryset[:index.stop], self.archived[:index.stop]),
+                           index.start, index.stop))
@@ -0,0 +1,65 @@
+from uuid import UUID
+
+from django.conf import settings
+
+from .models import Answer
+
+#------------------------------------------------------------------------------------------------------------#
+# Answer documents
+#
+# In the 'document' storage mode (FORMS_ANSWER_STORAGE) a response keeps all of its answers in
+# Response.answers_document, one JSONB value keyed by question id, with the answers to each
+# question listed (a CHECKBOX answer has one per option, like its rows):
+#
+#     {"<question id>": [{"value": "...", "option": "<option id>" | null}, ...], ...}
+#
+# instead of answers rows. The GIN index on the column serves has_key and contains lookups,
+# e.g. answers_document__contains={question_id: [{'option': option_id}]}. Documents written
+# before answers were listed hold a single {"value", "option"} object per question; they are
+# read as a list of one. Responses stored before the switch keep their rows until
+# migrate_answer_documents moves them.
+#------------------------------------------------------------------------------------------------------------#
+def uses_answer_document():
+    return getattr(settings, 'FORMS_ANSWER_STORAGE', 'rows') == 'document'
+
+
+def _id(value):
+    value = getattr(value, 'pk', value)
+    return None if value is None else str(value)
+
+
+def build_answer_document(answers):
+    """Document for answer dicts holding question/option instances or ids."""
+    document = {}
+    for answer in answers:
+        document.setdefault(_id(answer['question']), []).append(
+            {'value': answer.get('value'), 'option': _id(answer.get('option'))}
+        )
+    return document
+
+
+def document_entries(document):
+    """(question id, {"value", "option"}) pairs of an answers document, in either layout."""
+    for question_id, answers in document.items():
+        for answer in answers if isinstance(answers, list) else [answers]:
+            yield question_id, answer
+
+
+def document_answers(response):
+    """Unsaved Answer instances for the document of ``response``, for serializers."""
+    return [
+        Answer(
+            response=response,
+            question_id=UUID(question_id),
+            option_id=UUID(answer['option']) if answer['option'] else None,
+            value=answer['value'],
+        )
+        for question_id, answer in document_entries(response.answers_document)
+    ]
+
+
+def stored_answers(response):
+    """The answers of ``response`` in whichever storage it was written with."""
+    if response.answers_document is not None:
+        return document_answers(response)
+    return list(response.answers.all())
@@ -0,0 +1,302 @@
+import fcntl
+import json
+import logging
+import os
+import socket
+from contextlib import contextmanager
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
+from redis.exceptions import ResponseError
+
+from .models import Response
+from .submissions import build_submission, check_submission, store_submissions
+
+#------------------------------------------------------------------------------------------------------------#
+# Buffered submission ingestion
+#
+# For the form types in FORMS_ASYNC_INGESTION_TYPES, ResponseViewSet.create only validates a
+# submission, appends it to a durable queue and answers 202 with a receipt id. A Celery task
+# drains the queue and inserts Response/Answer rows in batches of FORMS_INGESTION_BATCH_SIZE.
+# The receipt id becomes the response id, so an entry delivered twice is only stored once.
+# An entry that cannot be stored (malformed, refused by the database) is rejected and
+# acknowledged with its batch; a batch that fails as a whole (database unreachable) is handed
+# out again, and an entry delivered FORMS_INGESTION_MAX_DELIVERIES times is moved to the
+# queue's dead letters instead, so nothing blocks the entries behind it.
+#------------------------------------------------------------------------------------------------------------#
+logger = logging.getLogger(__name__)
+
+QUEUED, STORED, REJECTED = 'queued', 'stored', 'rejected'
+RECEIPT_TIMEOUT = getattr(settings, 'FORMS_INGESTION_RECEIPT_TIMEOUT', 60 * 60 * 24)
+DRAIN_SCHEDULED_KEY = 'forms:ingestion:drain_scheduled'
+DRAIN_LOCK_KEY = 'forms:ingestion:draining'
+DRAIN_LOCK_TIMEOUT = 60 * 5
+
+
+class RedisStreamQueue:
+    """Redis stream read through a consumer group; entries are deleted once acknowledged."""
+    stream = 'forms:submissions'
+    dead_stream = 'forms:submissions:dead'
+    dead_maxlen = 100000
+    group = 'forms-ingestion'
+    # entries read by a worker that died are handed out again after this long
+    claim_idle_ms = 60 * 1000
+
+    def __init__(self):
+        self.redis = get_redis_connection("default")
+        self.consumer = f'{socket.gethostname()}-{os.getpid()}'
+
+    def _ensure_group(self):
+        try:
+            self.redis.xgroup_create(self.stream, self.group, id='0', mkstream=True)
+        except ResponseError as error:
+            if 'BUSYGROUP' not in str(error):
+                raise
+
+    def append(self, entry):
+        self.redis.xadd(self.stream, {'entry': json.dumps(entry, cls=DjangoJSONEncoder)})
+
+    def read(self, count):
+        """Up to ``count`` (message id, entry or None if unreadable, times delivered) triples."""
+        self._ensure_group()
+        _, claimed, *_ = self.redis.xautoclaim(
+            self.stream, self.group, self.consumer, self.claim_idle_ms, start_id='0-0', count=count)
+        claimed = [message for message in claimed if message[1]]
+        deliveries = {}
+        if claimed:
+            deliveries = {pending['message_id']: pending['times_delivered'] for pending in self.redis.xpending_range(
+                self.stream, self.group, min=claimed[0][0], max=claimed[-1][0], count=count, consumername=self.consumer)}
+        messages = [(message_id, fields, deliveries.get(message_id, 2)) for message_id, fields in claimed]
+        if len(messages) < count:
+            for _, new_messages in self.redis.xreadgroup(
+                    self.group, self.consumer, {self.stream: '>'}, count=count - len(messages)) or []:
+                messages.extend((message_id, fields, 1) for message_id, fields in new_messages)
+        return [(message_id, _loads(fields.get(b'entry')), delivered) for message_id, fields, delivered in messages]
+
+    def ack(self, message_ids):
+        if message_ids:
+            self.redis.xack(self.stream, self.group, *message_ids)
+            self.redis.xdel(self.stream, *message_ids)
+
+    def dead_letter(self, messages, error):
+        """Move (message id, entry) pairs to the dead letter stream."""
+        for _, entry in messages:
+            self.redis.xadd(self.dead_stream, {'entry': json.dumps(entry, cls=DjangoJSONEncoder), 'error': error},
+                            maxlen=self.dead_maxlen, approximate=True)
+        self.ack([message_id for message_id, _ in messages])
+
+
+class FileQueue:
+    """
+    Local stand-in for RedisStreamQueue (tests, single host development): one JSON line per
+    entry, with its message id and how often it was read; dead letters go to <path>.dead.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or getattr(settings, 'FORMS_INGESTION_FILE', 'submissions.jsonl')
+        self.dead_path = f'{self.path}.dead'
+
+    @contextmanager
+    def _locked(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with open(self.path, 'a+', encoding='utf-8') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield file
+                file.flush()
+                os.fsync(file.fileno())
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _messages(file):
+        file.seek(0)
+        return [json.loads(line) for line in file if line.strip()]
+
+    @staticmethod
+    def _rewrite(file, messages):
+        file.seek(0)
+        file.truncate()
+        file.writelines(json.dumps(message, cls=DjangoJSONEncoder) + '\n' for message in messages)
+
+    def append(self, entry):
+        with self._locked() as file:
+            file.write(json.dumps({'message': uuid4().hex, 'deliveries': 0, 'entry': entry}, cls=DjangoJSONEncoder) + '\n')
+
+    def read(self, count):
+        with self._locked() as file:
+            messages = self._messages(file)
+            for message in messages[:count]:
+                message['deliveries'] += 1
+            self._rewrite(file, messages)
+        return [(message['message'], message['entry'], message['deliveries']) for message in messages[:count]]
+
+    def ack(self, message_ids):
+        message_ids = set(message_ids)
+        with self._locked() as file:
+            self._rewrite(file, [message for message in self._messages(file) if message['message'] not in message_ids])
+
+    def dead_letter(self, messages, error):
+        with open(self.dead_path, 'a', encoding='utf-8') as file:
+            file.writelines(json.dumps({'entry': entry, 'error': error}, cls=DjangoJSONEncoder) + '\n'
+                            for _, entry in messages)
+        self.ack([message_id for message_id, _ in messages])
+
+
+def _loads(data):
+    try:
+        return json.loads(data)
+    except (TypeError, ValueError):
+        return None
+
+
+def get_submission_queue():
+    return import_string(getattr(settings, 'FORMS_INGESTION_QUEUE', 'forms.ingestion.RedisStreamQueue'))()
+
+
+#---------- receipts -----------------
+def _receipt_key(receipt):
+    return f'forms:ingestion:receipt:{receipt}'
+
+
+def _set_receipts(receipts, status, errors=None):
+    cache.set_many({
+        _receipt_key(receipt): {'receipt': receipt, 'user': str(user_id), 'status': status, 'errors': errors}
+        for receipt, user_id in receipts
+    }, RECEIPT_TIMEOUT)
+
+
+def _record_receipts(entries, failed):
+    # entries are stored (or not) whatever happens here; a receipt left "queued" is looked up below
+    try:
+        _set_receipts([_receipt_of(entry) for entry in entries
+                       if _receipt_of(entry) and entry['id'] not in failed], STORED)
+        for entry in entries:
+            if _receipt_of(entry) and entry['id'] in failed:
+                _set_receipts([_receipt_of(entry)], REJECTED, errors=[failed[entry['id']]])
+    except Exception:
+        logger.exception("Could not record the receipts of %s submissions", len(entries))
+
+
+def _receipt_of(entry):
+    return (entry['id'], entry.get('user')) if isinstance(entry, dict) and isinstance(entry.get('id'), str) else None
+
+
+def get_receipt(receipt):
+    """Outcome of a queued submission: receipt, user, status, response and errors; None if unknown."""
+    data = cache.get(_receipt_key(receipt))
+    if data is None or data['status'] == QUEUED:
+        # the receipt expired, or its update was lost; the response id is the receipt id
+        user_id = Response.objects.filter(pk=receipt).values_list('user_id', flat=True).first()
+        if user_id is not None:
+            data = {'receipt': receipt, 'user': str(user_id), 'status': STORED, 'errors': None}
+    if data is None:
+        return None
+    data['response'] = data['receipt'] if data['status'] == STORED else None
+    return data
+
+
+#---------- submit -----------------
+def uses_async_ingestion(form):
+    return form.type in getattr(settings, 'FORMS_ASYNC_INGESTION_TYPES', ())
+
+
+def enqueue_submission(validated_data, user):
+    """Queue validated ResponseSerializer data for ``user`` and return its receipt id."""
+    entry = build_submission(validated_data, user)
+    receipt = entry['id']
+
+    # before appending, so a fast drain is never overwritten with "queued"
+    _set_receipts([(receipt, user.pk)], QUEUED)
+    try:
+        get_submission_queue().append(entry)
+    except Exception:
+        cache.delete(_receipt_key(receipt))
+        raise
+    schedule_drain()
+    return receipt
+
+
+def schedule_drain():
+    # leading edge: one drain per FORMS_INGESTION_DRAIN_DELAY window, so entries arriving
+    # meanwhile are stored by the same batch
+    delay = getattr(settings, 'FORMS_INGESTION_DRAIN_DELAY', 2)
+    if cache.add(DRAIN_SCHEDULED_KEY, 1, delay):
+        from .tasks import drain_submission_queue
+        drain_submission_queue.apply_async(countdown=delay)
+
+
+#---------- drain -----------------
+def _ingest(entries):
+    # malformed entries are rejected as they are, the others stored
+    failed, valid = {}, []
+    for entry in entries:
+        error = check_submission(entry)
+        if error is None:
+            valid.append(entry)
+        elif _receipt_of(entry):
+            failed[entry['id']] = error
+
+    # entries redelivered after a worker stored them but died before acknowledging
+    stored = set(Response.objects.filter(pk__in=[entry['id'] for entry in valid]).values_list('pk', flat=True))
+    pending = [entry for entry in valid if UUID(entry['id']) not in stored]
+
+    failed.update(store_submissions(pending))
+    _record_receipts(entries, failed)
+    return len(pending)
+
+
+def _dead_letter(queue, messages, max_deliveries):
+    valid = [entry['id'] for _, entry in messages if check_submission(entry) is None]
+    stored = set(Response.objects.filter(pk__in=valid).values_list('pk', flat=True))
+    done, dead = [], []
+    for message_id, entry in messages:
+        if check_submission(entry) is None and UUID(entry['id']) in stored:
+            # stored by a worker that died before acknowledging
+            done.append(message_id)
+        else:
+            dead.append((message_id, entry))
+    queue.ack(done)
+    if dead:
+        error = f"Not stored after {max_deliveries} deliveries."
+        _record_receipts([entry for _, entry in dead], {entry['id']: error for _, entry in dead if _receipt_of(entry)})
+        queue.dead_letter(dead, error)
+
+
+def drain_submissions(batch_size=None, max_batches=100):
+    """Store queued submissions in batches, returns how many entries were processed."""
+    if not cache.add(DRAIN_LOCK_KEY, 1, DRAIN_LOCK_TIMEOUT):
+        return 0
+
+    batch_size = batch_size or getattr(settings, 'FORMS_INGESTION_BATCH_SIZE', 500)
+    max_deliveries = getattr(settings, 'FORMS_INGESTION_MAX_DELIVERIES', 5)
+    queue = get_submission_queue()
+    processed = 0
+    try:
+        for _ in range(max_batches):
+            messages = queue.read(batch_size)
+            if not messages:
+                break
+            exhausted = [(message_id, entry) for message_id, entry, deliveries in messages if deliveries > max_deliveries]
+            messages = [(message_id, entry) for message_id, entry, deliveries in messages if deliveries <= max_deliveries]
+            if exhausted:
+                _dead_letter(queue, exhausted, max_deliveries)
+                processed += len(exhausted)
+            try:
+                _ingest([entry for _, entry in messages])
+            except Exception:
+                # e.g. the database is unreachable: the batch is handed out again later, up to
+                # FORMS_INGESTION_MAX_DELIVERIES times
+                logger.exception("Could not store a batch of %s submissions", len(messages))
+                break
+            queue.ack([message_id for message_id, _ in messages])
+            processed += len(messages)
+            # held for as long as batches keep coming, a second drain would read the same entries
+            cache.touch(DRAIN_LOCK_KEY, DRAIN_LOCK_TIMEOUT)
+    finally:
+        cache.delete(DRAIN_LOCK_KEY)
+    return processed
@@ -0,0 +1,155 @@
+import asyncio
+import json
+import logging
+from uuid import uuid4
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+
+from .models import AnswerStatistic, Form, ResponseCount
+from .statistics import bucket_bounds, form_statistics
+
+#------------------------------------------------------------------------------------------------------------#
+# Live form results
+#
+# Admins open ws/forms/<form id>/results/ and get a snapshot of the form's response count and
+# statistics (forms.statistics), then deltas of both as responses come in. Writers only say
+# "results of this form changed" to the form's group, at most once per FORMS_LIVE_WINDOW
+# seconds (a cache key shared by all processes). A consumer receiving that waits for the end of
+# the window and sends what changed: a burst of a thousand submissions is a message per window,
+# not a thousand broadcasts. The summary rows (forms.statistics) are read once per window and
+# form, by the first consumer to get there; the others take its read from the cache.
+#------------------------------------------------------------------------------------------------------------#
+logger = logging.getLogger(__name__)
+
+CLOSE_FORBIDDEN = 4403
+CLOSE_NOT_FOUND = 4404
+STATE_TIMEOUT = 60
+
+
+def _window():
+    return getattr(settings, 'FORMS_LIVE_WINDOW', 1.0)
+
+
+def group_name(form_id):
+    return f'form_results.{form_id}'
+
+
+def _notify(form_id):
+    # the first change of a window announces it, the consumers pick up the rest when it ends
+    key = f'form_live_pending:{form_id}'
+    flush = uuid4().hex
+    if not cache.add(key, flush, _window()):
+        return
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    try:
+        async_to_sync(channel_layer.group_send)(group_name(form_id), {'type': 'results.changed', 'flush': flush})
+    except Exception:
+        # the responses are committed already; live results only miss this window, the next change announces again
+        cache.delete(key)
+        logger.exception("Could not announce changed results of form %s", form_id)
+
+
+def notify_results(*form_ids):
+    """Tell live results subscribers of ``form_ids`` that responses changed, once committed."""
+    for form_id in set(form_ids) - {None}:
+        transaction.on_commit(lambda form_id=form_id: _notify(form_id), robust=True)
+
+
+def results_state(form_id):
+    """Response count and {(question, option, bucket): count} of the form's statistics."""
+    statistics = AnswerStatistic.objects.filter(question__form_id=form_id).values_list(
+        'question_id', 'option_id', 'bucket', 'count')
+    return {
+        'responses': ResponseCount.objects.filter(form_id=form_id).values_list('count', flat=True).first() or 0,
+        'statistics': {(question_id, option_id, bucket): count
+                       for question_id, option_id, bucket, count in statistics},
+    }
+
+
+def flushed_results_state(form_id, flush):
+    """results_state of the form for the window announced as ``flush``, read once for all consumers."""
+    if flush is None:
+        return results_state(form_id)
+    key = f'form_live_state:{form_id}:{flush}'
+    state = cache.get(key)
+    if state is None:
+        state = results_state(form_id)
+        cache.set(key, state, STATE_TIMEOUT)
+    return state
+
+
+def results_delta(previous, current):
+    """The message for the change from ``previous`` to ``current`` results_state, None if equal."""
+    changed = []
+    for key in previous['statistics'].keys() | current['statistics'].keys():
+        count = current['statistics'].get(key, 0)
+        delta = count - previous['statistics'].get(key, 0)
+        if delta:
+            question_id, option_id, bucket = key
+            change = {'question': question_id, 'option': option_id, 'count': count, 'delta': delta}
+            if bucket is not None:
+                change['from'], change['to'] = bucket_bounds(bucket)
+            changed.append(change)
+    if not changed and current['responses'] == previous['responses']:
+        return None
+    return {
+        'type': 'delta',
+        'responses': current['responses'],
+        'responses_delta': current['responses'] - previous['responses'],
+        'statistics': changed,
+    }
+
+
+class FormResultsConsumer(AsyncJsonWebsocketConsumer):
+    async def connect(self):
+        self.form_id, self.state, self.flush = None, None, None
+        user = self.scope.get('user')
+        if not getattr(user, 'is_authenticated', False) or user.role not in ['superuser', 'admin']:
+            await self.close(code=CLOSE_FORBIDDEN)
+            return
+        form = await database_sync_to_async(Form.objects.filter(pk=self.scope['url_route']['kwargs']['form_id']).first)()
+        if form is None:
+            await self.close(code=CLOSE_NOT_FOUND)
+            return
+
+        self.form_id = form.pk
+        await self.channel_layer.group_add(group_name(self.form_id), self.channel_name)
+        await self.accept()
+        self.state, statistics = await database_sync_to_async(self._snapshot)(form)
+        await self.send_json({'type': 'snapshot', 'responses': self.state['responses'], 'statistics': statistics})
+
+    def _snapshot(self, form):
+        return results_state(form.pk), form_statistics(form)
+
+    async def disconnect(self, code):
+        if self.form_id is not None:
+            await self.channel_layer.group_discard(group_name(self.form_id), self.channel_name)
+        if self.flush is not None:
+            self.flush.cancel()
+
+    async def results_changed(self, event):
+        # one pending flush per window, later announcements are already covered by it
+        if self.flush is None and self.state is not None:
+            self.flush = asyncio.create_task(self._flush(event.get('flush')))
+
+    async def _flush(self, flush):
+        await asyncio.sleep(_window())
+        self.flush = None
+        state = await database_sync_to_async(flushed_results_state)(self.form_id, flush)
+        message, self.state = results_delta(self.state, state), state
+        if message is not None:
+            await self.send_json({**message, 'form': self.form_id})
+
+    @classmethod
+    async def encode_json(cls, content):
+        # ids are UUIDs
+        return json.dumps(content, cls=DjangoJSONEncoder)
@@ -0,0 +1,147 @@
+import json
+import os
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, migrations
+from django.db.migrations.autodetector import MigrationAutodetector
+from django.db.migrations.loader import MigrationLoader
+from django.db.migrations.writer import MigrationWriter
+
+from utils.index_advisor import (
+    estimate_cost, explain, has_hypopg, is_covered, propose_index, representative_params, scan_candidates,
+)
+from utils.query_patterns import pattern_log, read_patterns
+
+
+class Command(BaseCommand):
+    help = (
+        "Propose indexes for the queries recorded by QueryPatternMiddleware (QUERY_PATTERN_SAMPLE_RATE), "
+        "from their EXPLAIN plans, with the planner's estimated benefit, and write them as migrations."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--log', default=None, help="recorded queries, QUERY_PATTERN_LOG by default")
+        parser.add_argument('--min-calls', type=int, default=1, help="ignore queries recorded fewer times")
+        parser.add_argument('--values', default=None,
+                            help="JSON file of parameter values per recorded SQL; others come from pg_stats")
+        parser.add_argument('--database', default=None,
+                            help=f"database to explain the queries on, {DEFAULT_DB_ALIAS} by default")
+        parser.add_argument('--trial', action='store_true',
+                            help="without hypopg, estimate by building each index concurrently and dropping it; "
+                                 "needs --database, meant for a copy of production")
+        parser.add_argument('--dry-run', action='store_true', help="print the migrations instead of writing them")
+
+    def handle(self, *args, **options):
+        if options['trial'] and not options['database']:
+            raise CommandError("--trial builds indexes for real, name the database to build them on with --database.")
+        connection = connections[options['database'] or DEFAULT_DB_ALIAS]
+        if connection.vendor != 'postgresql':
+            raise CommandError("advise_indexes needs PostgreSQL.")
+        patterns = read_patterns(options['log'])
+        if not patterns:
+            raise CommandError(f"No queries recorded in {options['log'] or pattern_log()}.")
+        values = {}
+        if options['values']:
+            with open(options['values']) as file:
+                values = json.load(file)
+
+        local_models = {model._meta.db_table: model for model in apps.get_models()
+                        if 'site-packages' not in model._meta.app_config.path}
+        with connection.cursor() as cursor:
+            hypothetical = has_hypopg(cursor)
+        if not hypothetical and not options['trial']:
+            self.stdout.write("hypopg is not installed and --trial not given, benefits are not estimated.")
+
+        proposals = {}
+        for pattern in patterns.values():
+            if pattern['calls'] < options['min_calls']:
+                continue
+            try:
+                with connection.cursor() as cursor:
+                    params = representative_params(cursor, pattern['sql'], pattern['types'], values.get(pattern['sql']))
+                    plan = explain(cursor, pattern['sql'], params)
+            except DatabaseError as error:
+                self.stdout.write(f"could not explain a query of {', '.join(sorted(pattern['views']))}: {error}")
+                continue
+
+            for table, *scan in scan_candidates(plan):
+                model = local_models.get(table)
+                index = model and propose_index(model, *scan)
+                if index is None:
+                    continue
+                with connection.cursor() as cursor:
+                    existing = connection.introspection.get_constraints(cursor, table)
+                if is_covered(existing, model, index):
+                    continue
+                cost = estimate_cost(connection, model, index, pattern['sql'], params, hypothetical, options['trial'])
+                proposal = proposals.setdefault((model, index.name), {
+                    'index': index, 'calls': 0, 'views': set(), 'before': 0, 'after': 0, 'estimated': True,
+                })
+                proposal['calls'] += pattern['calls']
+                proposal['views'] |= pattern['views']
+                proposal['before'] += pattern['calls'] * plan['Total Cost']
+                if cost is None:
+                    proposal['estimated'] = False
+                else:
+                    proposal['after'] += pattern['calls'] * cost
+
+        useful = {}
+        # largest estimated saving first
+        ranked = sorted(proposals.items(), key=lambda item: (not item[1]['estimated'], item[1]['after'] - item[1]['before']))
+        for (model, name), proposal in ranked:
+            if proposal['estimated'] and proposal['after'] >= proposal['before']:
+                self.stdout.write(f"{model._meta.label} {name}: the planner would not use it, skipped")
+                continue
+            proposal['note'] = self._describe(model, proposal)
+            self.stdout.write(proposal['note'])
+            useful.setdefault(model._meta.app_label, []).append((model, proposal))
+        self._redundant_indexes(local_models.values())
+
+        for app_label, app_proposals in useful.items():
+            self._write_migration(app_label, app_proposals, options['dry_run'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {sum(len(items) for items in useful.values())} indexes proposed from {len(patterns)} recorded queries."
+        ))
+
+    def _describe(self, model, proposal):
+        index = proposal['index']
+        columns = ', '.join(index.fields) + (f" where {index.condition}" if index.condition else '')
+        if proposal['estimated']:
+            before, after = proposal['before'] / proposal['calls'], proposal['after'] / proposal['calls']
+            benefit = f"cost {before:.0f} -> {after:.0f} ({1 - after / before:.0%} less)"
+        else:
+            benefit = "benefit not estimated"
+        return (f"{model._meta.label} {index.name} ({columns}): {benefit}, {proposal['calls']} calls "
+                f"from {', '.join(sorted(proposal['views'])) or 'unknown views'}")
+
+    def _redundant_indexes(self, models):
+        for model in models:
+            for index in model._meta.indexes:
+                if list(index.fields) == [model._meta.pk.name] and not index.condition:
+                    self.stdout.write(f"{model._meta.label} {index.name} duplicates the primary key, consider dropping it")
+
+    def _write_migration(self, app_label, proposals, dry_run):
+        leaves = MigrationLoader(None, ignore_no_migrations=True).graph.leaf_nodes(app_label)
+        number = max((MigrationAutodetector.parse_number(name) or 0 for _, name in leaves), default=0) + 1
+        migration = migrations.Migration(f'{number:04d}_advised_indexes', app_label)
+        migration.dependencies = leaves
+        migration.operations = [
+            migrations.AddIndex(model_name=model._meta.model_name, index=proposal['index'])
+            for model, proposal in proposals
+        ]
+
+        writer = MigrationWriter(migration)
+        header, body = writer.as_string().split('\n', 1)
+        notes = ''.join(f"# {proposal['note']}\n" for model, proposal in proposals)
+        # the indexes belong in the models' Meta.indexes too, or makemigrations would drop them again
+        notes += ''.join(f"# {model.__name__}.Meta.indexes: {MigrationWriter.serialize(proposal['index'])[0]}\n"
+                         for model, proposal in proposals)
+        content = f'{header}\n{notes}{body}'
+        if dry_run:
+            self.stdout.write(content)
+            return
+        os.makedirs(os.path.dirname(writer.path), exist_ok=True)
+        with open(writer.path, 'w') as file:
+            file.write(content)
+        self.stdout.write(f"wrote {writer.path}")
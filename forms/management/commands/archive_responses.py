@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from forms.archive import archive_dir, archive_month, archived_months, index_archived_month
+from forms.models import Response
+from utils.partitions import add_months, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        "Move the responses older than the retention period, and their answers, out of the database "
+        "into the Parquet cold archive, one file per month. They stay readable through the API and exports."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--older-than', type=int, default=getattr(settings, 'FORMS_ARCHIVE_AFTER_MONTHS', 12),
+                            help="months to keep in the database, besides the current one")
+        parser.add_argument('--reindex', action='store_true',
+                            help="rebuild the archive's id index from the archived months, then archive")
+
+    def handle(self, *args, **options):
+        if options['reindex']:
+            for month in archived_months():
+                self.stdout.write(f"{month:%Y-%m}: {index_archived_month(month)} responses indexed")
+        oldest = Response.objects.order_by('_created_at').values_list('_created_at', flat=True).first()
+        before = add_months(month_start(timezone.now()), -options['older_than'])
+        archived = 0
+        month = month_start(oldest) if oldest else before
+        while month < before:
+            count = archive_month(month)
+            if count:
+                self.stdout.write(f"{month:%Y-%m}: {count} responses archived")
+            archived += count
+            month = add_months(month, 1)
+        self.stdout.write(self.style.SUCCESS(f"Done, {archived} responses archived to {archive_dir()}."))
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+
+from forms.models import Answer
+from forms.search import SEARCHABLE_TYPES, update_search_vectors
+from forms.validation import TYPED_FIELDS, VALUE_TYPES, set_typed_values
+
+
+class Command(BaseCommand):
+    help = "Fill the derived columns of existing answers: typed values and the full-text search vector."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        typed = self._in_chunks(Answer.objects.filter(question__question_type__in=VALUE_TYPES), options['chunk_size'],
+                                self._fill_typed_values)
+        self.stdout.write(self.style.SUCCESS(f"Done, {typed} typed answers updated."))
+        searchable = self._in_chunks(Answer.objects.filter(question__question_type__in=SEARCHABLE_TYPES),
+                                     options['chunk_size'], lambda pks: update_search_vectors(Answer.objects.filter(pk__in=pks)))
+        self.stdout.write(self.style.SUCCESS(f"Done, {searchable} text answers indexed."))
+
+    def _in_chunks(self, queryset, chunk_size, update):
+        queryset = queryset.order_by('pk')
+        updated, last_pk = 0, None
+        while True:
+            chunk = queryset if last_pk is None else queryset.filter(pk__gt=last_pk)
+            pks = list(chunk.values_list('pk', flat=True)[:chunk_size])
+            if not pks:
+                return updated
+            last_pk = pks[-1]
+            update(pks)
+            updated += len(pks)
+            self.stdout.write(f"{updated} answers updated")
+
+    def _fill_typed_values(self, pks):
+        answers = []
+        for pk, value, question_type in Answer.objects.filter(pk__in=pks).values_list('pk', 'value', 'question__question_type'):
+            answer = Answer(pk=pk, value=value)
+            set_typed_values(answer, question_type)
+            answers.append(answer)
+        # derived columns only: no _updated_at stamp and no audit entries
+        Answer.objects.bulk_update(answers, TYPED_FIELDS)
@@ -0,0 +1,74 @@
+import io
+import time
+from uuid import uuid4
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from utils.identifiers import uuid7
+
+GENERATORS = {'uuid4': uuid4, 'uuid7': uuid7}
+
+
+class Command(BaseCommand):
+    help = (
+        "Insert the same number of answer-like rows keyed by uuid4 and by uuid7 into two scratch tables "
+        "with COPY and compare throughput, WAL written and primary key index size (PostgreSQL)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10_000_000)
+        parser.add_argument('--batch-size', type=int, default=100_000)
+        parser.add_argument('--keep', action='store_true', help="keep the scratch tables")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("benchmark_primary_keys needs PostgreSQL.")
+        self.stdout.write(f"{'key':>6} {'rows/s':>10} {'last 10%':>10} {'WAL':>10} {'pk index':>10}")
+        for name, generate in GENERATORS.items():
+            table = f'benchmark_answers_{name}'
+            with connection.cursor() as cursor:
+                self._create(cursor, table)
+                rate, tail_rate, wal = self._insert(cursor, table, generate, options['rows'], options['batch_size'])
+                cursor.execute("SELECT pg_relation_size(%s)", [f'{table}_pkey'])
+                index_size = cursor.fetchone()[0]
+                if not options['keep']:
+                    cursor.execute(f"DROP TABLE {table}")
+            self.stdout.write(
+                f"{name:>6} {rate:>10.0f} {tail_rate:>10.0f} {wal / 2 ** 20:>8.0f}MB {index_size / 2 ** 20:>8.0f}MB"
+            )
+
+    def _create(self, cursor, table):
+        # the answers table's shape: random or ordered keys, one response per 20 answers
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+        cursor.execute(
+            f"CREATE TABLE {table} (id uuid PRIMARY KEY, response_id uuid NOT NULL, question_id uuid NOT NULL, "
+            f"value varchar(255), _created_at timestamp with time zone NOT NULL DEFAULT now())"
+        )
+        cursor.execute(f"CREATE INDEX {table}_response_id ON {table} (response_id)")
+
+    def _insert(self, cursor, table, generate, rows, batch_size):
+        questions = [uuid4() for _ in range(20)]
+        cursor.execute("SELECT pg_current_wal_insert_lsn()")
+        wal_start = cursor.fetchone()[0]
+        timings, inserted = [], 0
+        while inserted < rows:
+            size = min(batch_size, rows - inserted)
+            buffer = io.StringIO()
+            for row in range(size):
+                if row % 20 == 0:
+                    response = generate()
+                buffer.write(f'{generate()}\t{response}\t{questions[row % 20]}\tanswer {row}\n')
+            buffer.seek(0)
+
+            started = time.perf_counter()
+            cursor.copy_expert(f"COPY {table} (id, response_id, question_id, value) FROM STDIN", buffer)
+            timings.append((size, time.perf_counter() - started))
+            inserted += size
+
+        cursor.execute("SELECT pg_wal_lsn_diff(pg_current_wal_insert_lsn(), %s)", [wal_start])
+        wal = cursor.fetchone()[0]
+        tail = timings[-max(1, len(timings) // 10):]
+        rate = sum(size for size, _ in timings) / sum(elapsed for _, elapsed in timings)
+        tail_rate = sum(size for size, _ in tail) / sum(elapsed for _, elapsed in tail)
+        return rate, tail_rate, wal
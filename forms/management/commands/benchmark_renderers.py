@@ -0,0 +1,83 @@
+import time
+import uuid
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from rest_framework import views  # noqa: F401  (DEFAULT_RENDERER_CLASSES points back at core.exceptions)
+
+from core.exceptions import CustomJSONRenderer, FastJSONRenderer
+from forms.models import Response
+from forms.serializers import ResponseSerializer
+from utils.queryset import prefetch_for_serializer
+
+
+class Command(BaseCommand):
+    help = "Compare CustomJSONRenderer and FastJSONRenderer on a large ResponseViewSet page."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=500, help="responses per page")
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--answers', type=int, default=30, help="answers per synthetic response")
+        parser.add_argument('--synthetic', action='store_true',
+                            help="build the page in memory instead of reading responses from the database")
+
+    def handle(self, *args, **options):
+        data = self._synthetic_page(options) if options['synthetic'] else self._db_page(options)
+        context = {'response': SimpleNamespace(status_code=200)}
+
+        results = {}
+        for renderer_class in (CustomJSONRenderer, FastJSONRenderer):
+            renderer = renderer_class()
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                content = renderer.render(data, 'application/json', context)
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            results[renderer_class.__name__] = (elapsed, content)
+            self.stdout.write(f"{renderer_class.__name__:<20} {elapsed * 1000:8.2f} ms/page  {len(content)} bytes")
+
+        (base, base_content), (fast, fast_content) = results.values()
+        if base_content != fast_content:
+            raise CommandError("FastJSONRenderer output differs from CustomJSONRenderer.")
+        self.stdout.write(self.style.SUCCESS(f"identical output, {base / fast:.1f}x faster"))
+
+    def _db_page(self, options):
+        queryset = prefetch_for_serializer(Response.objects.order_by('-_created_at'), ResponseSerializer)
+        page = list(queryset[:options['limit']])
+        if not page:
+            raise CommandError("No responses in the database, use --synthetic.")
+        return self._paginated(ResponseSerializer(page, many=True).data)
+
+    def _synthetic_page(self, options):
+        now = timezone.now()
+        items = []
+        for _ in range(options['limit']):
+            items.append({
+                'id': str(uuid.uuid4()),
+                'form': uuid.uuid4(),
+                'form_title': 'فرم ارزیابی روزانه',
+                'user': uuid.uuid4(),
+                'day': uuid.uuid4(),
+                'snapshot': uuid.uuid4(),
+                'answers': [{
+                    'question': uuid.uuid4(),
+                    'question_details': None,
+                    'value': 'پاسخ متنی نمونه',
+                    'option': uuid.uuid4(),
+                } for _ in range(options['answers'])],
+                '_created_at': now,
+                '_updated_at': now,
+                '_updated_by': uuid.uuid4(),
+                '_created_by': uuid.uuid4(),
+            })
+        return self._paginated(items)
+
+    def _paginated(self, items):
+        return {
+            'pages_count': 1,
+            'items_per_page': len(items),
+            'current_page_items_count': len(items),
+            'current_page': 1,
+            'total_items': len(items),
+            'items': items,
+        }
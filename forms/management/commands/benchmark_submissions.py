@@ -0,0 +1,87 @@
+import time
+from contextlib import contextmanager
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models.signals import pre_save
+from django.test.utils import CaptureQueriesContext
+
+from core.type import QuestionType
+from forms.models import Answer, Form, Question, Response
+from forms.serializers import ResponseSerializer
+from forms.signals import fill_answer_typed_values
+from forms.snapshots import current_snapshot_id
+
+
+@contextmanager
+def baseline_signals():
+    # the answer signals came with the bulk writes (typed values, search vectors); the row by
+    # row baseline is timed with the signals it had, or it pays for work it never did
+    pre_save.disconnect(fill_answer_typed_values, sender=Answer)
+    try:
+        yield
+    finally:
+        pre_save.connect(fill_answer_typed_values, sender=Answer)
+
+
+class Command(BaseCommand):
+    help = (
+        "Time persisting a response with 10/100/500 answers, row by row (with the answer signals of "
+        "that time) against ResponseSerializer.create."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--repeat', type=int, default=5)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'answers':>8} {'row by row':>16} {'bulk':>16} {'speedup':>8}")
+        for size in options['sizes']:
+            # everything is written inside a transaction that is rolled back at the end
+            with transaction.atomic():
+                form = Form.objects.create(title=f'benchmark {size}', type='FORM')
+                questions = Question.objects.bulk_create([
+                    Question(form=form, text=f'question {i}', question_type=QuestionType.TEXT, order=i)
+                    for i in range(size)
+                ])
+                current_snapshot_id(form)
+
+                with baseline_signals():
+                    row_by_row = self._measure(options['repeat'], lambda: self._create_row_by_row(form, questions))
+                bulk = self._measure(options['repeat'], lambda: ResponseSerializer().create(
+                    self._validated_data(form, questions)))
+                transaction.set_rollback(True)
+
+            self.stdout.write(
+                f"{size:>8} {self._format(row_by_row):>16} {self._format(bulk):>16} {row_by_row[0] / bulk[0]:>7.1f}x"
+            )
+
+    def _validated_data(self, form, questions):
+        return {
+            'form': form,
+            'answers': [{'question': question, 'value': f'answer {question.order}'} for question in questions],
+        }
+
+    def _create_row_by_row(self, form, questions):
+        # ResponseSerializer.create before answers were bulk inserted
+        validated_data = self._validated_data(form, questions)
+        answers_data = validated_data.pop('answers')
+        with transaction.atomic():
+            response = Response.objects.create(snapshot_id=current_snapshot_id(form), **validated_data)
+            for answer_data in answers_data:
+                Answer.objects.create(response=response, **answer_data)
+        return response
+
+    def _measure(self, repeat, create):
+        elapsed, queries = 0, 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                create()
+                elapsed += time.perf_counter() - started
+            queries = len(context.captured_queries)
+        return elapsed / repeat, queries
+
+    def _format(self, result):
+        elapsed, queries = result
+        return f"{elapsed * 1000:.1f} ms/{queries}q"
@@ -0,0 +1,93 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from core.type import QuestionType
+from forms.models import Form, Option, Question
+from forms.serializers import ResponseSerializer
+from forms.validation import get_validation_plan
+
+QUESTION_TYPES = (QuestionType.NUMBER, QuestionType.BOOL, QuestionType.MULTIPLE_CHOICE, QuestionType.RADIO,
+                  QuestionType.TEXT)
+
+
+class NestedFieldsResponseSerializer(ResponseSerializer):
+    """ResponseSerializer as before the plan returned the answers: checked by it, then read by AnswerSerializer."""
+
+    def _validate_answers(self, form, data):
+        super()._validate_answers(form, data)
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Time ResponseSerializer validation of a submission with 10/100/500 answers, end to end, with the "
+        "nested AnswerSerializer fields against the answers read by the compiled validation plan."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500])
+        parser.add_argument('--repeat', type=int, default=20)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'answers':>8} {'nested fields':>16} {'plan':>16} {'speedup':>8}")
+        for size in options['sizes']:
+            # committed, so the plan is cached like in production (forms.validation), and deleted at the end
+            with transaction.atomic():
+                form, payload = self._build(size)
+            try:
+                get_validation_plan(form)
+                serializer = self._measure(options['repeat'], lambda: self._validate(NestedFieldsResponseSerializer, payload))
+                compiled = self._measure(options['repeat'], lambda: self._validate(ResponseSerializer, payload))
+            finally:
+                form.delete()
+
+            self.stdout.write(
+                f"{size:>8} {self._format(serializer):>16} {self._format(compiled):>16} {serializer[0] / compiled[0]:>7.1f}x"
+            )
+
+    def _build(self, size):
+        form = Form.objects.create(title=f'benchmark {size}', type='FORM')
+        questions = Question.objects.bulk_create([
+            Question(form=form, text=f'question {i}', question_type=QUESTION_TYPES[i % len(QUESTION_TYPES)],
+                     is_required=True, order=i, min=0, max=100)
+            for i in range(size)
+        ])
+        options = {option.question_id: option for option in Option.objects.bulk_create([
+            Option(question=question, text='option') for question in questions
+            if question.question_type in (QuestionType.MULTIPLE_CHOICE, QuestionType.RADIO)
+        ])}
+
+        answers = []
+        for question in questions:
+            answer = {'question': str(question.pk)}
+            if question.pk in options:
+                answer['option'] = str(options[question.pk].pk)
+            elif question.question_type == QuestionType.NUMBER:
+                answer['value'] = str(question.order % 100)
+            elif question.question_type == QuestionType.BOOL:
+                answer['value'] = 'true'
+            else:
+                answer['value'] = f'answer {question.order}'
+            answers.append(answer)
+        return form, {'form': str(form.pk), 'answers': answers}
+
+    def _validate(self, serializer_class, payload):
+        # a fresh serializer, preloading the submission's objects like a request does
+        serializer_class(data=payload).is_valid(raise_exception=True)
+
+    def _measure(self, repeat, validate):
+        elapsed, queries = 0, 0
+        for _ in range(repeat):
+            with CaptureQueriesContext(connection) as context:
+                started = time.perf_counter()
+                validate()
+                elapsed += time.perf_counter() - started
+            queries = len(context.captured_queries)
+        return elapsed / repeat, queries
+
+    def _format(self, result):
+        elapsed, queries = result
+        return f"{elapsed * 1000:.2f} ms/{queries}q"
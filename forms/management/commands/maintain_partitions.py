@@ -0,0 +1,35 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+
+from forms.management.commands.partition_tables import PARTITIONED_MODELS
+from utils.partitions import add_months, detach_partitions, ensure_partitions, is_partitioned, month_start
+
+
+class Command(BaseCommand):
+    help = (
+        "Create the monthly partitions of the response and answers tables ahead of time and detach "
+        "the ones older than the retention period (detached partitions are kept as plain tables)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=getattr(settings, 'FORMS_PARTITION_MONTHS_AHEAD', 3),
+                            help="future months to create partitions for")
+        parser.add_argument('--retain', type=int, default=getattr(settings, 'FORMS_PARTITION_RETAIN_MONTHS', 0),
+                            help="months to keep attached, besides the current one; 0 keeps all")
+
+    def handle(self, *args, **options):
+        for model, column in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            with connection.cursor() as cursor:
+                if connection.vendor != 'postgresql' or not is_partitioned(cursor, table):
+                    self.stdout.write(f"{table} is not partitioned, run partition_tables first.")
+                    continue
+
+            for name in ensure_partitions(table, column, options['ahead']):
+                self.stdout.write(f"created {name}")
+            if options['retain']:
+                before = add_months(month_start(timezone.now()), -options['retain'])
+                for name in detach_partitions(table, before):
+                    self.stdout.write(f"detached {name}")
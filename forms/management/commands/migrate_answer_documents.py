@@ -0,0 +1,65 @@
+from collections import Counter
+
+from auditlog.context import disable_auditlog
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from forms.documents import build_answer_document, document_answers
+from forms.models import Answer, Response
+
+
+def _answer_keys(answers):
+    return Counter((answer.question_id, answer.option_id, answer.value) for answer in answers)
+
+
+class Command(BaseCommand):
+    help = "Move the answers rows of existing responses into Response.answers_document, chunk by chunk."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help="responses per transaction")
+        parser.add_argument('--form', help="only migrate the responses of this form")
+
+    def handle(self, *args, **options):
+        pending = Response.objects.filter(answers_document__isnull=True).order_by('pk')
+        if options['form']:
+            pending = pending.filter(form_id=options['form'])
+
+        migrated, last_pk = 0, None
+        while True:
+            chunk = pending if last_pk is None else pending.filter(pk__gt=last_pk)
+            ids = list(chunk.values_list('pk', flat=True)[:options['chunk_size']])
+            if not ids:
+                break
+            last_pk = ids[-1]
+            migrated += self._migrate(ids)
+            self.stdout.write(f"{migrated} responses migrated")
+
+        self.stdout.write(self.style.SUCCESS(f"Done, {migrated} responses migrated."))
+
+    def _migrate(self, ids):
+        with transaction.atomic():
+            # skip responses written or migrated meanwhile
+            responses = list(Response.objects.select_for_update().filter(pk__in=ids, answers_document__isnull=True))
+            answers = {response.pk: [] for response in responses}
+            rows = Answer.objects.filter(response_id__in=answers).order_by('_created_at')
+            for row in rows.only('response_id', 'question_id', 'option_id', 'value'):
+                answers[row.response_id].append(row)
+
+            migrated = []
+            for response in responses:
+                rows = answers[response.pk]
+                # rows are deleted below, only for a document that gives all of them back (a
+                # document has no place for an answer without a question)
+                if all(row.question_id for row in rows):
+                    response.answers_document = build_answer_document([
+                        {'question': row.question_id, 'option': row.option_id, 'value': row.value} for row in rows
+                    ])
+                    if _answer_keys(document_answers(response)) == _answer_keys(rows):
+                        migrated.append(response)
+                        continue
+                self.stderr.write(f"Response {response.pk}: answers do not fit a document, rows kept.")
+            # a change of storage, not of the answers: no _updated_at stamp and no audit entries
+            Response.objects.bulk_update(migrated, ['answers_document'])
+            with disable_auditlog():
+                Answer.objects.filter(response_id__in=[response.pk for response in migrated]).delete()
+        return len(migrated)
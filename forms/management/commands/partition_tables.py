@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from forms.models import Answer, Response
+from utils.partitions import convert_to_partitioned
+
+# responses by the month of their uuid7 id, answers by their response's (utils.partitions)
+PARTITIONED_MODELS = ((Response, 'id'), (Answer, 'response_id'))
+
+
+class Command(BaseCommand):
+    help = (
+        "Convert the response and answers tables into tables range-partitioned by the month of the "
+        "response's uuid7 id (PostgreSQL, TIME_ORDERED_IDS). Locks each table while its rows are copied; "
+        "run in a maintenance window."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ahead', type=int, default=getattr(settings, 'FORMS_PARTITION_MONTHS_AHEAD', 3),
+                            help="future months to create partitions for")
+        parser.add_argument('--keep-legacy', action='store_true',
+                            help="keep the old tables as <table>_legacy instead of dropping them")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Partitioning needs PostgreSQL.")
+        if not getattr(settings, 'TIME_ORDERED_IDS', False):
+            raise CommandError("Partitions are months of uuid7 ids, turn TIME_ORDERED_IDS on first.")
+
+        for model, column in PARTITIONED_MODELS:
+            table = model._meta.db_table
+            if convert_to_partitioned(table, column, options['ahead'], keep_legacy=options['keep_legacy']):
+                self.stdout.write(self.style.SUCCESS(f"{table} is now partitioned by month."))
+            else:
+                self.stdout.write(f"{table} is already partitioned.")
@@ -0,0 +1,58 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, F, Q, Sum
+
+from forms.models import Attendance, AttendanceRollup, GroupAttendanceRollup
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the attendance rollups (per day and student, per group and day, and their running totals) "
+        "from scratch from attendance and group memberships."
+    )
+
+    def handle(self, *args, **options):
+        # imported here, forms loads before the user app's models
+        from user.models import GroupStudent
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # attendance writes wait with their deltas until the recount is committed
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"LOCK TABLE {AttendanceRollup._meta.db_table}, {GroupAttendanceRollup._meta.db_table} "
+                        f"IN EXCLUSIVE MODE"
+                    )
+            AttendanceRollup.objects.all().delete()
+            GroupAttendanceRollup.objects.all().delete()
+
+            counted = Attendance.objects.filter(
+                day__isnull=False, student__isnull=False, status__in=['present', 'absent']
+            ).order_by()
+            counts = {
+                'present': Count('pk', filter=Q(status='present')),
+                'absent': Count('pk', filter=Q(status='absent')),
+            }
+            # per day, then the running totals (no day)
+            rollups = AttendanceRollup.objects.bulk_create([
+                AttendanceRollup(**row) for row in counted.values('day_id', 'student_id').annotate(**counts).iterator(
+                    chunk_size=5000)
+            ], batch_size=5000)
+            rollups += AttendanceRollup.objects.bulk_create([
+                AttendanceRollup(**row) for row in counted.values('student_id').annotate(**counts).iterator(
+                    chunk_size=5000)
+            ], batch_size=5000)
+
+            # a student's attendance counts in every group they belong to, running totals included
+            group_rollups = GroupAttendanceRollup.objects.bulk_create([
+                GroupAttendanceRollup(**row) for row in GroupStudent.objects.filter(
+                    student__attendance_rollups__isnull=False
+                ).order_by().values('group_id', day_id=F('student__attendance_rollups__day_id')).annotate(
+                    present=Sum('student__attendance_rollups__present'),
+                    absent=Sum('student__attendance_rollups__absent'),
+                ).iterator(chunk_size=5000)
+            ], batch_size=5000)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Done, {len(rollups)} student and {len(group_rollups)} group attendance rollups rebuilt."
+        ))
@@ -0,0 +1,61 @@
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count
+
+from forms.archive import read_archived_responses
+from forms.documents import document_answers, stored_answers
+from forms.models import Answer, AnswerStatistic, Form, Response, ResponseCount
+from forms.statistics import StatisticDeltas, statistic_rows, statistics_deltas
+from forms.validation import CHOICE_TYPES, NUMERIC_TYPES
+
+
+class Command(BaseCommand):
+    help = (
+        "Recount the answer statistics and response count of every form (or of --form) from scratch: answers "
+        "rows, answer documents and archived responses. Run backfill_answer_columns first if numbers were never typed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--form', help="only recount the statistics of this form")
+
+    def handle(self, *args, **options):
+        forms = Form.objects.order_by('pk')
+        if options['form']:
+            forms = forms.filter(pk=options['form'])
+
+        rebuilt = 0
+        for form in forms:
+            with transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    # submissions wait with their deltas until the recount is committed
+                    with connection.cursor() as cursor:
+                        cursor.execute(f"LOCK TABLE {AnswerStatistic._meta.db_table}, {ResponseCount._meta.db_table} "
+                                       "IN EXCLUSIVE MODE")
+                AnswerStatistic.objects.filter(question__form=form).delete()
+                statistics, responses = self._count(form)
+                ResponseCount.objects.update_or_create(form=form, defaults={'count': responses})
+                AnswerStatistic.objects.bulk_create(statistic_rows(statistics))
+            rebuilt += 1
+            self.stdout.write(f"{form.title}: {len(statistics)} statistics, {responses} responses")
+        self.stdout.write(self.style.SUCCESS(f"Done, statistics of {rebuilt} forms rebuilt."))
+
+    def _count(self, form):
+        statistics = StatisticDeltas()
+        responses = Response.objects.filter(form=form).count()
+        answers = Answer.objects.filter(response__form=form, question__form=form).order_by()
+        for question_id, option_id, count in answers.filter(
+                question__question_type__in=CHOICE_TYPES, option__isnull=False
+        ).values_list('question', 'option').annotate(count=Count('pk')):
+            statistics[(question_id, option_id, None)] += count
+        for question_id, value_number, count in answers.filter(
+                question__question_type__in=NUMERIC_TYPES, value_number__isnull=False
+        ).values_list('question', 'value_number').annotate(count=Count('pk')):
+            statistics.add_number(question_id, value_number, count)
+
+        documents = Response.objects.filter(form=form, answers_document__isnull=False)
+        for response in documents.iterator(chunk_size=2000):
+            statistics_deltas(form, document_answers(response), deltas=statistics)
+        for response in read_archived_responses(form_id=form.pk):
+            statistics_deltas(form, stored_answers(response), deltas=statistics)
+            responses += 1
+        return statistics, responses
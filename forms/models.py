@@ -1,5 +1,8 @@
 from django.db import models
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField
+from django.core.serializers.json import DjangoJSONEncoder
 from core.models import GenericModel
 from core.type import QuestionType, FormType
 from django.contrib.auth import get_user_model
@@ -22,6 +25,10 @@ class Form(GenericModel):
     is_active = models.BooleanField(
         default=True
     )
+    version = models.PositiveIntegerField(
+        default=1,
+        editable=False
+    )
     class Meta:
         verbose_name_plural = "forms"
         verbose_name = "form"
@@ -121,6 +128,35 @@ class Option(GenericModel):
     def __str__(self):
         return self.text
 
+#------------------------------------------------------------------------------------------------------------#
+class FormSnapshot(GenericModel):
+    form = models.ForeignKey(
+        Form,
+        related_name='snapshots',
+        on_delete=models.CASCADE
+    )
+    version = models.PositiveIntegerField()
+    schema = models.JSONField(
+        encoder=DjangoJSONEncoder
+    )
+
+    class Meta:
+        verbose_name_plural = "form snapshots"
+        verbose_name = "form snapshot"
+        db_table = 'form_snapshot'
+        constraints = (
+            models.UniqueConstraint(fields=['form', 'version'], name='form_snapshot_version_uniq'),
+        )
+
+    def __str__(self):
+        return f"{self.form_id} v{self.version}"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Form snapshots are immutable.")
+        super().save(*args, **kwargs)
+
+
 #------------------------------------------------------------------------------------------------------------#
 class Response(GenericModel):
     form = models.ForeignKey(
@@ -141,10 +177,30 @@ class Response(GenericModel):
         related_name='responses'
         , null=True,
         blank=True)
+    snapshot = models.ForeignKey(
+        FormSnapshot,
+        related_name='responses',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        editable=False
+    )
+    # with FORMS_ANSWER_STORAGE = 'document' the answers live here, keyed by question id
+    # (see forms.documents), instead of in answers rows
+    answers_document = models.JSONField(
+        encoder=DjangoJSONEncoder,
+        null=True,
+        blank=True,
+        editable=False
+    )
     class Meta:
         verbose_name_plural = "responses"
         verbose_name = "response"
         db_table = 'response'
+        indexes = (
+            GinIndex(fields=['answers_document'], name='response_answers_doc_gin'),
+
+        )
 
     def __str__(self):
         return self.form.title
@@ -174,13 +230,41 @@ class Answer(GenericModel):
         blank=True,
         on_delete=models.SET_NULL
     )
+    # typed copies of value for NUMBER/RANGE, BOOL and DATE questions, filled on write
+    # (forms.validation.set_typed_values) so filters and aggregates compare natively
+    value_number = models.FloatField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+    value_bool = models.BooleanField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+    value_date = models.DateField(
+        null=True,
+        blank=True,
+        editable=False
+    )
+    # tsvector of value for TEXT/TEXTAREA questions, see forms.search
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False
+    )
 
     class Meta:
         verbose_name_plural = "answers"
         verbose_name = "answer"
         db_table = 'answers'
         indexes = (
-            models.Index(fields=['value'], name='answer_value_idx'),
+            models.Index(fields=['question', 'value_number'], name='answer_value_number_idx',
+                         condition=models.Q(value_number__isnull=False)),
+            models.Index(fields=['question', 'value_bool'], name='answer_value_bool_idx',
+                         condition=models.Q(value_bool__isnull=False)),
+            models.Index(fields=['question', 'value_date'], name='answer_value_date_idx',
+                         condition=models.Q(value_date__isnull=False)),
+            GinIndex(fields=['search_vector'], name='answer_search_vector_gin'),
 
         )
 
@@ -188,6 +272,81 @@ class Answer(GenericModel):
         return self.value or self.option.text
 
 
+#------------------------------------------------------------------------------------------------------------#
+class AnswerStatistic(models.Model):
+    # summary rows of forms.statistics: how many answers to a question chose an option, or, for a
+    # numeric question, one row with the count, sum and range of its numbers and a row per
+    # histogram bucket they fall in; kept up to date by submissions with counter deltas, not audited
+    question = models.ForeignKey(
+        Question,
+        related_name='statistics',
+        on_delete=models.CASCADE
+    )
+    option = models.ForeignKey(
+        Option,
+        null=True,
+        blank=True,
+        on_delete=models.CASCADE
+    )
+    bucket = models.IntegerField(
+        null=True,
+        blank=True
+    )
+    count = models.IntegerField(
+        default=0
+    )
+    total = models.FloatField(
+        null=True,
+        blank=True
+    )
+    minimum = models.FloatField(
+        null=True,
+        blank=True
+    )
+    maximum = models.FloatField(
+        null=True,
+        blank=True
+    )
+
+    class Meta:
+        verbose_name_plural = "answer statistics"
+        verbose_name = "answer statistic"
+        db_table = 'answer_statistic'
+        constraints = (
+            models.UniqueConstraint(fields=['question', 'option'], name='answer_statistic_option_uniq',
+                                    condition=models.Q(option__isnull=False)),
+            models.UniqueConstraint(fields=['question', 'bucket'], name='answer_statistic_bucket_uniq',
+                                    condition=models.Q(bucket__isnull=False)),
+            models.UniqueConstraint(fields=['question'], name='answer_statistic_number_uniq',
+                                    condition=models.Q(option__isnull=True, bucket__isnull=True)),
+        )
+
+    def __str__(self):
+        return f"{self.question_id}: {self.count}"
+
+
+class ResponseCount(models.Model):
+    # how many responses a form has, archived ones included; kept up to date with counter deltas
+    # by whoever writes or removes responses (forms.statistics.count_responses), not audited
+    form = models.OneToOneField(
+        Form,
+        primary_key=True,
+        related_name='response_count',
+        on_delete=models.CASCADE
+    )
+    count = models.IntegerField(
+        default=0
+    )
+
+    class Meta:
+        verbose_name_plural = "response counts"
+        verbose_name = "response count"
+        db_table = 'response_count'
+
+    def __str__(self):
+        return f"{self.form_id}: {self.count}"
+
+
 #------------------------------------------------------------------------------------------------------------#
 class Guest(GenericModel):
 
@@ -267,4 +426,77 @@ class Attendance(GenericModel):
 
 
     def __str__(self):
-        return f"{self.student} - {self.status}"
\ No newline at end of file
+        return f"{self.student} - {self.status}"
+
+#------------------------------------------------------------------------------------------------------------#
+class AttendanceRollup(models.Model):
+    # summary rows of forms.rollups: a student's present / absent attendance of a day, or of all
+    # days on the row without one (the running total), kept up to date by attendance writes with
+    # counter deltas, not audited
+    day = models.ForeignKey(
+        to='course.Day',
+        on_delete=models.CASCADE,
+        related_name='attendance_rollups',
+        null=True,
+        blank=True
+    )
+    student = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='attendance_rollups'
+    )
+    present = models.IntegerField(
+        default=0
+    )
+    absent = models.IntegerField(
+        default=0
+    )
+
+    class Meta:
+        verbose_name_plural = "attendance rollups"
+        verbose_name = "attendance rollup"
+        db_table = 'attendance_rollup'
+        constraints = (
+            models.UniqueConstraint(fields=['student', 'day'], name='attendance_rollup_uniq'),
+            models.UniqueConstraint(fields=['student'], name='attendance_rollup_total_uniq',
+                                    condition=models.Q(day__isnull=True)),
+        )
+
+    def __str__(self):
+        return f"{self.student_id} {self.day_id}: {self.present}/{self.absent}"
+
+
+class GroupAttendanceRollup(models.Model):
+    # the same counts summed over the students of a group, kept up to date by attendance and
+    # group membership writes
+    group = models.ForeignKey(
+        to='user.Group',
+        on_delete=models.CASCADE,
+        related_name='attendance_rollups'
+    )
+    day = models.ForeignKey(
+        to='course.Day',
+        on_delete=models.CASCADE,
+        related_name='group_attendance_rollups',
+        null=True,
+        blank=True
+    )
+    present = models.IntegerField(
+        default=0
+    )
+    absent = models.IntegerField(
+        default=0
+    )
+
+    class Meta:
+        verbose_name_plural = "group attendance rollups"
+        verbose_name = "group attendance rollup"
+        db_table = 'group_attendance_rollup'
+        constraints = (
+            models.UniqueConstraint(fields=['group', 'day'], name='group_attendance_rollup_uniq'),
+            models.UniqueConstraint(fields=['group'], name='group_attendance_rollup_total_uniq',
+                                    condition=models.Q(day__isnull=True)),
+        )
+
+    def __str__(self):
+        return f"{self.group_id} {self.day_id}: {self.present}/{self.absent}"
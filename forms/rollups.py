@@ -0,0 +1,148 @@
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+
+from .models import AttendanceRollup, GroupAttendanceRollup
+
+#------------------------------------------------------------------------------------------------------------#
+# Attendance rollups
+#
+# AttendanceRollup rows count a student's present and absent attendance per day, and
+# GroupAttendanceRollup rows the same summed over a group's students per day. Attendance
+# writes add the difference with present = present + delta; a student joining or leaving a
+# group adds or subtracts all of their day rows to the group's. Each student and group also has
+# a row without a day, the running total of all their days, changed by the same deltas (and
+# by the removal of a day). The attendance rate of a student or a group is then read from one
+# row, that of every group from one row per group, however long the attendance history.
+# Guests' attendance (no student) is not rolled up. rebuild_attendance_rollups recounts from
+# scratch, e.g. after attendance was written with bulk operations.
+#------------------------------------------------------------------------------------------------------------#
+STATUSES = ('present', 'absent')
+DAY_FIELDS = ('day_id', 'student_id')
+GROUP_FIELDS = ('group_id', 'day_id')
+
+
+def attendance_deltas(attendances, delta=1, deltas=None):
+    """Add ``delta`` per counted (day, student, status) among ``attendances`` to ``deltas``, and return it."""
+    deltas = Counter() if deltas is None else deltas
+    for day_id, student_id, status in attendances:
+        if day_id and student_id and status in STATUSES:
+            deltas[(day_id, student_id, status)] += delta
+    return deltas
+
+
+def _matching(fields, rows):
+    return reduce(or_, (Q(**dict(zip(fields, values))) for values in rows))
+
+
+def _apply(model, fields, deltas):
+    # {(*values of fields, status): delta}; a row only needs creating for something to add
+    deltas = {key: delta for key, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    keys = sorted(deltas, key=lambda key: tuple(str(value) for value in key))
+    rows = list(dict.fromkeys(key[:-1] for key in keys))
+    with transaction.atomic():
+        missing = list(dict.fromkeys(key[:-1] for key in keys if deltas[key] > 0))
+        if missing:
+            model.objects.bulk_create([model(**dict(zip(fields, values))) for values in missing], ignore_conflicts=True)
+        # writers lock the rows they change in one order (by pk) before changing any, so two
+        # attendance writes of the same day wait for each other instead of deadlocking
+        list(model.objects.select_for_update().filter(_matching(fields, rows)).order_by('pk').values_list('pk'))
+
+        keys_by_change = defaultdict(list)
+        for key in keys:
+            keys_by_change[(key[-1], deltas[key])].append(key[:-1])
+        # one UPDATE per status and distinct delta, usually just +1
+        for (status, delta), change_keys in sorted(keys_by_change.items()):
+            model.objects.filter(_matching(fields, change_keys)).update(**{status: F(status) + delta})
+
+
+def apply_attendance(deltas):
+    """Add ``deltas`` ({(day, student, status): delta}) to the student rollups and their groups' rollups."""
+    deltas = Counter({key: delta for key, delta in deltas.items() if delta})
+    if not deltas:
+        return
+    # the running totals change with every day
+    for (day_id, student_id, status), delta in list(deltas.items()):
+        if day_id is not None:
+            deltas[(None, student_id, status)] += delta
+    _apply(AttendanceRollup, DAY_FIELDS, deltas)
+
+    # imported here, forms loads before the user app's models
+    from user.models import GroupStudent
+    groups = defaultdict(list)
+    for student_id, group_id in GroupStudent.objects.filter(
+            student_id__in={student_id for _, student_id, _ in deltas}
+    ).values_list('student_id', 'group_id'):
+        groups[student_id].append(group_id)
+
+    group_deltas = Counter()
+    for (day_id, student_id, status), delta in deltas.items():
+        for group_id in groups[student_id]:
+            group_deltas[(group_id, day_id, status)] += delta
+    _apply(GroupAttendanceRollup, GROUP_FIELDS, group_deltas)
+
+
+def apply_membership(group_id, student_id, delta=1):
+    """Add (``delta`` 1) or subtract (-1) the day rollups and running total of a student to the group's."""
+    deltas = Counter()
+    for day_id, present, absent in AttendanceRollup.objects.filter(student_id=student_id).values_list(
+            'day_id', 'present', 'absent'):
+        deltas[(group_id, day_id, 'present')] += present * delta
+        deltas[(group_id, day_id, 'absent')] += absent * delta
+    _apply(GroupAttendanceRollup, GROUP_FIELDS, deltas)
+
+
+def remove_day(day_id):
+    """Subtract a day's rollups from the running totals, before the day takes the rollups along."""
+    deltas, group_deltas = Counter(), Counter()
+    for student_id, present, absent in AttendanceRollup.objects.filter(day_id=day_id).values_list(
+            'student_id', 'present', 'absent'):
+        deltas[(None, student_id, 'present')] -= present
+        deltas[(None, student_id, 'absent')] -= absent
+    for group_id, present, absent in GroupAttendanceRollup.objects.filter(day_id=day_id).values_list(
+            'group_id', 'present', 'absent'):
+        group_deltas[(group_id, None, 'present')] -= present
+        group_deltas[(group_id, None, 'absent')] -= absent
+    _apply(AttendanceRollup, DAY_FIELDS, deltas)
+    _apply(GroupAttendanceRollup, GROUP_FIELDS, group_deltas)
+
+
+#------------------------------------------------------------------------------------------------------------#
+def _rate(present, absent):
+    return present / (present + absent) if present + absent else None
+
+
+def _entry(row):
+    return {**row, 'rate': _rate(row['present'], row['absent'])}
+
+
+def attendance_rates(group=None, student=None, day=None, groups=None, per_day=False):
+    """
+    Present and absent counts and attendance rate of a student or a group on ``day`` or over all
+    days (and with ``per_day``, of each day), or else of every group (among ``groups`` if given)
+    on ``day`` or over all days, with their totals.
+    """
+    if student is not None:
+        rows, by = AttendanceRollup.objects.filter(student_id=student), 'day'
+    elif group is not None:
+        rows, by = GroupAttendanceRollup.objects.filter(group_id=group), 'day'
+    else:
+        rows, by = GroupAttendanceRollup.objects.all(), 'group'
+    if groups is not None and by == 'group':
+        rows = rows.filter(group_id__in=groups)
+    # over all days, the running totals
+    selected = rows.filter(day_id=day) if day is not None else rows.filter(day__isnull=True)
+
+    totals = selected.aggregate(present=Sum('present', default=0), absent=Sum('absent', default=0))
+    result = _entry(totals)
+    if by == 'group':
+        result['rows'] = [_entry(row) for row in selected.order_by('group').values('group', 'present', 'absent')]
+    elif per_day:
+        result['rows'] = [_entry(row) for row in rows.filter(day__isnull=False).order_by('day').values(
+            'day', 'present', 'absent')]
+    return result
@@ -0,0 +1,7 @@
+from django.urls import path
+
+from forms.live import FormResultsConsumer
+
+websocket_urlpatterns = [
+    path('ws/forms/<uuid:form_id>/results/', FormResultsConsumer.as_asgi(), name='form_results_live'),
+]
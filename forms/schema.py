@@ -0,0 +1,161 @@
+from urllib.parse import urlencode
+from uuid import UUID, uuid4
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.renderers import EncodedJSON
+from utils.conditional import make_etag
+from utils.jsonsql import json_for_serializer
+from utils.queryset import prefetch_for_serializer
+from .models import Form
+from .serializers import UserFormSerializer
+
+#------------------------------------------------------------------------------------------------------------#
+# Compiled form schema
+#
+# The serialized definition of an active form is cached under its version, so a warm read
+# costs no queries. Every save/delete of a Form, Question or Option bumps the version
+# (see forms.signals); old entries are never read again and simply expire.
+#------------------------------------------------------------------------------------------------------------#
+SCHEMA_TIMEOUT = getattr(settings, 'FORM_SCHEMA_CACHE_TIMEOUT', 60 * 60 * 24)
+LIST_GENERATION_KEY = 'form_schema:generation'
+
+
+def _state_key(form_id):
+    # (version, _updated_at); named apart from the plain version ints cached by older releases
+    return f'form_schema:state:{form_id}'
+
+
+def _schema_key(form_id, version):
+    return f'form_schema:{form_id}:v{version}'
+
+
+def _list_key(generation, query_params):
+    query = urlencode(sorted(query_params.lists()), doseq=True)
+    return f'form_schema:list:{generation}:{make_etag(query)}'
+
+
+def _parse_form_id(form_id):
+    try:
+        return UUID(str(form_id))
+    except ValueError:
+        return None
+
+
+def _load_form_state(form_id):
+    return Form.objects.filter(pk=form_id).values_list('version', '_updated_at').first()
+
+
+def get_form_state(form_id):
+    """(version, last modified) of a form's schema, or None if it does not exist."""
+    form_id = _parse_form_id(form_id)
+    if form_id is None:
+        return None
+
+    state = cache.get(_state_key(form_id))
+    if state is None:
+        state = _load_form_state(form_id)
+        if state is not None:
+            cache.set(_state_key(form_id), state, SCHEMA_TIMEOUT)
+    return state
+
+
+def get_form_version(form_id):
+    state = get_form_state(form_id)
+    return state[0] if state else None
+
+
+def get_form_etag(form_id, variant):
+    """Strong validator for one representation (``variant``) of a form's schema."""
+    version = get_form_version(form_id)
+    if version is None:
+        return None
+    return make_etag('form', variant, form_id, version)
+
+
+def get_form_last_modified(form_id):
+    state = get_form_state(form_id)
+    return state[1] if state else None
+
+
+def get_form_list_etag(query_params):
+    query = urlencode(sorted(query_params.lists()), doseq=True)
+    return make_etag('forms', get_list_generation(), query)
+
+
+def get_list_generation():
+    generation = cache.get(LIST_GENERATION_KEY)
+    if generation is None:
+        cache.add(LIST_GENERATION_KEY, uuid4().hex, None)
+        generation = cache.get(LIST_GENERATION_KEY)
+    return generation
+
+
+def get_compiled_form(form_id):
+    """Encoded definition of an active form, or None if there is no such form."""
+    version = get_form_version(form_id)
+    if version is None:
+        return None
+
+    key = _schema_key(form_id, version)
+    data = cache.get(key)
+    if data is None:
+        data = render_form_document(Form.objects.filter(pk=form_id, is_active=True), UserFormSerializer)
+        if data is None:
+            return None
+        cache.set(key, data, SCHEMA_TIMEOUT)
+    return data
+
+
+def render_form_document(queryset, serializer_class):
+    """
+    Encoded ``serializer_class`` document of the first form in ``queryset``, or None. With
+    FORM_SCHEMA_DATABASE_JSON the whole tree is assembled by PostgreSQL (see utils.jsonsql),
+    unless a field cannot be built in SQL.
+    """
+    if getattr(settings, 'FORM_SCHEMA_DATABASE_JSON', False):
+        try:
+            document = json_for_serializer(queryset, serializer_class)
+        except NotImplementedError:
+            pass
+        else:
+            # the same bytes as the serializer path, so both give the same ETag
+            return EncodedJSON(document.encode()) if document is not None else None
+
+    # the caller's prefetches (a view's get_queryset) give way to the serializer's own
+    form = prefetch_for_serializer(queryset.prefetch_related(None), serializer_class).first()
+    return EncodedJSON.encode(serializer_class(form).data) if form is not None else None
+
+
+def get_cached_form_list(query_params):
+    return cache.get(_list_key(get_list_generation(), query_params))
+
+
+def set_cached_form_list(query_params, data):
+    data = EncodedJSON.encode(data)
+    cache.set(_list_key(get_list_generation(), query_params), data, SCHEMA_TIMEOUT)
+    return data
+
+
+#------------------------------------------------------------------------------------------------------------#
+def invalidate_form_schema(form_id):
+    """Point readers at the committed version of a form and drop every cached list page."""
+    def _invalidate():
+        state = _load_form_state(form_id)
+        if state is None:
+            cache.delete(_state_key(form_id))
+        else:
+            cache.set(_state_key(form_id), state, SCHEMA_TIMEOUT)
+        cache.set(LIST_GENERATION_KEY, uuid4().hex, None)
+
+    transaction.on_commit(_invalidate)
+
+
+def bump_form_version(form_id):
+    # questions and options are part of the form definition, so they move its _updated_at too
+    Form.objects.filter(pk=form_id).update(version=F('version') + 1, _updated_at=timezone.now())
+    invalidate_form_schema(form_id)
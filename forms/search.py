@@ -0,0 +1,46 @@
+from django.conf import settings
+from django.contrib.postgres.search import SearchHeadline, SearchQuery, SearchRank, SearchVector
+from django.db.models import F, QuerySet, Value
+
+from core.type import QuestionType
+from .models import Answer
+
+#------------------------------------------------------------------------------------------------------------#
+# Full-text search over free-text answers
+#
+# Answers to TEXT/TEXTAREA questions carry a tsvector of their value (Answer.search_vector, GIN
+# indexed), refreshed by whoever writes the answers with one UPDATE per batch; a single save
+# computes it in its own INSERT/UPDATE (search_vector_for, see forms.signals). Searches match
+# against the index and are ranked with ts_rank. FORMS_SEARCH_CONFIG is the text search
+# configuration; 'simple' suits Persian, which PostgreSQL ships no stemmer for.
+#------------------------------------------------------------------------------------------------------------#
+SEARCHABLE_TYPES = (QuestionType.TEXT, QuestionType.TEXTAREA)
+
+
+def search_config():
+    return getattr(settings, 'FORMS_SEARCH_CONFIG', 'simple')
+
+
+def update_search_vectors(answers):
+    """Refresh the search vector of the searchable ones among ``answers`` (queryset or instances)."""
+    if not isinstance(answers, QuerySet):
+        answers = Answer.objects.filter(pk__in=[answer.pk for answer in answers])
+    return answers.filter(question__question_type__in=SEARCHABLE_TYPES).update(
+        search_vector=SearchVector('value', config=search_config())
+    )
+
+
+def search_vector_for(answer, question_type):
+    """Expression for the search vector of ``answer`` as it is saved; None for unsearchable questions."""
+    if question_type not in SEARCHABLE_TYPES or answer.value is None:
+        return None
+    return SearchVector(Value(answer.value), config=search_config())
+
+
+def search_answers(queryset, text):
+    """``queryset`` narrowed to answers matching ``text`` (web search syntax), best match first."""
+    query = SearchQuery(text, config=search_config(), search_type='websearch')
+    return queryset.filter(search_vector=query).annotate(
+        rank=SearchRank(F('search_vector'), query),
+        headline=SearchHeadline('value', query, config=search_config()),
+    ).order_by('-rank', '-_created_at')
@@ -1,7 +1,17 @@
 from rest_framework import serializers
-from core.type import QuestionType
 from .models import Form, Question, Option, Answer, Response, Attendance, Guest
+from .analytics import ANALYSES
+from .documents import build_answer_document, document_answers, uses_answer_document
+from .live import notify_results
+from .statistics import count_answers, count_responses, recount_answers
+from .search import update_search_vectors
+from .snapshots import current_snapshot_id, get_snapshot_questions
+from .validation import TYPED_FIELDS, get_validation_plan, parse_pk, set_typed_values
+from utils.audit import bulk_delete, bulk_log_create, bulk_log_update
+from collections import defaultdict
+from copy import copy
 from django.db import transaction
+from django.db.models import QuerySet
 #------------------ADMIN------------------------------------------------#
 class OptionSerializer(serializers.ModelSerializer):
     class Meta:
@@ -41,75 +51,267 @@ class UserFormSerializer(serializers.ModelSerializer):
         fields = ['id','type', 'title', 'questions']
 
 
+#------------------SUBMISSION------------------------------------------#
+def preload_submission(payloads, instances=()):
+    """
+    Forms, questions, options, days and users referenced by raw response payloads, one query
+    per model: ``{model: {pk: obj}}``.
+    """
+    related = {name: Response._meta.get_field(name).related_model for name in ('day', 'user')}
+    form_ids, question_ids, option_ids = set(), set(), set()
+    related_ids = {name: set() for name in related}
+    for instance in instances:
+        if instance is not None and instance.form_id:
+            form_ids.add(instance.form_id)
+    for payload in payloads:
+        if not hasattr(payload, 'get'):
+            continue
+        form_ids.add(parse_pk(Form, payload.get('form')))
+        for name, model in related.items():
+            related_ids[name].add(parse_pk(model, payload.get(name)))
+        answers = payload.get('answers')
+        for answer in answers if isinstance(answers, list) else ():
+            if hasattr(answer, 'get'):
+                question_ids.add(parse_pk(Question, answer.get('question')))
+                option_ids.add(parse_pk(Option, answer.get('option')))
+    for ids in (form_ids, question_ids, option_ids, *related_ids.values()):
+        ids.discard(None)
+
+    preloaded = {
+        model: model._default_manager.in_bulk(related_ids[name]) for name, model in related.items()
+    }
+    preloaded.update({
+        Form: Form.objects.in_bulk(form_ids),
+        Question: Question.objects.in_bulk(question_ids),
+        Option: Option.objects.in_bulk(option_ids),
+    })
+    return preloaded
+
+
+def _new_answer(response, answer_data):
+    answer = Answer(response=response, **answer_data)
+    set_typed_values(answer, answer.question.question_type if answer.question else None)
+    return answer
+
+
+def _same_answer(answer, answer_data):
+    # what the submission leaves out stays as stored
+    option = answer_data.get('option', answer.option_id)
+    return (answer_data.get('value', answer.value), getattr(option, 'pk', option)) == (answer.value, answer.option_id)
+
+
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Resolves ids from ``context['preloaded']`` (see preload_submission) before querying."""
+
+    def to_internal_value(self, data):
+        model = self.queryset.model
+        preloaded = self.context.get('preloaded', {}).get(model)
+        if preloaded is not None:
+            obj = preloaded.get(parse_pk(model, data))
+            if obj is not None:
+                return obj
+        return super().to_internal_value(data)
+
+
+class AnswerListSerializer(serializers.ListSerializer):
+    def get_attribute(self, instance):
+        # a response stored as one answers document (forms.documents) has no answers rows
+        if isinstance(instance, Response) and instance.answers_document is not None:
+            return document_answers(instance)
+        return super().get_attribute(instance)
+
+
 class AnswerSerializer(serializers.ModelSerializer):
-    option = serializers.PrimaryKeyRelatedField(queryset=Option.objects.all(), required=False)
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+    option = PreloadedPrimaryKeyRelatedField(queryset=Option.objects.all(), required=False)
     question_details = serializers.SerializerMethodField(read_only=True)
     class Meta:
         model = Answer
         fields = ['question','question_details', 'value', 'option']
+        list_serializer_class = AnswerListSerializer
 
     def get_question_details(self, obj):
-        return UserQuestionSerializer(obj.question).data
-    def validate(self, data):
-        question = data['question']
-
-        if question.question_type in [QuestionType.MULTIPLE_CHOICE, QuestionType.CHECKBOX]:
-            if not data.get('option'):
-                raise serializers.ValidationError("Option is required for this question type.")
-            if data['option'].question_id != question.id:
-                raise serializers.ValidationError("Selected option does not belong to this question.")
-
-        return data
+        # answers of a response share its snapshot, so look it up once per serializer tree
+        snapshot_id = obj.response.snapshot_id if obj.response_id else None
+        if snapshot_id:
+            snapshots = self.context.setdefault('snapshot_questions', {})
+            if snapshot_id not in snapshots:
+                snapshots[snapshot_id] = get_snapshot_questions(snapshot_id)
+            details = snapshots[snapshot_id].get(str(obj.question_id))
+            if details is not None:
+                return details
+        if obj.question_id is None or not obj.response_id:
+            return UserQuestionSerializer(obj.question).data
+        details = self._live_questions(obj.response.form_id).get(obj.question_id)
+        return details if details is not None else UserQuestionSerializer(obj.question).data
+
+    def _live_questions(self, form_id):
+        """
+        question id -> details of the live questions of ``form_id``, for responses without a
+        snapshot (or one older than the question): loaded once per serializer tree, with those of
+        every other form it renders.
+        """
+        forms = self.context.setdefault('live_questions', {})
+        if form_id not in forms:
+            instance = self.root.instance
+            responses = instance if isinstance(instance, (list, tuple, QuerySet)) else [instance]
+            form_ids = ({form_id} | {response.form_id for response in responses if isinstance(response, Response)}) - set(forms)
+            for loaded_form_id in form_ids:
+                forms[loaded_form_id] = {}
+            for question in Question.objects.filter(form_id__in=form_ids).prefetch_related('options'):
+                forms[question.form_id][question.pk] = UserQuestionSerializer(question).data
+        return forms[form_id]
 
 
 class ResponseSerializer(serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
     answers = AnswerSerializer(many=True)
     form_title = serializers.CharField(source='form.title', read_only=True)
     class Meta:
         model = Response
-        fields = ['id', 'form','form_title','user','day', 'answers','_created_at', '_updated_at', '_updated_by','_created_by']
+        fields = ['id', 'form','form_title','user','day','snapshot', 'answers','_created_at', '_updated_at', '_updated_by','_created_by']
+
+    def to_internal_value(self, data):
+        # a batch (many=True) preloads once for all of its items
+        if 'preloaded' not in self.context:
+            self.context['preloaded'] = preload_submission([data], [self.instance])
+        # answers are checked and read by the form's compiled plan (forms.validation) in one
+        # pass, the nested answers field then stays out of the fields run below
+        form = self._submitted_form(data)
+        self._planned_answers = None if form is None else self._validate_answers(form, data)
+        try:
+            validated_data = super().to_internal_value(data)
+        finally:
+            planned_answers, self._planned_answers = self._planned_answers, None
+        if planned_answers is not None:
+            validated_data['answers'] = planned_answers
+        return validated_data
+
+    def _validate_answers(self, form, data):
+        return get_validation_plan(form).validate(data, self.context['preloaded'])
+
+    @property
+    def _writable_fields(self):
+        for field in super()._writable_fields:
+            if field.field_name != 'answers' or getattr(self, '_planned_answers', None) is None:
+                yield field
+
+    def _submitted_form(self, data):
+        if not hasattr(data, 'get') or 'answers' not in data:
+            return None
+        if 'form' not in data:
+            return self.instance.form if self.instance is not None else None
+        form_id = parse_pk(Form, data['form'])
+        if form_id is None:
+            return None
+        form = self.context['preloaded'].get(Form, {}).get(form_id)
+        return form if form is not None else Form.objects.filter(pk=form_id).first()
 
     def validate(self, data):
-        form = data['form']
+        form = data['form'] if 'form' in data or self.instance is None else self.instance.form
         if not form.is_active:
             raise serializers.ValidationError("This form is not currently active.")
-
-
-        required_questions = form.questions.filter(is_required=True).values_list('id', flat=True)
-        answered_questions = {answer['question'].id for answer in data['answers']}
-        missing = set(required_questions) - answered_questions
-        if missing:
-            raise serializers.ValidationError(f"Required questions missing: {missing}")
         return data
 
     def create(self, validated_data):
         answers_data = validated_data.pop('answers')
         with transaction.atomic():
-            response = Response.objects.create(**validated_data)
-            for answer_data in answers_data:
-                Answer.objects.create(response=response, **answer_data)
+            document = build_answer_document(answers_data) if uses_answer_document() else None
+            response = Response.objects.create(
+                snapshot_id=current_snapshot_id(validated_data['form']),
+                answers_document=document,
+                **validated_data
+            )
+            answers = [_new_answer(response, answer_data) for answer_data in answers_data]
+            if document is None:
+                # one INSERT for all answers; bulk_create sends no signals, so write their audit log here
+                Answer.objects.bulk_create(answers)
+                bulk_log_create(answers)
+                update_search_vectors(answers)
+            count_answers(response.form, answers)
+            count_responses({response.form_id: 1})
+            notify_results(response.form_id)
         return response
 
     def update(self, instance, validated_data):
-        answers_data = validated_data.pop('answers', [])
+        answers_data = validated_data.pop('answers', None)
         with transaction.atomic():
+            notify_results(instance.form_id, validated_data['form'].pk if 'form' in validated_data else None)
+            if 'form' in validated_data and validated_data['form'].pk != instance.form_id:
+                instance.snapshot_id = current_snapshot_id(validated_data['form'])
+            # the stored answers are uncounted against the form they were given to
+            previous_form = instance.form
             for attr, value in validated_data.items():
                 setattr(instance, attr, value)
+            # a response keeps the storage it was created with; a document is simply replaced
+            # and its change logged with the response
+            if answers_data is not None and instance.answers_document is not None:
+                previous_answers = document_answers(instance)
+                instance.answers_document = build_answer_document(answers_data)
+                recount_answers(previous_form, previous_answers, instance.form,
+                                [_new_answer(instance, answer_data) for answer_data in answers_data])
             instance.save()
+            if instance.form_id != previous_form.pk:
+                count_responses({previous_form.pk: -1, instance.form_id: 1})
 
-            existing_answers = {answer.question.id: answer for answer in instance.answers.all()}
+            # a partial update without answers leaves them untouched
+            if answers_data is not None and instance.answers_document is None:
+                self.update_answers(instance, answers_data, previous_form)
 
-            for answer_data in answers_data:
-                question_id = answer_data['question'].id
-                if question_id in existing_answers:
+        return instance
 
-                    answer = existing_answers[question_id]
-                    answer.value = answer_data['value']
-                    answer.save()
+    def update_answers(self, instance, answers_data, previous_form=None):
+        """Diff the submitted answers against the stored ones (of ``previous_form``) and write only what changed."""
+        existing, submitted = defaultdict(list), defaultdict(list)
+        for answer in instance.answers.order_by('_created_at'):
+            existing[answer.question_id].append(answer)
+        for answer_data in answers_data:
+            submitted[answer_data['question'].pk].append(answer_data)
+
+        # a CHECKBOX answer is one row per option: rows still holding a submitted option/value stay
+        # as they are, the others are rewritten with what is new, then created or removed
+        changed, created, removed = [], [], []
+        for question_id in dict.fromkeys([*submitted, *existing]):
+            answers, new_answers = list(existing[question_id]), []
+            for answer_data in submitted[question_id]:
+                same = next((answer for answer in answers if _same_answer(answer, answer_data)), None)
+                if same is None:
+                    new_answers.append(answer_data)
                 else:
-                    Answer.objects.create(response=instance, **answer_data)
-
-        return instance
+                    answers.remove(same)
+
+            for answer, answer_data in zip(answers, new_answers):
+                original = copy(answer)
+                for attr in ('value', 'option'):
+                    if attr in answer_data:
+                        setattr(answer, attr, answer_data[attr])
+                set_typed_values(answer, answer_data['question'].question_type)
+                changed.append((original, answer))
+            removed.extend(answers[len(new_answers):])
+            created.extend(_new_answer(instance, answer_data) for answer_data in new_answers[len(answers):])
+
+        if changed:
+            # bulk_update skips pre_save, so stamp _updated_at/_updated_by like save() would
+            stamp_fields = [Answer._meta.get_field('_updated_at'), Answer._meta.get_field('_updated_by')]
+            for _, answer in changed:
+                for field in stamp_fields:
+                    field.pre_save(answer, add=False)
+            Answer.objects.bulk_update(
+                [answer for _, answer in changed],
+                ['value', 'option', *TYPED_FIELDS, *(field.name for field in stamp_fields)],
+            )
+            bulk_log_update(changed)
+        if created:
+            bulk_log_create(Answer.objects.bulk_create(created))
+        if changed or created:
+            update_search_vectors([*(answer for _, answer in changed), *created])
+        bulk_delete(Answer, removed)
+        recount_answers(
+            instance.form if previous_form is None else previous_form,
+            [*(original for original, _ in changed), *removed],
+            instance.form,
+            [*(answer for _, answer in changed), *created],
+        )
 
 class ResponseUserSerializer(serializers.ModelSerializer):
     form_title = serializers.CharField(source='form.title', read_only=True)
@@ -120,6 +322,32 @@ class ResponseUserSerializer(serializers.ModelSerializer):
         model = Response
         fields = ['id', 'form','first_name','last_name','form_title','user','_created_at', '_updated_at', '_updated_by','_created_by']
 
+class AnswerSearchSerializer(serializers.ModelSerializer):
+    form = serializers.UUIDField(source='response.form_id', read_only=True)
+    user = serializers.UUIDField(source='response.user_id', read_only=True)
+    question_text = serializers.CharField(source='question.text', read_only=True)
+    rank = serializers.FloatField(read_only=True)
+    headline = serializers.CharField(read_only=True)
+
+    class Meta:
+        model = Answer
+        fields = ['id', 'response', 'form', 'user', 'question', 'question_text', 'value', 'headline', 'rank', '_created_at']
+
+
+class FormAnalyticsQuerySerializer(serializers.Serializer):
+    analysis = serializers.ChoiceField(choices=ANALYSES)
+    question = serializers.UUIDField(required=False)
+    by = serializers.UUIDField(required=False)
+    day = serializers.UUIDField(required=False)
+    cohort = serializers.UUIDField(required=False)
+
+    def validate(self, data):
+        if data['analysis'] in ('crosstab', 'percentiles') and 'question' not in data:
+            raise serializers.ValidationError({'question': ["This analysis needs a question."]})
+        if data['analysis'] == 'crosstab' and 'by' not in data:
+            raise serializers.ValidationError({'by': ["A cross-tab needs a second question."]})
+        return data
+
 #------------------------------------------------------------------------------------------------------------#
 class GuestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -127,6 +355,13 @@ class GuestSerializer(serializers.ModelSerializer):
         fields = ['id','first_name', 'last_name','mobile', 'support_name', '_created_at','_created_by']
 
 
+class AttendanceRollupQuerySerializer(serializers.Serializer):
+    group = serializers.UUIDField(required=False)
+    student = serializers.UUIDField(required=False)
+    day = serializers.UUIDField(required=False)
+    per_day = serializers.BooleanField(required=False)
+
+
 class AttendanceSerializer(serializers.ModelSerializer):
     student_name = serializers.CharField(source='student.get_full_name', read_only=True)
     guest_details= GuestSerializer(many=True, read_only=True)
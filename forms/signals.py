@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.db.models import F
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+
+from .documents import stored_answers
+from .live import notify_results
+from .models import Answer, Attendance, Form, Question, Option, Response
+from .rollups import apply_attendance, apply_membership, attendance_deltas, remove_day
+from .schema import bump_form_version, invalidate_form_schema
+from .search import search_vector_for
+from .snapshots import publish_on_commit
+from .statistics import count_answers, count_responses
+from .validation import answer_question_type, set_typed_values
+
+
+def _form_id_of(sender, pk):
+    if sender is Question:
+        return Question.objects.filter(pk=pk).values_list('form_id', flat=True).first()
+    return Option.objects.filter(pk=pk).values_list('question__form_id', flat=True).first()
+
+
+#---------- form version -----------------
+@receiver(pre_save, sender=Form)
+def bump_version_on_form_save(sender, instance, **kwargs):
+    # increment in SQL so a stale in-memory instance can never write an older version back
+    if not instance._state.adding:
+        instance.version = F('version') + 1
+
+
+@receiver(post_save, sender=Form)
+def refresh_form_version(sender, instance, created, update_fields=None, **kwargs):
+    if update_fields is not None and 'version' not in update_fields:
+        bump_form_version(instance.pk)
+    if not created:
+        instance.refresh_from_db(fields=['version'])
+    invalidate_form_schema(instance.pk)
+    publish_on_commit(instance.pk)
+
+
+@receiver(post_delete, sender=Form)
+def drop_form_schema(sender, instance, **kwargs):
+    invalidate_form_schema(instance.pk)
+
+
+#---------- question / option -----------------
+@receiver(pre_save, sender=Question)
+@receiver(pre_save, sender=Option)
+def remember_previous_form(sender, instance, **kwargs):
+    instance._previous_form_id = None if instance._state.adding else _form_id_of(sender, instance.pk)
+
+
+@receiver(post_save, sender=Question)
+@receiver(post_save, sender=Option)
+def bump_version_on_save(sender, instance, **kwargs):
+    if sender is Question:
+        form_id = instance.form_id
+    else:
+        form_id = Question.objects.filter(pk=instance.question_id).values_list('form_id', flat=True).first()
+
+    for changed_form_id in {form_id, getattr(instance, '_previous_form_id', None)} - {None}:
+        bump_form_version(changed_form_id)
+        publish_on_commit(changed_form_id)
+
+
+@receiver(post_delete, sender=Question)
+@receiver(post_delete, sender=Option)
+def bump_version_on_delete(sender, instance, **kwargs):
+    if sender is Question:
+        form_id = instance.form_id
+    else:
+        form_id = Question.objects.filter(pk=instance.question_id).values_list('form_id', flat=True).first()
+
+    if form_id:
+        bump_form_version(form_id)
+        publish_on_commit(form_id)
+
+
+#---------- answer derived columns -----------------
+@receiver(pre_save, sender=Answer)
+def fill_answer_typed_values(sender, instance, **kwargs):
+    # bulk writers fill them themselves, this covers single saves (admin, import)
+    question_type = answer_question_type(instance)
+    set_typed_values(instance, question_type)
+    instance.search_vector = search_vector_for(instance, question_type)
+
+
+#---------- answer statistics -----------------
+@receiver(pre_delete, sender=Response)
+def uncount_response_answers(sender, instance, origin=None, **kwargs):
+    # a deleted form takes its questions' statistics and its response count along, nothing to subtract then
+    if isinstance(origin, Form) or getattr(origin, 'model', None) is Form:
+        return
+    count_answers(instance.form, stored_answers(instance), -1)
+    count_responses({instance.form_id: -1})
+    notify_results(instance.form_id)
+
+
+#---------- attendance rollups -----------------
+# save() runs these after its own write, outside any transaction of its own: writers of
+# attendance and of group memberships save in transaction.atomic(), so a failed delta rolls the
+# write back with it (deletes are atomic already)
+def _attendance_key(attendance):
+    return attendance.day_id, attendance.student_id, attendance.status
+
+
+@receiver(pre_save, sender=Attendance)
+def remember_previous_attendance(sender, instance, **kwargs):
+    instance._previous_attendance = None if instance._state.adding else Attendance.objects.filter(
+        pk=instance.pk).values_list('day_id', 'student_id', 'status').first()
+
+
+@receiver(post_save, sender=Attendance)
+def roll_up_attendance(sender, instance, **kwargs):
+    deltas = attendance_deltas([_attendance_key(instance)])
+    previous = getattr(instance, '_previous_attendance', None)
+    if previous:
+        attendance_deltas([previous], -1, deltas)
+    apply_attendance(deltas)
+
+
+@receiver(pre_delete, sender=Attendance)
+def roll_down_attendance(sender, instance, origin=None, **kwargs):
+    # a deleted day or student takes its rollups along (and leaves its groups), nothing to subtract then
+    options = getattr(getattr(origin, 'model', type(origin)), '_meta', None)
+    if options is not None and options.label in ('course.Day', settings.AUTH_USER_MODEL):
+        return
+    apply_attendance(attendance_deltas([_attendance_key(instance)], -1))
+
+
+@receiver(pre_delete, sender='course.Day')
+def roll_down_day(sender, instance, **kwargs):
+    # the day's own rollups go with it, its counts leave the running totals here
+    remove_day(instance.pk)
+
+
+@receiver(pre_save, sender='user.GroupStudent')
+def remember_previous_membership(sender, instance, **kwargs):
+    instance._previous_membership = None if instance._state.adding else sender.objects.filter(
+        pk=instance.pk).values_list('group_id', 'student_id').first()
+
+
+@receiver(post_save, sender='user.GroupStudent')
+def roll_up_membership(sender, instance, **kwargs):
+    previous = getattr(instance, '_previous_membership', None)
+    if previous == (instance.group_id, instance.student_id):
+        return
+    if previous:
+        apply_membership(*previous, -1)
+    apply_membership(instance.group_id, instance.student_id)
+
+
+@receiver(pre_delete, sender='user.GroupStudent')
+def roll_down_membership(sender, instance, **kwargs):
+    apply_membership(instance.group_id, instance.student_id, -1)
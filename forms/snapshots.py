@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Form, FormSnapshot, Option
+
+#------------------------------------------------------------------------------------------------------------#
+# Form snapshots
+#
+# A snapshot is an immutable, denormalized JSON copy of one version of a form definition.
+# Responses reference the snapshot they were submitted against, so rendering an old response
+# needs a single snapshot lookup (cached forever) instead of joins back to live questions.
+# Snapshots are published when a form, question or option change commits (forms.signals); a
+# submission only reads the id of its form version's snapshot (current_snapshot_id).
+#------------------------------------------------------------------------------------------------------------#
+QUESTION_FIELDS = ('id', 'name', 'max', 'min', 'text', 'description', 'category', 'placeholder',
+                   'question_type', 'is_required')
+
+
+def _snapshot_id_key(form_id, version):
+    return f'form_snapshot:id:{form_id}:v{version}'
+
+
+def _snapshot_questions_key(snapshot_id):
+    return f'form_snapshot:questions:{snapshot_id}'
+
+
+def build_form_schema(form):
+    options = {}
+    for option in Option.objects.filter(question__form=form).values('id', 'question_id', 'text'):
+        options.setdefault(option.pop('question_id'), []).append(option)
+
+    questions = []
+    for question in form.questions.values(*QUESTION_FIELDS):
+        question['options'] = options.get(question['id'], [])
+        questions.append(question)
+
+    return {
+        'id': form.id,
+        'type': form.type,
+        'title': form.title,
+        'version': form.version,
+        'questions': questions,
+    }
+
+
+def publish_form_snapshot(form):
+    """Id of the snapshot of the current version of ``form``, created on first use."""
+    snapshot_id = cache.get(_snapshot_id_key(form.pk, form.version))
+    if snapshot_id is not None:
+        return snapshot_id
+
+    with transaction.atomic():
+        # the row lock keeps question/option edits (which bump the version) out while we copy
+        form = Form.objects.select_for_update().get(pk=form.pk)
+        snapshot_id = FormSnapshot.objects.filter(form=form, version=form.version).values_list('id', flat=True).first()
+        if snapshot_id is None:
+            snapshot_id = FormSnapshot.objects.create(
+                form=form,
+                version=form.version,
+                schema=build_form_schema(form),
+            ).pk
+
+    cache.set(_snapshot_id_key(form.pk, form.version), snapshot_id, getattr(settings, 'FORM_SCHEMA_CACHE_TIMEOUT', None))
+    return snapshot_id
+
+
+def publish_on_commit(form_id):
+    """Publish the snapshot of the version ``form_id`` has once the current transaction commits, if active."""
+    def _publish():
+        form = Form.objects.filter(pk=form_id, is_active=True).first()
+        if form is not None:
+            publish_form_snapshot(form)
+
+    transaction.on_commit(_publish)
+
+
+def current_snapshot_id(form):
+    """Id of the snapshot of the loaded version of ``form``, published when that version was saved."""
+    key = _snapshot_id_key(form.pk, form.version)
+    snapshot_id = cache.get(key)
+    if snapshot_id is not None:
+        return snapshot_id
+    snapshot_id = FormSnapshot.objects.filter(form_id=form.pk, version=form.version).values_list('id', flat=True).first()
+    if snapshot_id is None:
+        # a version saved before snapshots were published on change, or whose publishing has not run yet
+        return publish_form_snapshot(form)
+    cache.set(key, snapshot_id, getattr(settings, 'FORM_SCHEMA_CACHE_TIMEOUT', None))
+    return snapshot_id
+
+
+def get_snapshot_questions(snapshot_id):
+    """question id -> question details (UserQuestionSerializer shape) as recorded in a snapshot."""
+    key = _snapshot_questions_key(snapshot_id)
+    questions = cache.get(key)
+    if questions is None:
+        schema = FormSnapshot.objects.filter(pk=snapshot_id).values_list('schema', flat=True).first() or {}
+        questions = {
+            question['id']: {**question, 'options': [option['id'] for option in question['options']]}
+            for question in schema.get('questions', [])
+        }
+        cache.set(key, questions, None)
+    return questions
@@ -0,0 +1,249 @@
+import math
+from collections import Counter, defaultdict
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q, Value
+from django.db.models.functions import Coalesce, Greatest, Least
+
+from .models import AnswerStatistic, Option, Question, ResponseCount
+from .validation import CHOICE_TYPES, NUMERIC_TYPES, get_validation_plan, parse_pk, set_typed_values
+
+#------------------------------------------------------------------------------------------------------------#
+# Per-question answer statistics
+#
+# AnswerStatistic rows count the answers to a question per option (choice questions). A numeric
+# question (NUMBER/RANGE) has one row with the count, sum, minimum and maximum of its numbers and
+# one per histogram bucket, buckets being fixed: a number's sign, decimal exponent and first digit
+# (1, 2, ... 9, 10, 20, ... 90, 100, ...), so a question has a few dozen rows whatever it is given.
+# Whoever writes or removes answers adds the difference with count = count + delta, so reading a
+# form's statistics costs one query per table, however many answers there are: option counts, and
+# mean, range, histogram and an estimated median from the numeric rows. Removing numbers does not
+# shrink the stored minimum/maximum, the emptied buckets narrow them when read.
+# ResponseCount keeps each form's number of responses the same way. Responses moved to the cold
+# archive (forms.archive) stay counted. rebuild_form_stats recounts from scratch, e.g. after
+# answers were written some other way (admin, import).
+#------------------------------------------------------------------------------------------------------------#
+EXPONENT_OFFSET = 400
+
+
+def bucket_of(value):
+    """Histogram bucket of the number ``value``: 250 and 299 share one, 300 is in the next."""
+    if value == 0:
+        return 0
+    mantissa, exponent = f'{abs(value):e}'.split('e')
+    bucket = (int(exponent) + EXPONENT_OFFSET) * 10 + int(mantissa[0])
+    return bucket if value > 0 else -bucket
+
+
+def bucket_bounds(bucket):
+    """(from, to) of the numbers in ``bucket``."""
+    if bucket == 0:
+        return 0.0, 0.0
+    exponent, digit = divmod(abs(bucket), 10)
+    scale = 10.0 ** (exponent - EXPONENT_OFFSET)
+    low, high = digit * scale, (digit + 1) * scale
+    return (low, high) if bucket > 0 else (-high, -low)
+
+
+class StatisticDeltas(Counter):
+    """
+    {(question, option, bucket): count delta} of the summary rows, the numeric questions' own row
+    keyed (question, None, None). ``numbers`` holds that row's [sum delta, lowest, highest added].
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.numbers = {}
+
+    def add_number(self, question_id, value, delta=1):
+        if not math.isfinite(value):
+            return
+        key = (question_id, None, None)
+        self[key] += delta
+        self[(question_id, None, bucket_of(value))] += delta
+        total, low, high = self.numbers.get(key, (0.0, None, None))
+        if delta > 0:
+            low = value if low is None else min(low, value)
+            high = value if high is None else max(high, value)
+        self.numbers[key] = (total + value * delta, low, high)
+
+
+def statistics_deltas(form, answers, delta=1, deltas=None):
+    """Add ``delta`` per counted answer among ``answers`` (of ``form``) to ``deltas``, and return it."""
+    deltas = StatisticDeltas() if deltas is None else deltas
+    rules = get_validation_plan(form).rules
+    for answer in answers:
+        question_id = parse_pk(Question, answer.question_id)
+        rule = rules.get(question_id)
+        if rule is None:
+            continue
+        if rule.question_type in CHOICE_TYPES:
+            option_id = parse_pk(Option, answer.option_id)
+            if option_id:
+                deltas[(question_id, option_id, None)] += delta
+        elif rule.question_type in NUMERIC_TYPES:
+            set_typed_values(answer, rule.question_type)
+            if answer.value_number is not None:
+                deltas.add_number(question_id, answer.value_number, delta)
+    return deltas
+
+
+def statistic_rows(deltas):
+    """The summary rows ``deltas`` counted from nothing, for a recount."""
+    rows = []
+    for (question_id, option_id, bucket), count in deltas.items():
+        if not count:
+            continue
+        row = AnswerStatistic(question_id=question_id, option_id=option_id, bucket=bucket, count=count)
+        if (question_id, option_id, bucket) in deltas.numbers:
+            row.total, row.minimum, row.maximum = deltas.numbers[(question_id, option_id, bucket)]
+        rows.append(row)
+    return rows
+
+
+def _ordered(keys):
+    # keys hold UUIDs, numbers and None; any fixed order will do
+    return sorted(keys, key=lambda key: tuple('' if value is None else str(value) for value in key))
+
+
+def _matching(keys):
+    return reduce(or_, (
+        Q(question_id=question_id, option_id=option_id, bucket=bucket)
+        for question_id, option_id, bucket in keys
+    ))
+
+
+def _range_update(value, bound, function):
+    # LEAST/GREATEST skip NULL on PostgreSQL but not everywhere
+    return Coalesce(function(F(bound), Value(value)), Value(value)) if value is not None else F(bound)
+
+
+def apply_statistics(deltas):
+    """Add ``deltas`` (StatisticDeltas) to the summary rows, creating missing ones."""
+    numbers = {key: number for key, number in getattr(deltas, 'numbers', {}).items()
+               if deltas[key] or number != (0.0, None, None)}
+    counts = {key: delta for key, delta in deltas.items() if delta and key not in numbers}
+    if not counts and not numbers:
+        return
+    keys = _ordered([*counts, *numbers])
+    with transaction.atomic():
+        AnswerStatistic.objects.bulk_create([
+            AnswerStatistic(question_id=question_id, option_id=option_id, bucket=bucket,
+                            total=0.0 if (question_id, option_id, bucket) in numbers else None)
+            for question_id, option_id, bucket in keys
+        ], ignore_conflicts=True)
+        # writers lock the rows they change in one order (by pk) before changing any, so two
+        # responses counting the same options wait for each other instead of deadlocking
+        list(AnswerStatistic.objects.select_for_update().filter(_matching(keys)).order_by('pk').values_list('pk'))
+
+        keys_by_delta = defaultdict(list)
+        for key in keys:
+            if key in counts:
+                keys_by_delta[counts[key]].append(key)
+        # one UPDATE per distinct delta, usually just +1, and one per numeric question
+        for delta, delta_keys in sorted(keys_by_delta.items()):
+            AnswerStatistic.objects.filter(_matching(delta_keys)).update(count=F('count') + delta)
+        for key in keys:
+            if key in numbers:
+                total, low, high = numbers[key]
+                AnswerStatistic.objects.filter(_matching([key])).update(
+                    count=F('count') + deltas[key],
+                    total=F('total') + total,
+                    minimum=_range_update(low, 'minimum', Least),
+                    maximum=_range_update(high, 'maximum', Greatest),
+                )
+
+
+def count_responses(deltas):
+    """Add ``deltas`` ({form id: delta}) to the forms' response counters, creating missing ones."""
+    deltas = {form_id: delta for form_id, delta in deltas.items() if delta and form_id is not None}
+    if not deltas:
+        return
+    form_ids = sorted(deltas, key=str)
+    with transaction.atomic():
+        ResponseCount.objects.bulk_create([ResponseCount(form_id=form_id) for form_id in form_ids],
+                                          ignore_conflicts=True)
+        # the same locking order as apply_statistics
+        list(ResponseCount.objects.select_for_update().filter(form_id__in=form_ids).order_by('pk').values_list('pk'))
+        keys_by_delta = defaultdict(list)
+        for form_id in form_ids:
+            keys_by_delta[deltas[form_id]].append(form_id)
+        for delta, delta_form_ids in sorted(keys_by_delta.items()):
+            ResponseCount.objects.filter(form_id__in=delta_form_ids).update(count=F('count') + delta)
+
+
+def count_answers(form, answers, delta=1):
+    if form is not None:
+        apply_statistics(statistics_deltas(form, answers, delta))
+
+
+def recount_answers(previous_form, previous_answers, form, answers):
+    """Subtract ``previous_answers`` (of ``previous_form``) and add ``answers`` (of ``form``) in one pass."""
+    deltas = StatisticDeltas()
+    if previous_form is not None:
+        statistics_deltas(previous_form, previous_answers, -1, deltas)
+    if form is not None:
+        statistics_deltas(form, answers, 1, deltas)
+    apply_statistics(deltas)
+
+
+#------------------------------------------------------------------------------------------------------------#
+def _median(buckets, total):
+    # average of the two middle positions (the same one if ``total`` is odd) of the sorted
+    # ``buckets``, the numbers of a bucket taken as spread evenly over it
+    middle, values, seen = [(total - 1) // 2, total // 2], [], 0
+    for low, high, count in buckets:
+        while middle and middle[0] < seen + count:
+            values.append(low + (high - low) * (middle.pop(0) - seen) / count)
+        seen += count
+    return sum(values) / 2
+
+
+def _number_statistics(summary, statistics):
+    buckets = sorted((*bucket_bounds(statistic.bucket), statistic.count) for statistic in statistics
+                     if statistic.bucket is not None and statistic.count > 0)
+    if summary is None or summary.count <= 0 or not buckets:
+        return {'answered': 0, 'mean': None, 'median': None, 'min': None, 'max': None, 'histogram': []}
+    low, high = buckets[0][0], buckets[-1][1]
+    if summary.minimum is not None:
+        low = max(low, summary.minimum)
+    if summary.maximum is not None:
+        high = min(high, summary.maximum)
+    return {
+        'answered': summary.count,
+        'mean': summary.total / summary.count,
+        'median': min(max(_median(buckets, sum(count for *_, count in buckets)), low), high),
+        'min': low,
+        'max': high,
+        'histogram': [{'from': bucket_low, 'to': bucket_high, 'count': count}
+                      for bucket_low, bucket_high, count in buckets],
+    }
+
+
+def form_statistics(form):
+    """Option counts of the choice questions and number summaries of the numeric ones of ``form``."""
+    questions = list(Question.objects.filter(form=form, question_type__in=CHOICE_TYPES | NUMERIC_TYPES)
+                     .order_by('order', '_created_at'))
+    options, counted = defaultdict(list), defaultdict(list)
+    for option in Option.objects.filter(question__in=questions).order_by('_created_at'):
+        options[option.question_id].append(option)
+    for statistic in AnswerStatistic.objects.filter(question__in=questions):
+        counted[statistic.question_id].append(statistic)
+
+    result = []
+    for question in questions:
+        entry = {'question': question.pk, 'text': question.text, 'question_type': question.question_type}
+        if question.question_type in CHOICE_TYPES:
+            option_counts = {statistic.option_id: statistic.count for statistic in counted[question.pk]}
+            entry['answered'] = sum(option_counts.values())
+            entry['options'] = [
+                {'option': option.pk, 'text': option.text, 'count': option_counts.get(option.pk, 0)}
+                for option in options[question.pk]
+            ]
+        else:
+            summary = next((statistic for statistic in counted[question.pk] if statistic.bucket is None), None)
+            entry.update(_number_statistics(summary, counted[question.pk]))
+        result.append(entry)
+    return {'form': form.pk, 'questions': result}
@@ -0,0 +1,174 @@
+from collections import Counter
+from uuid import UUID
+
+from django.db import InterfaceError, OperationalError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from utils.audit import bulk_log_create
+from utils.identifiers import generate_id
+from utils.pgcopy import bulk_copy
+from .documents import build_answer_document, document_answers, uses_answer_document
+from .live import notify_results
+from .search import update_search_vectors
+from .models import Answer, Form, Option, Response
+from .snapshots import current_snapshot_id
+from .statistics import StatisticDeltas, apply_statistics, count_responses, statistics_deltas
+from .validation import get_validation_plan, set_typed_values
+
+#------------------------------------------------------------------------------------------------------------#
+# Batched submission storage
+#
+# A submission entry is validated ResponseSerializer data reduced to ids, so it can be queued
+# as JSON (forms.ingestion) or stored right away (ResponseViewSet.batch). store_submissions
+# writes any number of entries with one COPY per table on PostgreSQL.
+#------------------------------------------------------------------------------------------------------------#
+def build_submission(validated_data, user):
+    form = validated_data['form']
+    day = validated_data.get('day')
+    return {
+        'id': generate_id().hex,
+        'form': form.pk,
+        'user': user.pk,
+        'day': day.pk if day else None,
+        'snapshot': current_snapshot_id(form),
+        # offline clients may send when the response was actually filled in
+        'submitted_at': validated_data.get('_created_at') or timezone.now(),
+        'answers': [{
+            'question': answer['question'].pk,
+            'option': answer['option'].pk if answer.get('option') else None,
+            'value': answer.get('value'),
+        } for answer in validated_data['answers']],
+    }
+
+
+def _pk(value):
+    return value if value is None or isinstance(value, UUID) else UUID(str(value))
+
+
+def check_submission(entry):
+    """Why ``entry`` is not a submission build_submission could have made, None if it is."""
+    try:
+        for field in ('id', 'form', 'user', 'day', 'snapshot'):
+            _pk(entry[field])
+        if not isinstance(entry['id'], str) or entry['form'] is None or entry['user'] is None:
+            raise ValueError("id, form and user are required")
+        if isinstance(entry['submitted_at'], str) and parse_datetime(entry['submitted_at']) is None:
+            raise ValueError(f"submitted_at {entry['submitted_at']!r} is not a datetime")
+        for answer in entry['answers']:
+            _pk(answer['question'])
+            _pk(answer['option'])
+            answer['value']
+    except (KeyError, IndexError, TypeError, ValueError, AttributeError) as error:
+        return f"Malformed submission: {error!r}"
+    return None
+
+
+def _write(entries):
+    as_document = uses_answer_document()
+    # audit entries use str(), which reads response.form and answer.option
+    forms = Form.objects.in_bulk({_pk(entry['form']) for entry in entries})
+    options = {} if as_document else Option.objects.in_bulk({
+        _pk(answer['option']) for entry in entries for answer in entry['answers'] if answer['option']
+    })
+
+    responses, answers, deltas = [], [], StatisticDeltas()
+    for entry in entries:
+        created_at = entry['submitted_at']
+        if isinstance(created_at, str):
+            created_at = parse_datetime(created_at)
+        response = Response(
+            id=UUID(entry['id']),
+            form_id=entry['form'],
+            user_id=entry['user'],
+            day_id=entry['day'],
+            snapshot_id=entry['snapshot'],
+            _created_by_id=entry['user'],
+            _created_at=created_at,
+        )
+        form = forms.get(_pk(entry['form']))
+        if form is not None:
+            response.form = form
+        responses.append(response)
+        if as_document:
+            response.answers_document = build_answer_document(entry['answers'])
+            if form is not None:
+                statistics_deltas(form, document_answers(response), deltas=deltas)
+            continue
+        # question types for the typed value columns come from the form's (cached) validation plan
+        rules = get_validation_plan(form).rules if form is not None else {}
+        entry_answers = []
+        for answer_data in entry['answers']:
+            answer = Answer(
+                response=response,
+                question_id=answer_data['question'],
+                option_id=answer_data['option'],
+                value=answer_data['value'],
+                _created_by_id=entry['user'],
+                _created_at=created_at,
+            )
+            if _pk(answer_data['option']) in options:
+                answer.option = options[_pk(answer_data['option'])]
+            rule = rules.get(_pk(answer_data['question']))
+            set_typed_values(answer, rule.question_type if rule else None)
+            entry_answers.append(answer)
+        answers.extend(entry_answers)
+        if form is not None:
+            statistics_deltas(form, entry_answers, deltas=deltas)
+
+    bulk_copy(Response, responses)
+    bulk_copy(Answer, answers)
+
+    # without a current user (ingestion worker) _updated_by is stamped empty, a new row was
+    # last updated by whoever created it
+    unstamped = [response for response in responses if response._updated_by_id is None]
+    if unstamped:
+        Response.objects.filter(pk__in=[response.pk for response in unstamped]).update(_updated_by=F('_created_by'))
+        Answer.objects.filter(response__in=unstamped).update(_updated_by=F('_created_by'))
+        for obj in (*responses, *answers):
+            if obj._updated_by_id is None:
+                obj._updated_by_id = obj._created_by_id
+
+    bulk_log_create([*responses, *answers])
+    if answers:
+        update_search_vectors(Answer.objects.filter(response__in=responses))
+    apply_statistics(deltas)
+    count_responses(Counter(response.form_id for response in responses))
+    notify_results(*(response.form_id for response in responses))
+    # foreign keys are deferred, surface a deleted form/question/option here rather than at commit
+    connection.check_constraints()
+
+
+def _connection_lost(error):
+    return isinstance(error, (OperationalError, InterfaceError)) and not connection.is_usable()
+
+
+def store_submissions(entries):
+    """
+    Store submission entries in one transaction; if that fails (e.g. a question was deleted
+    meanwhile) store them one by one. Returns ``{entry id: error}`` for entries that failed;
+    an entry whose response already exists (delivered twice) is stored, not failed. Losing the
+    database connection is not an entry's fault and raises instead.
+    """
+    if not entries:
+        return {}
+    try:
+        with transaction.atomic():
+            _write(entries)
+        return {}
+    except Exception as error:
+        if _connection_lost(error):
+            raise
+
+    failed = {}
+    for entry in entries:
+        try:
+            with transaction.atomic():
+                _write([entry])
+        except Exception as error:
+            if _connection_lost(error):
+                raise
+            if not Response.objects.filter(pk=entry['id']).exists():
+                failed[entry['id']] = str(error) or repr(error)
+    return failed
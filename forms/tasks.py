@@ -0,0 +1,19 @@
+from celery import shared_task
+from django.core.management import call_command
+
+from .ingestion import drain_submissions
+
+
+@shared_task
+def drain_submission_queue():
+    return drain_submissions()
+
+
+@shared_task
+def maintain_partitions():
+    call_command('maintain_partitions')
+
+
+@shared_task
+def archive_old_responses():
+    call_command('archive_responses')
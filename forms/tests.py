@@ -1,3 +1,823 @@
-from django.test import TestCase
+import json
+import os
+import shutil
+import tempfile
+from io import StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import pandas as pd
+import pyarrow.parquet as pq
+from uuid import UUID, uuid4
+
+from auditlog.context import set_actor
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry
+
+from django.apps import apps
+from django.core.exceptions import MiddlewareNotUsed
+from django.core.management import CommandError, call_command
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, OperationalError, connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import serializers
+from rest_framework.test import APIClient
+
+from core.models import CustomUser
+from core.renderers import EncodedJSON
+from utils.audit import bulk_delete, bulk_log_create, bulk_log_update
+from utils.identifiers import uuid7, uuid7_floor
+from utils.index_advisor import representative_params
+from utils.jsonsql import json_for_serializer
+from utils.partitions import add_months, ensure_partitions, month_start, partition_name
+from utils.query_patterns import QueryPatternMiddleware, QueryRecorder, normalize_sql, read_patterns
+from utils.queryset import prefetch_for_serializer
+from .archive import _path, archive_month, find_archived_response, read_archived_responses
+from .ingestion import QUEUED, REJECTED, STORED, FileQueue, _set_receipts, drain_submissions, get_receipt
+from .live import flushed_results_state
+from .models import Answer, AnswerStatistic, Attendance, AttendanceRollup, Form, FormSnapshot, Option, Question, Response, ResponseCount
+from .serializers import AnswerSerializer, FormSerializer, ResponseSerializer, UserFormSerializer
+from .rollups import attendance_rates
+from .search import search_answers
+from .statistics import form_statistics
+from .submissions import build_submission
+from .validation import get_validation_plan
+
+
+def make_user(role='user', number=0):
+    return CustomUser.objects.create_user(
+        mobile=f'0912000{number:04d}', password='password', email=f'user{number}@example.com', role=role)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Form schema cache and conditional GET (forms.schema)
+#------------------------------------------------------------------------------------------------------------#
+class FormCacheTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(make_user())
+        with self.captureOnCommitCallbacks(execute=True):
+            self.form = Form.objects.create(title='Check-in', type='FORM', is_active=True)
+            self.question = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+        self.url = reverse('forms:view_form-detail', args=[self.form.pk])
+
+    def test_warm_schema_is_served_without_queries(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.content, first.content)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag']).status_code, 304)
+
+    def test_edits_invalidate_the_schema_once_committed(self):
+        first = self.client.get(self.url)
+        list_url = reverse('forms:view_form-list')
+        listed = self.client.get(list_url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.question.text = 'How did it go?'
+            self.question.save()
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], first['ETag'])
+        self.assertIn('How did it go?', response.content.decode())
+        self.assertIn('How did it go?', self.client.get(list_url).content.decode())
+        self.assertNotIn('How did it go?', listed.content.decode())
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Response edits (ResponseSerializer.update)
+#------------------------------------------------------------------------------------------------------------#
+class ResponseUpdateTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.questions = [Question.objects.create(form=self.form, text=f'Question {number}', question_type='TEXT',
+                                                  order=number) for number in range(4)]
+        self.response = ResponseSerializer().create({
+            'form': self.form, 'user': self.user,
+            'answers': [{'question': question, 'value': 'before'} for question in self.questions[:3]],
+        })
+
+    def test_only_the_difference_is_written(self):
+        kept, changed, removed = (self.response.answers.get(question=question) for question in self.questions[:3])
+        LogEntry.objects.all().delete()
+        ResponseSerializer().update(self.response, {'answers': [
+            {'question': self.questions[0], 'value': 'before'},
+            {'question': self.questions[1], 'value': 'after'},
+            {'question': self.questions[3], 'value': 'new'},
+        ]})
+
+        answers = {answer.question_id: answer for answer in self.response.answers.all()}
+        self.assertEqual({question_id: answer.value for question_id, answer in answers.items()}, {
+            self.questions[0].pk: 'before', self.questions[1].pk: 'after', self.questions[3].pk: 'new',
+        })
+        self.assertEqual(answers[self.questions[0].pk]._updated_at, kept._updated_at)
+        self.assertEqual(answers[self.questions[1].pk].pk, changed.pk)
+        logged = {(entry.object_pk, entry.action) for entry in LogEntry.objects.filter(content_type__model='answer')}
+        self.assertEqual(logged, {
+            (str(changed.pk), LogEntry.Action.UPDATE),
+            (str(removed.pk), LogEntry.Action.DELETE),
+            (str(answers[self.questions[3].pk].pk), LogEntry.Action.CREATE),
+        })
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Idempotency keys (utils.idempotency)
+#------------------------------------------------------------------------------------------------------------#
+class IdempotencyTests(TestCase):
+    def setUp(self):
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+        self.client = APIClient()
+        self.client.force_authenticate(make_user())
+        self.url = reverse('forms:admin_response-list')
+
+    def submit(self, value, key='retry-1'):
+        payload = {'form': str(self.form.pk), 'answers': [{'question': str(self.question.pk), 'value': value}]}
+        return self.client.post(self.url, payload, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retried_submission_is_replayed(self):
+        first = self.submit('fine')
+        self.assertEqual(first.status_code, 201)
+        with self.assertNumQueries(0):
+            replayed = self.submit('fine')
+        self.assertEqual((replayed.status_code, replayed.content), (201, first.content))
+        self.assertEqual(replayed['Idempotent-Replayed'], 'true')
+        self.assertEqual(Response.objects.count(), 1)
+
+        self.assertEqual(self.submit('different').status_code, 400)
+        self.assertEqual(self.submit('different', key='retry-2').status_code, 201)
+        self.assertEqual(Response.objects.count(), 2)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Answer documents (forms.documents)
+#------------------------------------------------------------------------------------------------------------#
+class AnswerDocumentTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.text = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+        self.checkbox = Question.objects.create(form=self.form, text='Meals', question_type='CHECKBOX', order=2)
+        self.options = [Option.objects.create(question=self.checkbox, text=text) for text in ('Lunch', 'Dinner')]
+
+    def submit(self):
+        return ResponseSerializer().create({'form': self.form, 'user': self.user, 'answers': [
+            {'question': self.text, 'value': 'fine'},
+            *({'question': self.checkbox, 'option': option} for option in self.options),
+        ]})
+
+    def answers(self, response):
+        response = Response.objects.get(pk=response.pk)
+        return sorted(json.dumps(answer, cls=DjangoJSONEncoder, sort_keys=True)
+                      for answer in ResponseSerializer(response).data['answers'])
+
+    def test_documents_read_back_like_rows(self):
+        rows = self.submit()
+        with override_settings(FORMS_ANSWER_STORAGE='document'):
+            document = self.submit()
+
+        self.assertFalse(document.answers.exists())
+        self.assertEqual(len(Response.objects.get(pk=document.pk).answers_document[str(self.checkbox.pk)]), 2)
+        self.assertEqual(self.answers(document), self.answers(rows))
+
+    def test_rows_are_migrated_into_documents(self):
+        response = self.submit()
+        expected = self.answers(response)
+        call_command('migrate_answer_documents', stdout=StringIO())
+
+        self.assertFalse(Answer.objects.filter(response=response).exists())
+        self.assertIsNotNone(Response.objects.get(pk=response.pk).answers_document)
+        self.assertEqual(self.answers(response), expected)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Buffered ingestion (forms.ingestion)
+#------------------------------------------------------------------------------------------------------------#
+class IngestionTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, 'submissions.jsonl')
+        settings = override_settings(FORMS_INGESTION_QUEUE='forms.ingestion.FileQueue', FORMS_INGESTION_FILE=path,
+                                     FORMS_INGESTION_MAX_DELIVERIES=2)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.queue = FileQueue(path)
+
+        self.user = make_user()
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+
+    def build(self, value='fine'):
+        # an entry as read back from the queue
+        return json.loads(json.dumps(build_submission(
+            {'form': self.form, 'answers': [{'question': self.question, 'value': value}]}, self.user),
+            cls=DjangoJSONEncoder))
+
+    def enqueue(self, entry):
+        # what enqueue_submission leaves behind, without scheduling a drain
+        _set_receipts([(entry['id'], entry['user'])], QUEUED)
+        self.queue.append(entry)
+        return entry['id']
+
+    def submission(self, value='fine'):
+        return self.enqueue(self.build(value))
+
+    def test_malformed_entry_is_rejected_and_the_batch_after_it_stored(self):
+        malformed = self.enqueue({'id': uuid4().hex, 'user': str(self.user.pk), 'form': 'not-a-uuid', 'answers': None})
+        first = self.submission('first')
+        later = [self.submission(f'later {index}') for index in range(3)]
+
+        drain_submissions(batch_size=2)
+
+        self.assertEqual(get_receipt(malformed)['status'], REJECTED)
+        for receipt in [first, *later]:
+            self.assertEqual(get_receipt(receipt)['status'], STORED)
+        self.assertEqual(Response.objects.count(), 4)
+        self.assertEqual(self.queue.read(10), [])
+
+    def test_entry_the_database_refuses_is_rejected_alone(self):
+        # a form deleted since the submission was queued
+        refused = self.enqueue({**self.build(), 'form': uuid4().hex})
+        stored = self.submission()
+
+        drain_submissions()
+
+        self.assertEqual(get_receipt(refused)['status'], REJECTED)
+        self.assertEqual(get_receipt(stored)['status'], STORED)
+        self.assertEqual(self.queue.read(10), [])
+
+    def test_redelivered_entry_is_stored_once(self):
+        entry = self.build()
+        receipt = self.enqueue(entry)
+        drain_submissions()
+        # a worker that stored the entry but died before acknowledging it
+        self.queue.append(entry)
+
+        drain_submissions()
+
+        self.assertEqual(Response.objects.filter(pk=receipt).count(), 1)
+        self.assertEqual(get_receipt(receipt)['status'], STORED)
+        self.assertEqual(self.queue.read(10), [])
+
+    def test_batch_failing_as_a_whole_is_retried_then_dead_lettered(self):
+        receipt = self.submission()
+        with mock.patch('forms.ingestion.store_submissions', side_effect=OperationalError('server closed')):
+            drain_submissions()
+            drain_submissions()
+            self.assertEqual(get_receipt(receipt)['status'], QUEUED)
+            drain_submissions()
+
+        self.assertEqual(get_receipt(receipt)['status'], REJECTED)
+        self.assertEqual(self.queue.read(10), [])
+        with open(self.queue.dead_path, encoding='utf-8') as file:
+            self.assertEqual([json.loads(line)['entry']['id'] for line in file], [receipt])
+
+    def test_lost_receipt_update_still_reports_stored_response(self):
+        receipt = self.submission()
+        with mock.patch('forms.ingestion.cache.set_many', side_effect=ConnectionError('cache down')):
+            drain_submissions()
+
+        self.assertEqual(get_receipt(receipt)['status'], STORED)
+        self.assertEqual(self.queue.read(10), [])
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Compiled answer validation (forms.validation)
+#------------------------------------------------------------------------------------------------------------#
+class ValidationPlanTests(TestCase):
+    def setUp(self):
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.number = Question.objects.create(form=self.form, text='Hours?', question_type='NUMBER',
+                                              is_required=True, order=1, min=0, max=24)
+        self.choice = Question.objects.create(form=self.form, text='Mood?', question_type='RADIO', order=2)
+        self.option = Option.objects.create(question=self.choice, text='Good')
+
+    def validate(self, answers):
+        serializer = ResponseSerializer(data={'form': str(self.form.pk), 'answers': answers})
+        with mock.patch.object(AnswerSerializer, 'to_internal_value') as nested:
+            valid = serializer.is_valid()
+        nested.assert_not_called()
+        return valid, serializer
+
+    def test_plan_returns_answers_with_resolved_questions_and_options(self):
+        valid, serializer = self.validate([
+            {'question': str(self.number.pk), 'value': ' 8 '},
+            {'question': str(self.choice.pk), 'option': str(self.option.pk)},
+        ])
+
+        self.assertTrue(valid, serializer.errors)
+        self.assertEqual(serializer.validated_data['form'], self.form)
+        self.assertEqual(serializer.validated_data['answers'], [
+            {'question': self.number, 'value': '8'},
+            {'question': self.choice, 'option': self.option},
+        ])
+        self.assertIsInstance(serializer.validated_data['answers'][1]['option'], Option)
+
+    def test_plan_reports_errors_per_answer(self):
+        other = Option.objects.create(question=self.number, text='Not a choice')
+        valid, serializer = self.validate([
+            {'question': str(self.number.pk), 'value': '30'},
+            {'question': str(self.choice.pk), 'option': str(other.pk)},
+            {'question': str(uuid4()), 'value': 'x'},
+        ])
+
+        self.assertFalse(valid)
+        self.assertEqual([sorted(errors) for errors in serializer.errors['answers']], [['value'], ['option'], ['question']])
+
+    def test_missing_required_question(self):
+        valid, serializer = self.validate([{'question': str(self.choice.pk), 'option': str(self.option.pk)}])
+        self.assertFalse(valid)
+        self.assertIn('Required questions missing', str(serializer.errors))
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Monthly partitions (utils.partitions, partition_tables)
+#------------------------------------------------------------------------------------------------------------#
+RESPONSES, ANSWERS = Response._meta.db_table, Answer._meta.db_table
+
+
+@skipUnless(connection.vendor == 'postgresql', "partitioning needs PostgreSQL")
+@override_settings(TIME_ORDERED_IDS=True)
+class PartitionTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+        self.response = Response.objects.create(form=self.form, user=self.user)
+        self.answer = Answer.objects.create(response=self.response, question=self.question, value='fine')
+        # run like in a transaction of its own, without the deferred checks of the rows above
+        connection.check_constraints()
+        call_command('partition_tables', ahead=1, stdout=StringIO())
+
+    def partition_of(self, model, pk):
+        with connection.cursor() as cursor:
+            cursor.execute(f"SELECT tableoid::regclass::text FROM {model._meta.db_table} WHERE id = %s", [pk])
+            return cursor.fetchone()[0]
+
+    def test_rows_live_in_their_responses_month(self):
+        month = month_start(timezone.now())
+        self.assertEqual(self.partition_of(Response, self.response.pk), partition_name(RESPONSES, month))
+        self.assertEqual(self.partition_of(Answer, self.answer.pk), partition_name(ANSWERS, month))
+
+    def test_response_ids_stay_unique_and_referenced(self):
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Response.objects.bulk_create([Response(id=self.response.pk, form=self.form, user=self.user)])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Answer.objects.bulk_create([Answer(response_id=uuid7(), question=self.question, value='orphan')])
+            connection.check_constraints()
+
+    def test_reading_answers_by_response_scans_one_partition(self):
+        plan = Answer.objects.filter(response_id=self.response.pk).explain()
+        self.assertIn(partition_name(ANSWERS, month_start(timezone.now())), plan)
+        self.assertNotIn(f'{ANSWERS}_default', plan)
+
+    def test_new_month_takes_its_rows_out_of_the_default_partition(self):
+        month = add_months(month_start(timezone.now()), 3)
+        future = Response.objects.create(id=UUID(int=uuid7_floor(month).int + 1), form=self.form, user=self.user)
+        answer = Answer.objects.create(response=future, question=self.question, value='later')
+        self.assertEqual(self.partition_of(Response, future.pk), f'{RESPONSES}_default')
+        connection.check_constraints()
+
+        self.assertIn(partition_name(RESPONSES, month), ensure_partitions(RESPONSES, 'id', 3))
+        self.assertIn(partition_name(ANSWERS, month), ensure_partitions(ANSWERS, 'response_id', 3))
+
+        self.assertEqual(self.partition_of(Response, future.pk), partition_name(RESPONSES, month))
+        self.assertEqual(self.partition_of(Answer, answer.pk), partition_name(ANSWERS, month))
+        self.assertEqual(Response.objects.count(), 2)
+        self.assertEqual(Answer.objects.count(), 2)
+        # the answers' foreign key, dropped for the move, is back
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Answer.objects.bulk_create([Answer(response_id=uuid7(), question=self.question, value='orphan')])
+            connection.check_constraints()
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Query patterns and index advice (utils.query_patterns, utils.index_advisor, advise_indexes)
+#------------------------------------------------------------------------------------------------------------#
+class QueryPatternTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.log = os.path.join(directory, 'query_patterns.jsonl')
+
+    def test_recorded_queries_keep_parameter_types_not_values(self):
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            list(Form.objects.filter(title='private title', id__in=[uuid4(), uuid4(), uuid4()]))
+        with override_settings(QUERY_PATTERN_LOG=self.log):
+            recorder.save('FormViewSet.list')
+
+        with open(self.log, encoding='utf-8') as file:
+            self.assertNotIn('private title', file.read())
+        (sql, pattern), = read_patterns(self.log).items()
+        self.assertIn('IN (%s)', sql)
+        self.assertEqual(pattern['views'], {'FormViewSet.list'})
+        self.assertEqual(sorted(pattern['types']), ['UUID', 'str'])
+
+    def test_middleware_is_unused_while_sampling_is_off(self):
+        with override_settings(QUERY_PATTERN_SAMPLE_RATE=0), self.assertRaises(MiddlewareNotUsed):
+            QueryPatternMiddleware(lambda request: None)
+
+    @skipUnless(connection.vendor == 'postgresql', "pg_stats is PostgreSQL's")
+    def test_queries_are_explained_with_values_from_the_statistics(self):
+        Form.objects.bulk_create([Form(title='Check-in' if index % 4 else f'Survey {index}', type='FORM')
+                                  for index in range(40)])
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {Form._meta.db_table}")
+            sql, params = Form.objects.filter(title='private title').order_by('id').query.sql_with_params()
+            sql, types = normalize_sql(sql, params)
+
+            self.assertEqual(representative_params(cursor, sql, types), ['Check-in'])
+            self.assertEqual(representative_params(cursor, sql, types, given=['Survey 0']), ['Survey 0'])
+            # compared to nothing the statistics know
+            self.assertEqual(representative_params(cursor, 'SELECT %s', ['int']), [1])
+
+    def test_trial_indexes_need_a_named_database(self):
+        with self.assertRaises(CommandError):
+            call_command('advise_indexes', trial=True, log=self.log, stdout=StringIO())
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Cold archive (forms.archive)
+#------------------------------------------------------------------------------------------------------------#
+class ArchiveTests(TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        settings = override_settings(FORMS_ARCHIVE_DIR=directory)
+        settings.enable()
+        self.addCleanup(settings.disable)
+
+        self.user = make_user()
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+        self.month = month_start(timezone.now())
+
+    def respond(self, value, pk=None):
+        response = Response.objects.create(form=self.form, user=self.user, **({'id': pk} if pk else {}))
+        Answer.objects.create(response=response, question=self.question, value=value)
+        return response
+
+    def test_month_is_written_a_row_group_at_a_time(self):
+        responses = [self.respond(f'answer {index}') for index in range(5)]
+        with mock.patch('forms.archive.ROW_GROUP_SIZE', 2):
+            self.assertEqual(archive_month(self.month), 5)
+
+        self.assertEqual(pq.ParquetFile(_path('responses', self.month)).num_row_groups, 3)
+        self.assertFalse(Response.objects.exists())
+        archived = {response.pk: response for response in read_archived_responses()}
+        self.assertEqual(set(archived), {response.pk for response in responses})
+        self.assertEqual([answer.value for answer in archived[responses[0].pk].answers.all()], ['answer 0'])
+
+    def test_month_archived_again_keeps_what_was_there(self):
+        first = self.respond('first')
+        archive_month(self.month)
+        late = self.respond('late')
+        archive_month(self.month)
+
+        self.assertEqual({response.pk for response in read_archived_responses()}, {first.pk, late.pk})
+
+    def test_listing_pages_through_live_and_archived_responses(self):
+        archived = [self.respond(f'archived {index}') for index in range(3)]
+        archive_month(self.month)
+        live = [self.respond(f'live {index}') for index in range(2)]
+        client = APIClient()
+        client.force_authenticate(make_user('admin', 1))
+        url = reverse('forms:admin_response-list')
+
+        pages = [client.get(url, {'created_after': self.month.date(), 'limit': 2, 'offset': offset}).data
+                 for offset in (0, 2, 4)]
+        self.assertEqual([page['total_items'] for page in pages], [5, 5, 5])
+        self.assertEqual([item['id'] for page in pages for item in page['items']],
+                         [str(response.pk) for response in [*reversed(live), *reversed(archived)]])
+        self.assertEqual(pages[1]['items'][0]['answers'][0]['value'], 'archived 2')
+
+    def test_lookup_reads_only_the_month_of_the_response(self):
+        legacy = self.respond('legacy', pk=uuid4())
+        with override_settings(TIME_ORDERED_IDS=True):
+            recent = self.respond('recent')
+        archive_month(self.month)
+        # another month in the archive, never to be read
+        other = add_months(self.month, -1)
+        os.makedirs(os.path.dirname(_path('responses', other)), exist_ok=True)
+        shutil.copy(_path('responses', self.month), _path('responses', other))
+
+        with mock.patch('forms.archive.pd.read_parquet', wraps=pd.read_parquet) as read:
+            self.assertEqual(find_archived_response(recent.pk).answers.all()[0].value, 'recent')
+            self.assertEqual(find_archived_response(str(legacy.pk)).answers.all()[0].value, 'legacy')
+            self.assertIsNone(find_archived_response(uuid4()))
+        self.assertNotIn(_path('responses', other), [call.args[0] for call in read.call_args_list])
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Form documents built in SQL (utils.jsonsql)
+#------------------------------------------------------------------------------------------------------------#
+class AnswerNumberSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Answer
+        fields = ['id', 'value', 'value_number', 'value_bool', 'response', '_created_at']
+
+
+@skipUnless(connection.vendor == 'postgresql', "json_for_serializer needs PostgreSQL")
+class JsonSqlTests(TestCase):
+    def setUp(self):
+        self.admin = make_user('admin')
+        self.admin.first_name, self.admin.last_name = 'Zoë', 'Ñandú'
+        self.admin.save()
+        with mock.patch('django_currentuser.middleware.get_current_authenticated_user', return_value=self.admin):
+            self.form = Form.objects.create(title='Check-in "weekly"\u2028\\ \t', type='FORM')
+        question = Question.objects.create(form=self.form, text='How was it?', question_type='RADIO', order=1, max=5)
+        for text in ('Good', 'Bad'):
+            Option.objects.create(question=question, text=text)
+        # a whole second, no microseconds to print
+        Question.objects.filter(pk=question.pk).update(_created_at=timezone.now().replace(microsecond=0))
+
+    def assertSameBytes(self, queryset, serializer_class):
+        self.assertEqual(json_for_serializer(queryset, serializer_class).encode(),
+                         bytes(EncodedJSON.encode(serializer_class(queryset.get()).data)))
+
+    def test_form_documents_match_the_serializers(self):
+        for serializer_class in (FormSerializer, UserFormSerializer):
+            self.assertSameBytes(Form.objects.filter(pk=self.form.pk), serializer_class)
+
+    def test_numbers_match_the_serializer(self):
+        response = Response.objects.create(form=self.form, user=self.admin)
+        for number in (100.0, 0.1, -2.5, 1e-05, 0.0001, 1e15, 1234567890123456.5, 1e16, 1.5e300, -0.0, None):
+            answer = Answer.objects.create(response=response, value='x', value_number=number)
+            self.assertSameBytes(Answer.objects.filter(pk=answer.pk), AnswerNumberSerializer)
+
+    def test_admin_retrieve_is_the_same_with_either_path(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        url = reverse('forms:admin_form-detail', args=[self.form.pk])
+        expected = client.get(url).content
+        with override_settings(FORM_SCHEMA_DATABASE_JSON=True):
+            self.assertEqual(client.get(url).content, expected)
+            # fields SQL cannot build fall back to the serializer, scoped the same way
+            with mock.patch('forms.schema.json_for_serializer', side_effect=NotImplementedError):
+                self.assertEqual(client.get(url).content, expected)
+            with mock.patch('forms.views.AdminFormViewSet.get_queryset', return_value=Form.objects.none()):
+                self.assertEqual(client.get(url).status_code, 404)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Form snapshots (forms.snapshots)
+#------------------------------------------------------------------------------------------------------------#
+class SnapshotTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.form = Form.objects.create(title='Check-in', type='FORM')
+            self.question = Question.objects.create(form=self.form, text='How was it?', question_type='TEXT', order=1)
+
+    def current_snapshot(self):
+        self.form.refresh_from_db()
+        return FormSnapshot.objects.filter(form=self.form, version=self.form.version).first()
+
+    def test_question_changes_publish_a_snapshot_on_commit(self):
+        self.assertIsNotNone(self.current_snapshot())
+        with self.captureOnCommitCallbacks(execute=True):
+            Question.objects.create(form=self.form, text='Anything else?', question_type='TEXT', order=2)
+
+        snapshot = self.current_snapshot()
+        self.assertEqual([question['text'] for question in snapshot.schema['questions']], ['How was it?', 'Anything else?'])
+
+    def test_submission_only_reads_the_snapshot(self):
+        snapshot = self.current_snapshot()
+        with mock.patch('forms.snapshots.publish_form_snapshot') as publish:
+            response = ResponseSerializer().create({
+                'form': self.form, 'user': self.user, 'answers': [{'question': self.question, 'value': 'fine'}],
+            })
+        publish.assert_not_called()
+        self.assertEqual(response.snapshot_id, snapshot.pk)
+
+    def render_without_snapshots(self, responses, answers):
+        for _ in range(responses):
+            response = Response.objects.create(form=self.form, user=self.user)
+            Answer.objects.bulk_create([Answer(response=response, question=self.question, value='fine')
+                                        for _ in range(answers)])
+        # as ResponseViewSet lists them
+        page = list(prefetch_for_serializer(Response.objects.filter(form=self.form), ResponseSerializer))
+        with CaptureQueriesContext(connection) as context:
+            data = ResponseSerializer(page, many=True).data
+        self.assertEqual(data[0]['answers'][0]['question_details']['text'], 'How was it?')
+        Response.objects.all().delete()
+        return len(context.captured_queries)
+
+    def test_live_questions_are_loaded_once_per_page(self):
+        self.assertEqual(self.render_without_snapshots(1, 1), self.render_without_snapshots(3, 4))
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Answer save hooks (forms.signals)
+#------------------------------------------------------------------------------------------------------------#
+class AnswerSignalTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.form = Form.objects.create(title='Check-in', type='FORM')
+            self.question = Question.objects.create(form=self.form, text='Hours slept', question_type='NUMBER', order=1)
+        self.response = Response.objects.create(form=self.form, user=self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.form.refresh_from_db()
+            get_validation_plan(self.form)
+
+    def test_single_save_reads_the_question_type_from_the_plan(self):
+        answer = Answer(response=self.response, question_id=self.question.pk, value='7.5')
+        with CaptureQueriesContext(connection) as context:
+            answer.save()
+        self.assertEqual(answer.value_number, 7.5)
+        self.assertFalse([query['sql'] for query in context.captured_queries
+                          if query['sql'].startswith('SELECT') and 'FROM "question"' in query['sql']])
+
+    def test_single_save_writes_the_search_vector_with_the_answer(self):
+        text = Question.objects.create(form=self.form, text='Notes', question_type='TEXT', order=2)
+        answer = Answer(response=self.response, question=text, value='slept through the alarm')
+        with CaptureQueriesContext(connection) as context:
+            answer.save()
+        writes = [query['sql'].split()[0] for query in context.captured_queries if '"answers"' in query['sql']]
+        self.assertEqual(writes, ['INSERT'])
+        self.assertEqual(list(search_answers(Answer.objects.all(), 'alarm')), [answer])
+
+        answer = Answer(response=self.response, question=self.question, value='8')
+        answer.save()
+        self.assertIsNone(Answer.objects.get(pk=answer.pk).search_vector)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Bulk audit log (utils.audit)
+#------------------------------------------------------------------------------------------------------------#
+class AuditTests(TestCase):
+    FIELDS = ('content_type_id', 'object_pk', 'object_id', 'object_repr', 'serialized_data', 'action', 'changes',
+              'cid', 'actor_id', 'additional_data')
+
+    def setUp(self):
+        self.user = make_user()
+        self.form = Form.objects.create(title='Check-in', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='Notes', question_type='TEXT', order=1)
+        self.response = Response.objects.create(form=self.form, user=self.user)
+        self.answers = Answer.objects.bulk_create([
+            Answer(response=self.response, question=self.question, value=str(number)) for number in range(3)
+        ])
+
+    def logged(self, write):
+        LogEntry.objects.all().delete()
+        with set_actor(self.user):
+            write()
+        return [
+            {field: getattr(entry, field) for field in self.FIELDS}
+            for entry in LogEntry.objects.filter(content_type__model='answer').order_by('object_pk')
+        ]
+
+    def assertLoggedAlike(self, bulk_write, action, changes):
+        def log_one_by_one():
+            for old, new in changes:
+                LogEntry.objects.log_create(new or old, action=action, changes=model_instance_diff(old, new))
+
+        entries = self.logged(bulk_write)
+        self.assertEqual(len(entries), len(changes))
+        self.assertEqual({entry['actor_id'] for entry in entries}, {self.user.pk})
+        self.assertEqual(entries, self.logged(log_one_by_one))
+
+    def test_bulk_entries_match_log_create(self):
+        self.assertLoggedAlike(lambda: bulk_log_create(self.answers), LogEntry.Action.CREATE,
+                               [(None, answer) for answer in self.answers])
+
+        changes = []
+        for answer in self.answers:
+            changed = Answer.objects.get(pk=answer.pk)
+            changed.value = 'edited'
+            changes.append((answer, changed))
+        self.assertLoggedAlike(lambda: bulk_log_update(changes), LogEntry.Action.UPDATE, changes)
+
+        self.assertLoggedAlike(lambda: bulk_delete(Answer, self.answers), LogEntry.Action.DELETE,
+                               [(answer, None) for answer in self.answers])
+        self.assertFalse(Answer.objects.exists())
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Live results (forms.live)
+#------------------------------------------------------------------------------------------------------------#
+class LiveResultsTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.form = Form.objects.create(title='Lunch', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='Main course', question_type='RADIO', order=1)
+        self.option = Option.objects.create(question=self.question, text='Rice')
+
+    def submit(self):
+        return ResponseSerializer().create({
+            'form': self.form, 'user': self.user, 'answers': [{'question': self.question, 'option': self.option}],
+        })
+
+    def test_state_is_read_once_per_flush(self):
+        self.submit()
+        self.submit().delete()
+        self.submit()
+        with CaptureQueriesContext(connection) as context:
+            state = flushed_results_state(self.form.pk, 'flush-1')
+        # the response counter and the statistics, no count of the responses
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertEqual(state['responses'], 2)
+        self.assertEqual(state['statistics'], {(self.question.pk, self.option.pk, None): 2})
+
+        with self.assertNumQueries(0):
+            self.assertEqual(flushed_results_state(self.form.pk, 'flush-1'), state)
+        self.submit()
+        self.assertEqual(flushed_results_state(self.form.pk, 'flush-2')['responses'], 3)
+
+    def test_rebuild_recounts_the_responses(self):
+        self.submit()
+        ResponseCount.objects.update(count=7)
+        call_command('rebuild_form_stats', form=str(self.form.pk), stdout=StringIO())
+        self.assertEqual(ResponseCount.objects.get(form=self.form).count, 1)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Answer statistics (forms.statistics)
+#------------------------------------------------------------------------------------------------------------#
+class StatisticsTests(TestCase):
+    def setUp(self):
+        self.user = make_user()
+        self.form = Form.objects.create(title='Sleep', type='FORM')
+        self.question = Question.objects.create(form=self.form, text='Minutes awake', question_type='NUMBER', order=1)
+
+    def submit(self, value):
+        return ResponseSerializer().create({
+            'form': self.form, 'user': self.user, 'answers': [{'question': self.question, 'value': value}],
+        })
+
+    def summary(self):
+        return form_statistics(self.form)['questions'][0]
+
+    def test_numbers_are_summed_into_fixed_buckets(self):
+        responses = [self.submit(value) for value in ('1', '2', '3', '250', '299', '3')]
+        # the summary row and buckets 1, 2, 3 and 200-300
+        self.assertEqual(AnswerStatistic.objects.filter(question=self.question).count(), 5)
+        summary = self.summary()
+        # the median is placed within its bucket, 3 to 4
+        self.assertEqual((summary['answered'], summary['mean'], summary['median']), (6, 93.0, 3.25))
+        self.assertEqual((summary['min'], summary['max']), (1, 299))
+        self.assertEqual([bucket['count'] for bucket in summary['histogram']], [1, 1, 2, 2])
+        self.assertEqual(summary['histogram'][-1], {'from': 200.0, 'to': 300.0, 'count': 2})
+
+        for response in responses[3:5]:
+            response.delete()
+        summary = self.summary()
+        self.assertEqual((summary['answered'], summary['mean'], summary['min'], summary['max']), (4, 2.25, 1, 4.0))
+
+    def test_deltas_match_a_recount(self):
+        for value in ('0.5', '-12', '7', '7', '1e6'):
+            self.submit(value)
+        self.submit('40').delete()
+        counted = self.summary()
+        call_command('rebuild_form_stats', form=str(self.form.pk), stdout=StringIO())
+        self.assertEqual(self.summary(), counted)
+
+
+#------------------------------------------------------------------------------------------------------------#
+# Attendance rollups (forms.rollups)
+#------------------------------------------------------------------------------------------------------------#
+class AttendanceRollupTests(TestCase):
+    def setUp(self):
+        self.students = [make_user(number=number) for number in range(2)]
+        self.days = [apps.get_model('course', 'Day').objects.create() for _ in range(3)]
+        self.group = apps.get_model('user', 'Group').objects.create()
+
+    def attend(self, day, student, status):
+        with transaction.atomic():
+            return Attendance.objects.create(day=day, student=student, status=status)
+
+    def rates(self, **params):
+        return {key: value for key, value in attendance_rates(**params).items() if key != 'rows'}
+
+    def test_rates_are_read_from_the_running_totals(self):
+        apps.get_model('user', 'GroupStudent').objects.create(group=self.group, student=self.students[0])
+        for day in self.days:
+            self.attend(day, self.students[0], 'present')
+        attendance = self.attend(self.days[0], self.students[1], 'absent')
+        apps.get_model('user', 'GroupStudent').objects.create(group=self.group, student=self.students[1])
+        attendance.status = 'present'
+        with transaction.atomic():
+            attendance.save()
+        self.attend(self.days[1], self.students[1], 'absent')
+
+        with self.assertNumQueries(1):
+            self.assertEqual(self.rates(student=self.students[0].pk), {'present': 3, 'absent': 0, 'rate': 1.0})
+        self.assertEqual(self.rates(group=self.group.pk), {'present': 4, 'absent': 1, 'rate': 0.8})
+        self.assertEqual(self.rates(group=self.group.pk, day=self.days[1].pk), {'present': 1, 'absent': 1, 'rate': 0.5})
+        per_day = attendance_rates(student=self.students[1].pk, per_day=True)['rows']
+        self.assertEqual({row['day']: (row['present'], row['absent']) for row in per_day},
+                         {self.days[0].pk: (1, 0), self.days[1].pk: (0, 1)})
+
+        self.days[0].delete()
+        self.assertEqual(self.rates(group=self.group.pk), {'present': 2, 'absent': 1, 'rate': 2 / 3})
+        totals = self.rates(group=self.group.pk)
+        call_command('rebuild_attendance_rollups', stdout=StringIO())
+        self.assertEqual(self.rates(group=self.group.pk), totals)
+        self.assertEqual(AttendanceRollup.objects.filter(day__isnull=True).count(), 2)
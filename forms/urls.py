@@ -10,6 +10,7 @@ router.register(r'forms',views.PublicFormViewSet,basename='view_form')
 router.register(r'bc/response', views.ResponseBcViewSet,basename='bc_response_student')
 router.register(r'response', views.ResponseViewSet,basename='admin_response')
 router.register(r'admin/user-response', views.ResponseUserViewSet,basename='admin_response_user')
+router.register(r'admin/answer-search', views.AnswerSearchViewSet,basename='admin_answer_search')
 router.register(r'bc/attendance', views.AttendanceViewSet,basename='bc_attendance')
 router.register(r'bc/guest', views.GuestViewSet,basename='bc_guest')
 
@@ -0,0 +1,276 @@
+from collections import namedtuple
+from decimal import Decimal, InvalidOperation
+from uuid import UUID
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from rest_framework import serializers
+from rest_framework.settings import api_settings
+
+from core.type import QuestionType
+from .models import Answer, Option, Question
+
+#------------------------------------------------------------------------------------------------------------#
+# Compiled answer validation
+#
+# The rules of a form's questions are compiled once per form version into a plan that checks a
+# raw submission payload in a single pass and returns its validated answers, questions and
+# options resolved from the objects preloaded for the request (forms.serializers.preload_submission),
+# so DRF's nested answer fields do not run. Editing a question or option bumps the form version
+# (see forms.signals), so a stale plan is never looked up again.
+#------------------------------------------------------------------------------------------------------------#
+PLAN_TIMEOUT = getattr(settings, 'FORM_SCHEMA_CACHE_TIMEOUT', 60 * 60 * 24)
+LOCAL_PLANS_MAX_SIZE = 256
+
+NUMERIC_TYPES = frozenset((QuestionType.NUMBER, QuestionType.RANGE))
+CHOICE_TYPES = frozenset((QuestionType.MULTIPLE_CHOICE, QuestionType.CHECKBOX, QuestionType.RADIO))
+OPTION_REQUIRED_TYPES = frozenset((QuestionType.MULTIPLE_CHOICE, QuestionType.CHECKBOX))
+VALUE_TYPES = NUMERIC_TYPES | {QuestionType.BOOL, QuestionType.DATE}
+TRUE_VALUES = frozenset(('true', '1', 'yes'))
+BOOLEAN_VALUES = TRUE_VALUES | {'false', '0', 'no'}
+TYPED_FIELDS = ('value_number', 'value_bool', 'value_date')
+
+QuestionRule = namedtuple('QuestionRule', ('question_type', 'is_required', 'min', 'max', 'options'))
+
+_local_plans = {}
+
+
+def parse_pk(model, value):
+    if not isinstance(value, (str, int, UUID)):
+        return None
+    try:
+        return model._meta.pk.to_python(value)
+    except DjangoValidationError:
+        return None
+
+
+def _is_blank(value):
+    return value is None or (isinstance(value, str) and not value.strip())
+
+
+def _parse_number(value):
+    if isinstance(value, bool):
+        return None
+    try:
+        number = Decimal(str(value).strip())
+    except InvalidOperation:
+        return None
+    return number if number.is_finite() else None
+
+
+def _parse_boolean(value):
+    if isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    return value in TRUE_VALUES if value in BOOLEAN_VALUES else None
+
+
+def _parse_date(value):
+    try:
+        return parse_date(str(value).strip())
+    except ValueError:
+        return None
+
+
+def _check_number(rule, value):
+    number = _parse_number(value)
+    if number is None:
+        return "A valid number is required."
+    if rule.min is not None and number < rule.min:
+        return f"Ensure this value is greater than or equal to {rule.min}."
+    if rule.max is not None and number > rule.max:
+        return f"Ensure this value is less than or equal to {rule.max}."
+    return None
+
+
+def _check_boolean(value):
+    return "Must be a valid boolean." if _parse_boolean(value) is None else None
+
+
+def _check_date(value):
+    return "Date has wrong format. Use YYYY-MM-DD." if _parse_date(value) is None else None
+
+
+def set_typed_values(answer, question_type):
+    """Fill the typed copies of ``answer.value`` (TYPED_FIELDS) for the question's type."""
+    value = None if _is_blank(answer.value) else answer.value
+    number = _parse_number(value) if value is not None and question_type in NUMERIC_TYPES else None
+    answer.value_number = float(number) if number is not None else None
+    answer.value_bool = _parse_boolean(value) if value is not None and question_type == QuestionType.BOOL else None
+    answer.value_date = _parse_date(value) if value is not None and question_type == QuestionType.DATE else None
+
+
+def _resolve(model, value, preloaded):
+    pk = parse_pk(model, value)
+    if pk is None:
+        return None
+    obj = preloaded.get(model, {}).get(pk)
+    return obj if obj is not None else model.objects.filter(pk=pk).first()
+
+
+def _clean_value(value):
+    """Answer.value as AnswerSerializer's CharField reads it, or an error."""
+    if value is None:
+        return None, None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float, Decimal)):
+        return None, "Not a valid string."
+    return str(value).strip(), None
+
+
+class ValidationPlan:
+    def __init__(self, rules):
+        self.rules = rules
+        self.required = frozenset(question_id for question_id, rule in rules.items() if rule.is_required)
+
+    def _check_answer(self, question_id, answer):
+        rule = self.rules.get(question_id)
+        if rule is None:
+            return {'question': ["Question does not belong to this form."]}
+
+        if rule.question_type in CHOICE_TYPES:
+            option = answer.get('option')
+            if option is None:
+                if rule.question_type in OPTION_REQUIRED_TYPES:
+                    return {'option': ["Option is required for this question type."]}
+            elif option.pk not in rule.options:
+                return {'option': ["Selected option does not belong to this question."]}
+            return {}
+
+        value = answer.get('value')
+        if _is_blank(value):
+            if rule.is_required and rule.question_type in VALUE_TYPES:
+                return {'value': ["A value is required for this question."]}
+            return {}
+        if rule.question_type in NUMERIC_TYPES:
+            error = _check_number(rule, value)
+        elif rule.question_type == QuestionType.BOOL:
+            error = _check_boolean(value)
+        elif rule.question_type == QuestionType.DATE:
+            error = _check_date(value)
+        else:
+            error = None
+        return {'value': [error]} if error else {}
+
+    def _read_answer(self, answer, preloaded):
+        """The validated data of one raw answer (the fields AnswerSerializer writes) and its errors."""
+        if not hasattr(answer, 'get'):
+            return None, {api_settings.NON_FIELD_ERRORS_KEY: [
+                f"Invalid data. Expected a dictionary, but got {type(answer).__name__}."
+            ]}
+        validated, errors = {}, {}
+        for name, model in (('question', Question), ('option', Option)):
+            if name not in answer or (name == 'question' and answer[name] is None):
+                continue
+            if answer[name] is None:
+                errors[name] = ["This field may not be null."]
+                continue
+            obj = _resolve(model, answer[name], preloaded)
+            if obj is None:
+                errors[name] = [f'Invalid pk "{answer[name]}" - object does not exist.']
+            else:
+                validated[name] = obj
+        if 'value' in answer:
+            validated['value'], error = _clean_value(answer['value'])
+            if error:
+                errors['value'] = [error]
+
+        if not errors and 'question' in validated:
+            errors = self._check_answer(validated['question'].pk, validated)
+        return validated, errors
+
+    def validate(self, data, preloaded):
+        """
+        The validated ``answers`` of a raw submission payload, raising a DRF ValidationError;
+        None if they are not a list, for the answers field to report.
+        """
+        answers = data.get('answers')
+        if not isinstance(answers, list):
+            return None
+
+        validated, errors, answered = [], [], set()
+        for answer in answers:
+            answer_data, answer_errors = self._read_answer(answer, preloaded)
+            validated.append(answer_data)
+            errors.append(answer_errors)
+            if answer_data and 'question' in answer_data:
+                answered.add(answer_data['question'].pk)
+
+        if any(errors):
+            raise serializers.ValidationError({'answers': errors})
+        missing = set(self.required) - answered
+        if missing:
+            raise serializers.ValidationError({
+                api_settings.NON_FIELD_ERRORS_KEY: [f"Required questions missing: {missing}"],
+            })
+        return validated
+
+
+#------------------------------------------------------------------------------------------------------------#
+def _plan_key(form_id, version):
+    return f'form_validator:{form_id}:v{version}'
+
+
+def compile_validation_plan(form_id):
+    options = {}
+    for question_id, option_id in Option.objects.filter(question__form_id=form_id).values_list('question_id', 'id'):
+        options.setdefault(question_id, set()).add(option_id)
+
+    rules = {}
+    for question in Question.objects.filter(form_id=form_id).values('id', 'question_type', 'is_required', 'min', 'max'):
+        rules[question['id']] = QuestionRule(
+            question['question_type'],
+            bool(question['is_required']),
+            question['min'],
+            question['max'],
+            frozenset(options.get(question['id'], ())),
+        )
+    return ValidationPlan(rules)
+
+
+def _remember(key, plan):
+    if len(_local_plans) >= LOCAL_PLANS_MAX_SIZE:
+        _local_plans.clear()
+    _local_plans[key] = plan
+    cache.set(key, plan, PLAN_TIMEOUT)
+
+
+def get_validation_plan(form):
+    """Validation plan of the loaded version of ``form``; compiled on first use."""
+    return _get_plan(form.pk, form.version)
+
+
+def _get_plan(form_id, version):
+    key = _plan_key(form_id, version)
+    plan = _local_plans.get(key)
+    if plan is not None:
+        return plan
+
+    plan = cache.get(key)
+    if plan is not None:
+        _local_plans[key] = plan
+        return plan
+
+    plan = compile_validation_plan(form_id)
+    # a plan read inside a transaction that edits the form must not outlive a rollback
+    transaction.on_commit(lambda: _remember(key, plan))
+    return plan
+
+
+def answer_question_type(answer):
+    """Type of the question ``answer`` answers, without loading the question: the one already on
+    the answer, else its rule in the cached plan of the response's form, else a single column."""
+    if answer.question_id is None:
+        return None
+    if Answer.question.is_cached(answer):
+        return answer.question.question_type
+    if Answer.response.is_cached(answer):
+        from .schema import get_form_version
+
+        version = get_form_version(answer.response.form_id)
+        rule = _get_plan(answer.response.form_id, version).rules.get(answer.question_id) if version else None
+        if rule is not None:
+            return rule.question_type
+    return Question.objects.filter(pk=answer.question_id).values_list('question_type', flat=True).first()
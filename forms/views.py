@@ -3,16 +3,39 @@ from rest_framework.viewsets import ModelViewSet
 
 from forms.models import Response as ResponseModel
 from utils.paginations import CustomLimitOffsetPagination
+from utils.queryset import prefetch_for_serializer
 from user.models import GroupStudent
-from .models import Form, Attendance, Question, Option, Guest
+from .models import Form, Attendance, Question, Option, Guest, Answer
 from .serializers import FormSerializer, UserFormSerializer, ResponseSerializer, AttendanceSerializer, \
-    QuestionSerializer, GuestSerializer, ResponseUserSerializer
-from rest_framework import viewsets, permissions
+    QuestionSerializer, GuestSerializer, ResponseUserSerializer, AnswerSearchSerializer, FormAnalyticsQuerySerializer, \
+    AttendanceRollupQuerySerializer, preload_submission
+from rest_framework import viewsets, permissions, mixins
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
 from rest_framework.filters import OrderingFilter, SearchFilter
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
+from rest_framework.decorators import action
 from django_filters.rest_framework import DjangoFilterBackend
+from django_filters import rest_framework as filters
+from django.db.models import Exists, OuterRef
+from django.conf import settings
+from django.db import transaction
+from django.http import Http404
+import operator
+from .schema import get_compiled_form, get_cached_form_list, set_cached_form_list, get_form_etag, \
+    get_form_last_modified, get_form_list_etag, get_form_version, render_form_document
+from utils.conditional import conditional_get
+from utils.idempotency import idempotent
+from .ingestion import enqueue_submission, get_receipt, uses_async_ingestion
+from .submissions import build_submission, store_submissions
+from .search import search_answers
+from .statistics import form_statistics
+from .analytics import analyze
+from .rollups import attendance_rates
+from .validation import parse_pk
+from .archive import MergedResponses, archived_months, find_archived_response, read_archived_responses
+from utils.partitions import add_months
 #---------create -update -delete -----------------
 class AdminFormViewSet(viewsets.ModelViewSet):
     queryset = Form.objects.all()
@@ -24,6 +47,26 @@ class AdminFormViewSet(viewsets.ModelViewSet):
     ordering_fields = ('_created_at', '_updated_at')
     search_fields = ('_created_by__first_name','_created_by__last_name','title')
 
+    def get_queryset(self):
+        return prefetch_for_serializer(super().get_queryset(), self.get_serializer_class())
+
+    @conditional_get(
+        lambda view, request, *args, **kwargs: get_form_etag(kwargs[view.lookup_field], 'admin'),
+        lambda view, request, *args, **kwargs: get_form_last_modified(kwargs[view.lookup_field]),
+    )
+    def retrieve(self, request, *args, **kwargs):
+        if not getattr(settings, 'FORM_SCHEMA_DATABASE_JSON', False):
+            return super().retrieve(request, *args, **kwargs)
+
+        form_id = kwargs[self.lookup_field]
+        data = None
+        if get_form_version(form_id) is not None:
+            # scoped like get_object: the view's queryset and filters
+            queryset = self.filter_queryset(self.get_queryset()).filter(pk=form_id)
+            data = render_form_document(queryset, self.get_serializer_class())
+        if data is None:
+            raise NotFound()
+        return Response(data)
 
     def perform_create(self, serializer):
         serializer.save(_created_by=self.request.user)
@@ -31,7 +74,31 @@ class AdminFormViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save(_created_by=self.request.user)
 
+    @action(detail=True, methods=['get'])
+    def stats(self, request, *args, **kwargs):
+        # read from the summary rows of forms.statistics, not from the answers
+        return Response(form_statistics(self._results_form(request, kwargs)))
+
+    @action(detail=True, methods=['get'])
+    def analytics(self, request, *args, **kwargs):
+        form = self._results_form(request, kwargs)
+        query = FormAnalyticsQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        result = analyze(form, **query.validated_data)
+        if result is None:
+            raise ValidationError({'question': ["Not a question of this form this analysis applies to."]})
+        return Response(result)
+
+    def _results_form(self, request, kwargs):
+        if request.user.role not in ['superuser', 'admin']:
+            raise PermissionDenied()
+        form = Form.objects.filter(pk=parse_pk(Form, kwargs[self.lookup_field])).first()
+        if form is None:
+            raise NotFound()
+        return form
+
 class QuestionCreateView(APIView):
+    @idempotent
     def post(self, request, form_id):
         try:
             form = Form.objects.get(id=form_id)
@@ -46,12 +113,14 @@ class QuestionCreateView(APIView):
         serializer.is_valid(raise_exception=True)
 
         created_questions = []
-        for question_data in serializer.validated_data:
-            options_data = question_data.pop('options', [])
-            question = Question.objects.create(form=form, **question_data)
-            options = [Option(question=question, **opt) for opt in options_data]
-            Option.objects.bulk_create(options)
-            created_questions.append(question)
+        # one transaction, so the form schema version is only published once all options exist
+        with transaction.atomic():
+            for question_data in serializer.validated_data:
+                options_data = question_data.pop('options', [])
+                question = Question.objects.create(form=form, **question_data)
+                options = [Option(question=question, **opt) for opt in options_data]
+                Option.objects.bulk_create(options)
+                created_questions.append(question)
 
         response_data = QuestionSerializer(created_questions, many=True).data
         return Response(response_data, status=status.HTTP_201_CREATED)
@@ -63,6 +132,9 @@ class AdminQuestionViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     pagination_class = CustomLimitOffsetPagination
 
+    def get_queryset(self):
+        return prefetch_for_serializer(super().get_queryset(), self.get_serializer_class())
+
     def perform_create(self, serializer):
         serializer.save(_created_by=self.request.user)
 
@@ -78,6 +150,26 @@ class PublicFormViewSet(viewsets.ReadOnlyModelViewSet):
     filter_backends = (DjangoFilterBackend, OrderingFilter)
     filterset_fields = ['_created_by','type']
     ordering_fields = ('_created_at', '_updated_at')
+
+    def get_queryset(self):
+        return prefetch_for_serializer(super().get_queryset(), self.get_serializer_class())
+
+    @conditional_get(lambda view, request, *args, **kwargs: get_form_list_etag(request.query_params))
+    def list(self, request, *args, **kwargs):
+        data = get_cached_form_list(request.query_params)
+        if data is None:
+            data = set_cached_form_list(request.query_params, super().list(request, *args, **kwargs).data)
+        return Response(data)
+
+    @conditional_get(
+        lambda view, request, *args, **kwargs: get_form_etag(kwargs[view.lookup_field], 'public'),
+        lambda view, request, *args, **kwargs: get_form_last_modified(kwargs[view.lookup_field]),
+    )
+    def retrieve(self, request, *args, **kwargs):
+        data = get_compiled_form(kwargs[self.lookup_field])
+        if data is None:
+            raise NotFound()
+        return Response(data)
 #---------- bc get response ---------
 class ResponseBcViewSet(viewsets.ModelViewSet):
     queryset = ResponseModel.objects.all()
@@ -92,13 +184,93 @@ class ResponseBcViewSet(viewsets.ModelViewSet):
         return ResponseModel.objects.filter(_created_by=self.request.user)
 
 #---------- user get response ---------
+class ResponseFilter(filters.FilterSet):
+    """
+    Responses with an answer matching all given answer filters, e.g.
+    ``?question=<id>&number_min=3&number_max=5``; compared on the typed value columns.
+    """
+    ANSWER_LOOKUPS = {
+        'number_min': 'value_number__gte',
+        'number_max': 'value_number__lte',
+        'bool': 'value_bool',
+        'date_after': 'value_date__gte',
+        'date_before': 'value_date__lte',
+    }
+    question = filters.UUIDFilter(method='filter_answer')
+    number_min = filters.NumberFilter(method='filter_answer')
+    number_max = filters.NumberFilter(method='filter_answer')
+    bool = filters.BooleanFilter(method='filter_answer')
+    date_after = filters.DateFilter(method='filter_answer')
+    date_before = filters.DateFilter(method='filter_answer')
+    created = filters.DateFromToRangeFilter(field_name='_created_at')
+
+    class Meta:
+        model = ResponseModel
+        fields = ['_created_by', 'user', 'form']
+
+    def filter_answer(self, queryset, name, value):
+        # combined in filter_queryset, all conditions must hold for the same answer
+        return queryset
+
+    def answer_conditions(self):
+        data = self.form.cleaned_data
+        conditions = {lookup: data[name] for name, lookup in self.ANSWER_LOOKUPS.items() if data.get(name) is not None}
+        if data.get('question') is not None:
+            conditions['question'] = data['question']
+        return conditions
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        conditions = self.answer_conditions()
+        if conditions:
+            queryset = queryset.filter(Exists(Answer.objects.filter(response=OuterRef('pk'), **conditions)))
+        return queryset
+
+    def archived_responses(self, user=None):
+        """
+        Archived responses (forms.archive) matching the filters, or None if the created range
+        does not reach back into the archive. ``user`` limits them to that user's responses.
+        """
+        data = self.form.cleaned_data
+        created = data.get('created')
+        months = archived_months()
+        if not created or created.start is None or not months or created.start >= add_months(months[-1], 1):
+            return None
+
+        columns = {attname: data[name].pk for name, attname in (('_created_by', '_created_by_id'), ('user', 'user_id'),
+                                                               ('form', 'form_id')) if data.get(name) is not None}
+        if user is not None:
+            if columns.setdefault('user_id', user.pk) != user.pk:
+                return []
+        responses = read_archived_responses(created.start, created.stop, **columns)
+
+        conditions = self.answer_conditions()
+        if conditions:
+            responses = [response for response in responses
+                         if any(_answer_matches(answer, conditions) for answer in response.answers.all())]
+        return responses
+
+
+ANSWER_OPERATORS = {'': operator.eq, 'gte': operator.ge, 'lte': operator.le}
+
+
+def _answer_matches(answer, conditions):
+    # the ResponseFilter answer lookups, evaluated on an archived answer
+    for lookup, expected in conditions.items():
+        attname, _, operation = lookup.partition('__')
+        value = answer.question_id if attname == 'question' else getattr(answer, attname)
+        if value is None or not ANSWER_OPERATORS[operation](value, expected):
+            return False
+    return True
+
+
 class ResponseViewSet(viewsets.ModelViewSet):
     queryset = ResponseModel.objects.all()
     serializer_class = ResponseSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CustomLimitOffsetPagination
     filter_backends = (DjangoFilterBackend, OrderingFilter)
-    filterset_fields = ['_created_by','user','form']
+    filterset_class = ResponseFilter
     ordering_fields = ('_created_at', '_updated_at')
 
     def get_queryset(self):
@@ -106,16 +278,132 @@ class ResponseViewSet(viewsets.ModelViewSet):
             return ResponseModel.objects.all()
         return ResponseModel.objects.filter(user=self.request.user)
 
+    def list(self, request, *args, **kwargs):
+        archived = self._archived_responses(request)
+        if not archived:
+            return super().list(request, *args, **kwargs)
+
+        # the created range reaches the cold archive (forms.archive): merge both sources
+        queryset = self.filter_queryset(self.get_queryset())
+        ordering = (OrderingFilter().get_ordering(request, queryset, self) or ['-_created_at'])[0]
+        rows = MergedResponses(queryset, archived, ordering)
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.get_serializer(page, many=True).data)
+        return Response(self.get_serializer(list(rows), many=True).data)
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve':
+                raise
+            # archived responses are read-only, only retrieve falls through to the archive
+            response = find_archived_response(self.kwargs[self.lookup_field])
+            if response is None or not (self.request.user.role in ['superuser', 'admin']
+                                        or response.user_id == self.request.user.pk):
+                raise
+            return response
+
+    def _archived_responses(self, request):
+        filterset = ResponseFilter(request.query_params, queryset=self.get_queryset(), request=request)
+        if not filterset.is_valid():
+            return None
+        return filterset.archived_responses(None if request.user.role in ['superuser', 'admin'] else request.user)
+
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        if not uses_async_ingestion(serializer.validated_data['form']):
+            self.perform_create(serializer)
+            headers = self.get_success_headers(serializer.data)
+            return Response(serializer.data, status=status.HTTP_201_CREATED, headers=headers)
+
+        # buffered ingestion: stored later in a batch, see forms.ingestion
+        receipt = enqueue_submission(serializer.validated_data, request.user)
+        return Response(self._receipt_data(get_receipt(receipt)), status=status.HTTP_202_ACCEPTED)
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Store many responses (offline clients) at once and report the outcome of each item."""
+        items = request.data.get('responses') if isinstance(request.data, dict) else request.data
+        if not isinstance(items, list) or not items:
+            raise ValidationError({'responses': ["Expected a non-empty list of responses."]})
+        max_size = getattr(settings, 'FORMS_BATCH_MAX_SIZE', 500)
+        if len(items) > max_size:
+            raise ValidationError({'responses': [f"At most {max_size} responses per batch."]})
+
+        # every item is validated against the same forms/questions/options, loaded once
+        context = {**self.get_serializer_context(), 'preloaded': preload_submission(items)}
+        report, entries = [], []
+        for index, item in enumerate(items):
+            serializer = self.get_serializer(data=item, context=context)
+            if serializer.is_valid():
+                entry = build_submission(serializer.validated_data, request.user)
+                entries.append(entry)
+                report.append({'index': index, 'status': 'created', 'id': entry['id'], 'errors': None})
+            else:
+                report.append({'index': index, 'status': 'invalid', 'id': None, 'errors': serializer.errors})
+
+        failed = store_submissions(entries)
+        for item in report:
+            if item['id'] in failed:
+                item.update(status='failed', errors={'non_field_errors': [failed.pop(item['id'])]}, id=None)
+
+        created = sum(item['status'] == 'created' for item in report)
+        return Response({'created': created, 'rejected': len(report) - created, 'items': report})
+
+    @action(detail=False, methods=['get'], url_path=r'receipts/(?P<receipt>[0-9a-f]{32})')
+    def receipt(self, request, receipt=None):
+        data = get_receipt(receipt)
+        if data is None or (data['user'] != str(request.user.pk) and request.user.role not in ['superuser', 'admin']):
+            raise NotFound()
+        return Response(self._receipt_data(data))
+
+    def _receipt_data(self, data):
+        return {key: data[key] for key in ('receipt', 'status', 'response', 'errors')}
+
+#---------- answer full-text search ---------
+class AnswerSearchFilter(filters.FilterSet):
+    q = filters.CharFilter(method='filter_search', required=True)
+    form = filters.UUIDFilter(field_name='response__form')
+    user = filters.UUIDFilter(field_name='response__user')
+    date = filters.DateFromToRangeFilter(field_name='_created_at')
+
+    class Meta:
+        model = Answer
+        fields = ['question']
+
+    def filter_search(self, queryset, name, value):
+        return search_answers(queryset, value)
+
+
+class AnswerSearchViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Ranked full-text search over TEXT/TEXTAREA answers: ``?q=...&form=&user=&date_after=&date_before=``."""
+    queryset = Answer.objects.select_related('response', 'question')
+    serializer_class = AnswerSearchSerializer
+    permission_classes = [IsAuthenticated]
+    pagination_class = CustomLimitOffsetPagination
+    filter_backends = (DjangoFilterBackend,)
+    filterset_class = AnswerSearchFilter
+
+    def get_queryset(self):
+        if self.request.user.role in ['superuser', 'admin']:
+            return super().get_queryset()
+        return super().get_queryset().filter(response__user=self.request.user)
+
+
 class ResponseUserViewSet(viewsets.ModelViewSet):
     queryset = ResponseModel.objects.all()
     serializer_class = ResponseUserSerializer
     permission_classes = [IsAuthenticated]
     pagination_class = CustomLimitOffsetPagination
     filter_backends = (DjangoFilterBackend, OrderingFilter)
-    filterset_fields = ['_created_by','user','form']
+    filterset_class = ResponseFilter
     ordering_fields = ('_created_at', '_updated_at')
 
 
@@ -153,6 +441,45 @@ class AttendanceViewSet(ModelViewSet):
 
         return Attendance.objects.none()
 
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+
+    # the rollups (forms.rollups) change in the attendance's transaction, or not at all;
+    # a delete already runs in one
+    def perform_create(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    def perform_update(self, serializer):
+        with transaction.atomic():
+            serializer.save()
+
+    @action(detail=False, methods=['get'])
+    def rollup(self, request, *args, **kwargs):
+        # read from the summary rows of forms.rollups, not from attendance
+        query = AttendanceRollupQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        params, user = query.validated_data, request.user
+
+        if user.is_superuser or user.role == 'admin':
+            return Response(attendance_rates(**params))
+
+        elif user.role == 'bc':
+            group_students = GroupStudent.objects.filter(group__business_coach=user)
+            if 'student' in params and not group_students.filter(student_id=params['student']).exists():
+                raise PermissionDenied()
+            if 'group' in params and not group_students.filter(group_id=params['group']).exists():
+                raise PermissionDenied()
+            return Response(attendance_rates(**params, groups=group_students.values('group_id')))
+
+        elif user.role == 'user':
+            if params.get('student', user.pk) != user.pk or 'group' in params:
+                raise PermissionDenied()
+            return Response(attendance_rates(**{**params, 'student': user.pk}))
+
+        raise PermissionDenied()
+
 class GuestViewSet(viewsets.ModelViewSet):
     queryset = Guest.objects.all()
     serializer_class = GuestSerializer
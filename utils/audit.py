@@ -0,0 +1,63 @@
+from auditlog.context import auditlog_disabled, disable_auditlog
+from auditlog.diff import model_instance_diff
+from auditlog.models import LogEntry, LogEntryManager
+from django.db.models.signals import pre_save
+
+from utils.pgcopy import bulk_copy
+
+#------------------------------------------------------------------------------------------------------------#
+# Bulk audit log
+#
+# The entries are built by auditlog's own LogEntry.objects.log_create, on a manager whose create()
+# collects instead of saving, then inserted together. The actor comes from auditlog.context.set_actor,
+# a LogEntry pre_save receiver, so that signal is sent for each entry as save() would. This relies on
+# how django-auditlog 3.1 builds its entries (pinned in requirements.txt); forms.tests.AuditTests
+# compares the result with log_create's.
+#------------------------------------------------------------------------------------------------------------#
+class _EntryCollector(LogEntryManager):
+    def __init__(self):
+        super().__init__()
+        self.model = LogEntry
+        self.entries = []
+
+    def create(self, **kwargs):
+        entry = self.model(**kwargs)
+        self.entries.append(entry)
+        return entry
+
+
+def bulk_log_changes(action, changes):
+    """
+    Audit log for objects written with bulk_create/bulk_update, which send no model signals.
+    ``changes`` is an iterable of ``(old, new)`` instances (``old`` is None for creates, ``new``
+    for deletes); the entries match what auditlog's receivers would have written and are inserted in one query.
+    """
+    if auditlog_disabled.get():
+        return []
+
+    collector = _EntryCollector()
+    for old, new in changes:
+        diff = model_instance_diff(old, new)
+        if diff:
+            collector.log_create(new if new is not None else old, action=action, changes=diff)
+
+    for entry in collector.entries:
+        pre_save.send(sender=LogEntry, instance=entry, raw=False, using=LogEntry.objects.db, update_fields=None)
+    return bulk_copy(LogEntry, collector.entries, using=LogEntry.objects.db)
+
+
+def bulk_log_create(instances):
+    return bulk_log_changes(LogEntry.Action.CREATE, ((None, instance) for instance in instances))
+
+
+def bulk_log_update(changes):
+    return bulk_log_changes(LogEntry.Action.UPDATE, changes)
+
+
+def bulk_delete(model, instances):
+    """Delete ``instances`` in one statement with a single audit log insert for all of them."""
+    if not instances:
+        return
+    with disable_auditlog():
+        model._default_manager.filter(pk__in=[instance.pk for instance in instances]).delete()
+    bulk_log_changes(LogEntry.Action.DELETE, ((instance, None) for instance in instances))
@@ -0,0 +1,51 @@
+import hashlib
+from functools import wraps
+
+from django.conf import settings
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+
+
+def make_etag(*parts):
+    return hashlib.md5(':'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def conditional_get(etag_func, last_modified_func=None):
+    """
+    Viewset method decorator answering If-None-Match/If-Modified-Since with a 304 before the
+    view runs. ``etag_func``/``last_modified_func`` receive the same arguments as the method
+    and may return None to skip validation (e.g. the object does not exist).
+
+    Responses are marked public but keyed on Authorization, so a local reverse proxy may keep
+    them for FORM_SCHEMA_PROXY_MAX_AGE seconds and revalidate afterwards.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            etag = etag_func(self, request, *args, **kwargs)
+            etag = quote_etag(etag) if etag is not None else None
+            last_modified = last_modified_func(self, request, *args, **kwargs) if last_modified_func else None
+            last_modified = last_modified.timestamp() if last_modified is not None else None
+
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view_method(self, request, *args, **kwargs)
+
+            if response.status_code in (200, 304):
+                if etag:
+                    response.headers.setdefault('ETag', etag)
+                if last_modified:
+                    response.headers.setdefault('Last-Modified', http_date(last_modified))
+                patch_cache_control(
+                    response,
+                    public=True,
+                    max_age=0,
+                    s_maxage=getattr(settings, 'FORM_SCHEMA_PROXY_MAX_AGE', 0),
+                    must_revalidate=True,
+                )
+                patch_vary_headers(response, ('Authorization',))
+            return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,76 @@
+import json
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.exceptions import Conflict
+from core.renderers import EncodedJSON
+from utils.conditional import make_etag
+
+HEADER = 'Idempotency-Key'
+REPLAYED_HEADER = 'Idempotent-Replayed'
+# how long a request holding a key may run before another one may take it over
+LOCK_TIMEOUT = 60
+
+
+def _fingerprint(request):
+    body = json.dumps(request.data, cls=JSONEncoder, sort_keys=True, default=str)
+    return make_etag(request.method, request.get_full_path(), body)
+
+
+def _replay(stored):
+    response = Response(EncodedJSON(stored['content']), status=stored['status'])
+    for header, value in stored['headers'].items():
+        response[header] = value
+    response[REPLAYED_HEADER] = 'true'
+    return response
+
+
+def idempotent(view_method):
+    """
+    Honor an ``Idempotency-Key`` header on a view method that creates something. The first
+    successful response is stored for IDEMPOTENCY_KEY_TTL seconds; repeating the request with
+    the same key replays it without running the view. A concurrent request with the key gets
+    409 right away, rather than holding a worker until the first finishes. Reusing a key for a
+    different request is a validation error. Failed requests store nothing and may be retried.
+    Keys are scoped per user; anonymous callers would share one scope and are not replayed.
+    """
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        key = request.headers.get(HEADER)
+        if not key or not request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+        if len(key) > 255:
+            raise ValidationError({HEADER: ["Idempotency key is longer than 255 characters."]})
+
+        scope = make_etag(request.user.pk, request.path, key)
+        response_key, lock_key = f'idempotency:{scope}', f'idempotency:{scope}:lock'
+        fingerprint = _fingerprint(request)
+        ttl = getattr(settings, 'IDEMPOTENCY_KEY_TTL', 60 * 60 * 24)
+
+        stored = cache.get(response_key)
+        if stored is not None:
+            if stored['fingerprint'] != fingerprint:
+                raise ValidationError({HEADER: ["Idempotency key was already used for a different request."]})
+            return _replay(stored)
+        if not cache.add(lock_key, fingerprint, LOCK_TIMEOUT):
+            raise Conflict("A request with this idempotency key is still in progress.")
+
+        try:
+            response = view_method(self, request, *args, **kwargs)
+            if 200 <= response.status_code < 300:
+                cache.set(response_key, {
+                    'fingerprint': fingerprint,
+                    'status': response.status_code,
+                    'content': bytes(EncodedJSON.encode(response.data)),
+                    'headers': {header: response[header] for header in ('Location',) if response.has_header(header)},
+                }, ttl)
+            return response
+        finally:
+            cache.delete(lock_key)
+
+    return wrapper
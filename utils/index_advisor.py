@@ -0,0 +1,194 @@
+import json
+import re
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
+from uuid import UUID
+
+from django.db import models
+from django.db.models import Q
+
+from utils.partitions import PARTITION_NAME, is_partitioned
+
+#------------------------------------------------------------------------------------------------------------#
+# Index advisor
+#
+# Reads PostgreSQL plans (EXPLAIN FORMAT JSON) of recorded queries (utils.query_patterns): a
+# sequential scan, or an index scan that still filters rows or feeds a sort, is a table a better
+# index could serve. The index proposed is the usual one: equality columns first, then the sort
+# columns, or else the first range column; IS [NOT] NULL conditions make it partial. Its benefit
+# is the planner's cost of the query without and with it, the index being hypothetical (hypopg)
+# or built concurrently and dropped again (--trial, on a database named explicitly).
+#
+# Recorded queries carry no parameter values (utils.query_patterns): they are explained with
+# values given by the caller, else the most common value (or the median of the histogram) of
+# the column each parameter is compared to, from pg_stats, else a neutral value of its type.
+#------------------------------------------------------------------------------------------------------------#
+STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+CAST = re.compile(r'::[\w ]+(?:\[\])?')
+CONDITION = re.compile(r'(?:"?(\w+)"?\.)?"?(\w+)"?\s+(IS NOT NULL|IS NULL|=|>=|<=|>|<)')
+SCANS = ('Seq Scan', 'Index Scan', 'Index Only Scan', 'Bitmap Heap Scan')
+SORTS = ('Sort', 'Incremental Sort')
+SORT_KEY = re.compile(r'^(?:"?(\w+)"?\.)?"?(\w+)"?(?: (DESC|ASC))?')
+# the column a placeholder is compared to, from the SQL before it
+COMPARED = re.compile(r'"(\w+)"\."(\w+)"(?:::\w+)?\s*(?:=|<>|>=|<=|>|<|IN \(|I?LIKE)\s*(?:UPPER\()?$')
+NEUTRAL_VALUES = {
+    'bool': True, 'int': 1, 'float': 1.0, 'Decimal': Decimal(1), 'str': '', 'UUID': UUID(int=0),
+    'date': date(2000, 1, 1), 'time': time(0), 'datetime': datetime(2000, 1, 1, tzinfo=timezone.utc),
+}
+
+
+def explain(cursor, sql, params):
+    cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']
+
+
+def column_value(cursor, table, column):
+    """A representative value of ``table.column`` from the planner's statistics, as text, or None."""
+    cursor.execute(
+        "SELECT (most_common_vals::text::text[])[1], (histogram_bounds::text::text[])"
+        "[array_length(histogram_bounds::text::text[], 1) / 2 + 1] FROM pg_stats "
+        "WHERE schemaname = current_schema() AND tablename = %s AND attname = %s "
+        "ORDER BY inherited DESC LIMIT 1", [table, column]
+    )
+    row = cursor.fetchone()
+    return row and (row[0] if row[0] is not None else row[1])
+
+
+def representative_params(cursor, sql, types, given=None):
+    """
+    Parameters to explain a recorded query (``types`` from utils.query_patterns.normalize_sql)
+    with: the ``given`` ones, else values of the compared columns from pg_stats, else neutral
+    values of their types.
+    """
+    if given is not None:
+        return list(given)
+    params, placeholders = [], [match.start() for match in re.finditer(r'%s', sql.replace('%%', '__'))]
+    for position, type_name in zip(placeholders, types):
+        value = None
+        compared = COMPARED.search(sql[:position])
+        if compared:
+            value = column_value(cursor, parent_table(compared.group(1)), compared.group(2))
+        params.append(value if value is not None else NEUTRAL_VALUES.get(type_name))
+    return params
+
+
+def _nodes(plan, parent=None):
+    yield plan, parent
+    for child in plan.get('Plans', ()):
+        yield from _nodes(child, plan)
+
+
+def parent_table(relation):
+    """The table a partition (utils.partitions) belongs to."""
+    return PARTITION_NAME.sub('', relation.removesuffix('_default'))
+
+
+def scan_candidates(plan):
+    """
+    (table, equal, ranges, nulls, order) for every scan a better index could serve: sequential
+    scans, and index scans that still filter rows or feed a sort.
+    """
+    for node, parent in _nodes(plan):
+        if node['Node Type'] not in SCANS:
+            continue
+        sorted_ = parent is not None and parent['Node Type'] in SORTS
+        if node['Node Type'] != 'Seq Scan' and 'Filter' not in node and not sorted_:
+            continue
+        alias = node.get('Alias', node['Relation Name'])
+        condition = ' AND '.join(node[key] for key in ('Index Cond', 'Recheck Cond', 'Filter') if key in node)
+        condition = CAST.sub('', STRING_LITERAL.sub("''", condition))
+        equal, ranges, nulls = [], [], {}
+        # ORed conditions are not served by one btree index
+        if ' OR ' not in condition:
+            for qualifier, column, operator in CONDITION.findall(condition):
+                if qualifier and qualifier != alias:
+                    continue
+                if operator == '=':
+                    equal.append(column)
+                elif operator.startswith('IS'):
+                    nulls[column] = operator == 'IS NULL'
+                else:
+                    ranges.append(column)
+
+        order = []
+        if sorted_:
+            for key in parent['Sort Key']:
+                qualifier, column, direction = SORT_KEY.match(key).groups()
+                if qualifier and qualifier != alias:
+                    order = []
+                    break
+                order.append((column, direction == 'DESC'))
+
+        if equal or ranges or nulls or order:
+            yield parent_table(node['Relation Name']), equal, ranges, nulls, order
+
+
+def propose_index(model, equal, ranges, nulls, order):
+    """The index serving a scan of ``model``'s table, or None if it has no usable column."""
+    fields = {field.column: field.name for field in model._meta.concrete_fields}
+    names = list(dict.fromkeys(fields[column] for column in equal if column in fields))
+    if order:
+        names += [f'-{fields[column]}' if descending else fields[column]
+                  for column, descending in order if column in fields and fields[column] not in names]
+    elif ranges:
+        names += [fields[column] for column in ranges[:1] if column in fields and fields[column] not in names]
+    if not names:
+        return None
+
+    index = models.Index(fields=names)
+    index.set_name_with_model(model)
+    condition = Q(**{f'{fields[column]}__isnull': isnull for column, isnull in nulls.items() if column in fields})
+    if not condition:
+        return index
+    return models.Index(fields=names, condition=condition, name=index.name[:-len('idx')] + 'pix')
+
+
+def is_covered(existing, model, index):
+    """Whether an index or key of the table starts with the columns of ``index``."""
+    columns = [model._meta.get_field(name.lstrip('-')).column for name in index.fields]
+    return any(
+        (constraint['index'] or constraint['primary_key'] or constraint['unique'])
+        and constraint['columns'][:len(columns)] == columns
+        for constraint in existing.values()
+    )
+
+
+def has_hypopg(cursor):
+    cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'hypopg'")
+    return cursor.fetchone() is not None
+
+
+def estimate_cost(connection, model, index, sql, params, hypothetical, trial):
+    """
+    Total plan cost of the query with ``index`` in place, or None if it cannot be estimated. A
+    trial index is built concurrently, so writes go on meanwhile, and dropped again; partitioned
+    tables cannot build indexes concurrently and are not estimated that way.
+    """
+    if not hypothetical and not trial:
+        return None
+    with connection.cursor() as cursor:
+        if hypothetical:
+            with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+                statement = str(index.create_sql(model, editor))
+            cursor.execute("SELECT * FROM hypopg_create_index(%s)", [statement])
+            try:
+                return explain(cursor, sql, params)['Total Cost']
+            finally:
+                cursor.execute("SELECT hypopg_reset()")
+        if is_partitioned(cursor, model._meta.db_table):
+            return None
+
+    with connection.schema_editor(collect_sql=True, atomic=False) as editor:
+        statement = str(index.create_sql(model, editor, concurrently=True))
+        drop = str(index.remove_sql(model, editor, concurrently=True))
+    # concurrent builds run outside a transaction, the finally clause drops the index (or what
+    # is left of it after a failed build)
+    with connection.cursor() as cursor:
+        try:
+            cursor.execute(statement)
+            return explain(cursor, sql, params)['Total Cost']
+        finally:
+            cursor.execute(drop)
@@ -0,0 +1,195 @@
+import json
+
+from django.core.exceptions import EmptyResultSet
+from django.db import connections, models, transaction
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.relations import ManyRelatedField, PrimaryKeyRelatedField
+from rest_framework.settings import api_settings
+
+from utils.queryset import _get_field
+
+# model fields whose column value to_json renders the way DRF does
+PLAIN_FIELDS = (
+    models.UUIDField, models.CharField, models.TextField, models.IntegerField, models.BooleanField,
+)
+# serializer fields rendering their value with str(), or as is
+PLAIN_SERIALIZER_FIELDS = (
+    serializers.UUIDField, serializers.CharField, serializers.IntegerField, serializers.BooleanField,
+    serializers.ChoiceField, serializers.ReadOnlyField, serializers.ModelField,
+)
+
+
+def _encode_key(name):
+    # the way JSONRenderer writes an object key (ensure_ascii off, compact separators)
+    return json.dumps(name, ensure_ascii=False) + ':'
+
+
+class _Planner:
+    """
+    Turns a serializer tree into one SQL expression building the JSON text JSONRenderer would
+    write for it: compact, keys in the serializer's order, values formatted like DRF and json do.
+    """
+
+    def __init__(self, connection):
+        self.quote_name = connection.ops.quote_name
+        self.params = []
+        self.aliases = 0
+
+    def new_alias(self):
+        self.aliases += 1
+        return f't{self.aliases}'
+
+    def column(self, alias, column):
+        return f'{self.quote_name(alias)}.{self.quote_name(column)}'
+
+    def json(self, sql):
+        # to_json escapes strings like json with ensure_ascii off; SQL NULL is JSON null
+        return f"COALESCE(to_json({sql})::text, 'null')"
+
+    def datetime(self, sql):
+        # isoformat() in the session time zone: no fraction when it is zero, 'Z' for UTC
+        return (
+            f"COALESCE('\"' || regexp_replace(to_char({sql}, 'YYYY-MM-DD\"T\"HH24:MI:SS.US'), '\\.000000$', '')"
+            f" || replace(to_char({sql}, 'TZH:TZM'), '+00:00', 'Z') || '\"', 'null')"
+        )
+
+    def float(self, sql):
+        # float.__repr__: shortest digits like PostgreSQL, but fixed notation from 1e-4 up to 1e16
+        # (PostgreSQL switches to exponents at 1e15) and always with a fraction ('100.0')
+        return (
+            f"CASE WHEN {sql} IS NULL THEN 'null'"
+            f" WHEN {sql} = 0 THEN {sql}::text || '.0'"
+            f" WHEN abs({sql}) >= 1e-4 AND abs({sql}) < 1e16 THEN {sql}::text::numeric::text"
+            f" || CASE WHEN {sql}::text::numeric = trunc({sql}::text::numeric) THEN '.0' ELSE '' END"
+            f" ELSE {sql}::text END"
+        )
+
+    def order_by(self, model, alias):
+        ordering = []
+        for name in model._meta.ordering or ():
+            field = _get_field(model, name.lstrip('-'))
+            if field is None or not field.concrete:
+                raise NotImplementedError(f"Cannot order {model.__name__} by {name!r} in SQL.")
+            ordering.append(f"{self.column(alias, field.column)}{' DESC' if name.startswith('-') else ''}")
+        return f" ORDER BY {', '.join(ordering)}" if ordering else ''
+
+    def reverse_agg(self, model_field, parent_alias, value):
+        """JSON array text of ``value(alias)`` over the rows of a reverse foreign key, [] when there are none."""
+        related_model = model_field.related_model
+        alias = self.new_alias()
+        return (
+            f"COALESCE((SELECT '[' || string_agg({value(alias)}, ','{self.order_by(related_model, alias)}) || ']'"
+            f" FROM {self.quote_name(related_model._meta.db_table)} {self.quote_name(alias)}"
+            f" WHERE {self.column(alias, model_field.field.column)}"
+            f" = {self.column(parent_alias, model_field.field.target_field.column)}), '[]')"
+        )
+
+    def display_user(self, model, name, alias):
+        # mirrors GenericModel.created_by/updated_by
+        relation = model._meta.get_field(model.property_relations[name])
+        user_alias = self.new_alias()
+        return self.json(
+            f"(SELECT COALESCE(NULLIF(btrim({self.column(user_alias, 'first_name')} || ' ' || "
+            f"{self.column(user_alias, 'last_name')}), ''), {self.column(user_alias, 'email')})"
+            f" FROM {self.quote_name(relation.related_model._meta.db_table)} {self.quote_name(user_alias)}"
+            f" WHERE {self.column(user_alias, relation.target_field.column)} = {self.column(alias, relation.column)})"
+        )
+
+    def value(self, model, field, alias):
+        attrs = field.source_attrs
+        model_field = _get_field(model, attrs[0]) if len(attrs) == 1 else None
+
+        if isinstance(field, serializers.ListSerializer) and model_field is not None and model_field.one_to_many:
+            return self.reverse_agg(model_field, alias, lambda child: self.object(
+                model_field.related_model, field.child, child))
+
+        if isinstance(field, ManyRelatedField) and model_field is not None and model_field.one_to_many \
+                and isinstance(field.child_relation, PrimaryKeyRelatedField) and field.child_relation.pk_field is None:
+            return self.reverse_agg(model_field, alias, lambda child: self.json(self.column(
+                child, model_field.related_model._meta.pk.column)))
+
+        if isinstance(field, PrimaryKeyRelatedField) and field.pk_field is None \
+                and model_field is not None and model_field.many_to_one:
+            return self.json(self.column(alias, model_field.column))
+
+        if len(attrs) == 1 and attrs[0] in getattr(model, 'property_relations', {}):
+            return self.display_user(model, attrs[0], alias)
+
+        if model_field is not None and model_field.concrete and not model_field.is_relation:
+            column = self.column(alias, model_field.column)
+            if isinstance(field, serializers.DateTimeField) and isinstance(model_field, models.DateTimeField):
+                if getattr(field, 'format', api_settings.DATETIME_FORMAT) != ISO_8601 or hasattr(field, 'timezone'):
+                    raise NotImplementedError(f"Field {field.field_name!r} uses a custom datetime format.")
+                return self.datetime(column)
+            if type(field) is serializers.FloatField and isinstance(model_field, models.FloatField):
+                return self.float(column)
+            if type(field) is serializers.DecimalField and isinstance(model_field, models.DecimalField) \
+                    and field.decimal_places == model_field.decimal_places and not field.localize \
+                    and not field.normalize_output:
+                # quantized to the column's own scale, so its text is str() of the quantized value;
+                # not coerced to a string, JSONEncoder writes it as a float
+                return self.json(f'{column}::text') if field.coerce_to_string else self.float(f'{column}::float8')
+            if isinstance(field, serializers.UUIDField) and field.uuid_format != 'hex_verbose':
+                raise NotImplementedError(f"Field {field.field_name!r} uses a custom uuid format.")
+            if isinstance(model_field, PLAIN_FIELDS) and isinstance(field, PLAIN_SERIALIZER_FIELDS) \
+                    and not isinstance(field, serializers.MultipleChoiceField):
+                return self.json(column)
+
+        raise NotImplementedError(f"Field {field.field_name!r} of {type(field.parent).__name__} cannot be built in SQL.")
+
+    def object(self, model, serializer, alias):
+        members = []
+        for name, field in serializer.fields.items():
+            if field.write_only:
+                continue
+            self.params.append(_encode_key(name))
+            members.append(f"%s || {self.value(model, field, alias)}")
+        body = " || ',' || ".join(members) if members else "''"
+        return f"'{{' || {body} || '}}'"
+
+
+def json_for_serializer(queryset, serializer):
+    """
+    JSON text of the first object of ``queryset`` as ``serializer`` would render it, assembled by
+    PostgreSQL in a single query, or None if the queryset is empty. Python only passes the text
+    through, so no model instances are built for large nested trees.
+
+    Only plain columns, datetimes, floats, decimals at their column's scale, foreign key ids,
+    display user properties and reverse relations (nested or as id lists, ordered by
+    Meta.ordering) are supported; anything else raises NotImplementedError. The text is the
+    bytes JSONRenderer writes for the serializer's data, except for non-finite floats, which it
+    refuses and which are written NaN/Infinity here.
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql':
+        raise NotImplementedError("json_for_serializer needs PostgreSQL.")
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    model = queryset.model
+    planner = _Planner(connection)
+    document = planner.object(model, serializer, 't0')
+    try:
+        pk_sql, pk_params = queryset.values('pk').query.get_compiler(using=queryset.db).as_sql()
+    except EmptyResultSet:
+        return None
+    # JSONRenderer escapes U+2028/U+2029 for JavaScript
+    sql = (
+        f"SELECT replace(replace({document}, U&'\\2028', '\\u2028'), U&'\\2029', '\\u2029')"
+        f" FROM {planner.quote_name(model._meta.db_table)} {planner.quote_name('t0')}"
+        f" WHERE {planner.column('t0', model._meta.pk.column)} IN ({pk_sql}) LIMIT 1"
+    )
+
+    with transaction.atomic(using=queryset.db), connection.cursor() as cursor:
+        # DRF renders datetimes in the current time zone, so format them in it too; the caller's
+        # transaction gets its own back (a failed query's savepoint rollback restores it anyway)
+        cursor.execute("SELECT current_setting('TimeZone'), set_config('TimeZone', %s, true)",
+                       [timezone.get_current_timezone_name()])
+        previous = cursor.fetchone()[0]
+        cursor.execute(sql, [*planner.params, *pk_params])
+        row = cursor.fetchone()
+        cursor.execute("SELECT set_config('TimeZone', %s, true)", [previous])
+    return row[0] if row else None
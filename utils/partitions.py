@@ -0,0 +1,212 @@
+import re
+from datetime import datetime
+
+from django.db import connections, transaction
+from django.utils import timezone
+
+from utils.identifiers import uuid7_floor, uuid7_time
+
+#------------------------------------------------------------------------------------------------------------#
+# Monthly range partitioning (PostgreSQL)
+#
+# A table converted by convert_to_partitioned is declaratively partitioned by RANGE on a uuid
+# column holding uuid7 ids (TIME_ORDERED_IDS), one partition per calendar month (in TIME_ZONE)
+# of the ids' time, named <table>_pYYYY_MM, plus <table>_default for anything outside them
+# (random uuid4 ids from before uuid7). PostgreSQL requires the partition key in every unique
+# constraint: partitioned on its own id, a table keeps its primary key (id), globally unique,
+# and the foreign keys pointing at it; partitioned on a parent's id (answers on response_id),
+# its rows live in their parent's month, so reading them by parent scans one partition, and
+# its primary key becomes (id, column). Ids stay unique across partitions as generated ids
+# (never reused: a response is written once with its answers, see forms.submissions), but
+# the database only checks that within a partition.
+#
+# A month's partition is created with rows of that month moved out of the default partition
+# first (their bounds would overlap, which PostgreSQL refuses): they are deleted into a
+# temporary table, the partition is created, and the rows are inserted back through the
+# parent, landing in the new partition. Foreign keys of other tables pointing at the table
+# are dropped for the move and added back, which validates them again (a scan of those
+# tables). All in the caller's transaction, which must have no pending deferred checks on
+# these tables. Without such rows (the usual case) the partition is just created.
+#------------------------------------------------------------------------------------------------------------#
+PARTITION_NAME = re.compile(r'_p(\d{4})_(\d{2})$')
+
+
+def month_start(value):
+    value = timezone.localtime(value)
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return timezone.make_aware(datetime(index // 12, index % 12 + 1, 1), month.tzinfo)
+
+
+def partition_name(table, month):
+    return f'{table}_p{month:%Y_%m}'
+
+
+def is_partitioned(cursor, table):
+    cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [table])
+    return cursor.fetchone() is not None
+
+
+def list_partitions(cursor, table):
+    """Names of the monthly partitions of ``table`` with the month each one holds."""
+    cursor.execute(
+        "SELECT child.relname FROM pg_inherits JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+        "WHERE pg_inherits.inhparent = to_regclass(%s)", [table]
+    )
+    partitions = {}
+    for name, in cursor.fetchall():
+        match = PARTITION_NAME.search(name)
+        if match and name == f'{table}{match.group(0)}':
+            partitions[name] = timezone.make_aware(datetime(int(match.group(1)), int(match.group(2)), 1))
+    return partitions
+
+
+def month_bounds(month):
+    """The uuid7 range [from, to) of the ids created in ``month``."""
+    return [str(uuid7_floor(month)), str(uuid7_floor(add_months(month, 1)))]
+
+
+def _referencing_keys(cursor, table):
+    """Foreign keys of other tables pointing at ``table``, as (relation, name, definition)."""
+    # constraints PostgreSQL cloned per partition (conparentid) come and go with their parent
+    cursor.execute(
+        "SELECT conrelid::regclass::text, conname, pg_get_constraintdef(oid) FROM pg_constraint "
+        "WHERE confrelid = to_regclass(%s) AND contype = 'f' AND conparentid = 0", [table]
+    )
+    return cursor.fetchall()
+
+
+def _create_partition(cursor, quote_name, table, column, month):
+    name, default = partition_name(table, month), f'{table}_default'
+    bounds = month_bounds(month)
+    where = f"{quote_name(column)} >= %s AND {quote_name(column)} < %s"
+    cursor.execute(f"SELECT 1 FROM {quote_name(default)} WHERE {where} LIMIT 1", bounds)
+    if cursor.fetchone() is None:
+        cursor.execute(
+            f"CREATE TABLE {quote_name(name)} PARTITION OF {quote_name(table)} FOR VALUES FROM (%s) TO (%s)", bounds
+        )
+        return name
+
+    # rows of that month that landed in the default partition must move, or the new
+    # partition's bounds would overlap them; foreign keys pointing at them are dropped
+    # meanwhile (PostgreSQL checks them per partition) and validated again afterwards
+    referencing = _referencing_keys(cursor, table)
+    for relation, key, _ in referencing:
+        cursor.execute(f"ALTER TABLE {relation} DROP CONSTRAINT {quote_name(key)}")
+    cursor.execute(
+        f"CREATE TEMPORARY TABLE partition_moved AS "
+        f"WITH moved AS (DELETE FROM {quote_name(default)} WHERE {where} RETURNING *) SELECT * FROM moved", bounds
+    )
+    cursor.execute(
+        f"CREATE TABLE {quote_name(name)} PARTITION OF {quote_name(table)} FOR VALUES FROM (%s) TO (%s)", bounds
+    )
+    cursor.execute(f"INSERT INTO {quote_name(table)} SELECT * FROM partition_moved")
+    cursor.execute("DROP TABLE partition_moved")
+    for relation, key, definition in referencing:
+        cursor.execute(f"ALTER TABLE {relation} ADD CONSTRAINT {quote_name(key)} {definition}")
+    return name
+
+
+def ensure_partitions(table, column, months_ahead, using='default'):
+    """Create the partitions of the current month and ``months_ahead`` following ones."""
+    connection = connections[using]
+    created = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        existing = set(list_partitions(cursor, table))
+        first = month_start(timezone.now())
+        for offset in range(months_ahead + 1):
+            month = add_months(first, offset)
+            if partition_name(table, month) not in existing:
+                created.append(_create_partition(cursor, connection.ops.quote_name, table, column, month))
+    return created
+
+
+def detach_partitions(table, before, using='default'):
+    """Detach the monthly partitions entirely older than ``before``; they stay as plain tables."""
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    detached = []
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        for name, month in sorted(list_partitions(cursor, table).items(), key=lambda item: item[1]):
+            if add_months(month, 1) <= before:
+                cursor.execute(f"ALTER TABLE {quote_name(table)} DETACH PARTITION {quote_name(name)}")
+                detached.append(name)
+    return detached
+
+
+def convert_to_partitioned(table, column, months_ahead, keep_legacy=False, using='default'):
+    """
+    Rebuild ``table`` as a table partitioned by month on the uuid7 ``column`` (its id, or a
+    parent's) and copy its rows over, under an exclusive lock. Secondary indexes and outgoing
+    foreign keys are recreated, incoming ones too when partitioned on its id (they need it
+    unique); unique indexes other than the primary key are dropped. The old table is dropped,
+    or kept as <table>_legacy. Returns False if ``table`` is partitioned already.
+    """
+    connection = connections[using]
+    quote_name = connection.ops.quote_name
+    legacy = f'{table}_legacy'
+
+    with transaction.atomic(using=using), connection.cursor() as cursor:
+        if is_partitioned(cursor, table):
+            return False
+        cursor.execute(f"LOCK TABLE {quote_name(table)} IN ACCESS EXCLUSIVE MODE")
+
+        cursor.execute(
+            "SELECT idx.relname, pg_get_indexdef(pg_index.indexrelid) FROM pg_index "
+            "JOIN pg_class idx ON idx.oid = pg_index.indexrelid "
+            "WHERE pg_index.indrelid = to_regclass(%s) AND NOT pg_index.indisunique", [table]
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = to_regclass(%s) "
+            "AND contype = 'f' AND conparentid = 0", [table]
+        )
+        foreign_keys = cursor.fetchall()
+        # defined before the rename, while they still name this table
+        referencing = _referencing_keys(cursor, table)
+        # the oldest uuid7 (version digit 7), rows with other ids go to the default partition
+        cursor.execute(
+            f"SELECT {quote_name(column)} FROM {quote_name(table)} "
+            f"WHERE substr({quote_name(column)}::text, 15, 1) = '7' ORDER BY {quote_name(column)} LIMIT 1"
+        )
+        row = cursor.fetchone()
+        oldest = uuid7_time(row[0]) if row else timezone.now()
+
+        for relation, name, _ in referencing:
+            cursor.execute(f"ALTER TABLE {relation} DROP CONSTRAINT {quote_name(name)}")
+        cursor.execute(f"ALTER TABLE {quote_name(table)} RENAME TO {quote_name(legacy)}")
+        cursor.execute(
+            f"CREATE TABLE {quote_name(table)} (LIKE {quote_name(legacy)} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+            f"PARTITION BY RANGE ({quote_name(column)})"
+        )
+        cursor.execute(f"CREATE TABLE {quote_name(table + '_default')} PARTITION OF {quote_name(table)} DEFAULT")
+        month, last = month_start(oldest), add_months(month_start(timezone.now()), months_ahead)
+        while month <= last:
+            _create_partition(cursor, quote_name, table, column, month)
+            month = add_months(month, 1)
+        cursor.execute(f"INSERT INTO {quote_name(table)} SELECT * FROM {quote_name(legacy)}")
+
+        if keep_legacy:
+            # index names are unique per schema, free them for the new table
+            cursor.execute(
+                "SELECT idx.relname FROM pg_index JOIN pg_class idx ON idx.oid = pg_index.indexrelid "
+                "WHERE pg_index.indrelid = to_regclass(%s)", [legacy]
+            )
+            for name, in cursor.fetchall():
+                cursor.execute(f"ALTER INDEX {quote_name(name)} RENAME TO {quote_name(name[:50] + '_legacy')}")
+        else:
+            cursor.execute(f"DROP TABLE {quote_name(legacy)}")
+
+        key = 'id' if column == 'id' else f'id, {quote_name(column)}'
+        cursor.execute(f"ALTER TABLE {quote_name(table)} ADD PRIMARY KEY ({key})")
+        for name, definition in indexes:
+            cursor.execute(definition)
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE {quote_name(table)} ADD CONSTRAINT {quote_name(name)} {definition}")
+        if column == 'id':
+            for relation, name, definition in referencing:
+                cursor.execute(f"ALTER TABLE {relation} ADD CONSTRAINT {quote_name(name)} {definition}")
+    return True
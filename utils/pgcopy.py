@@ -0,0 +1,59 @@
+import io
+import json
+from datetime import date, datetime
+
+from django.db import connections, models
+
+
+def _copy_text(value):
+    """One value in COPY's text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (date, datetime)):
+        value = value.isoformat()
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def bulk_copy(model, objs, using='default'):
+    """
+    Insert ``objs`` with PostgreSQL COPY ... FROM STDIN, one round trip for any number of rows;
+    bulk_create on other backends. Like bulk_create, fields' pre_save runs (defaults, auto_now,
+    current user) but no signals are sent. Auto-increment primary keys are left to the database
+    and not read back.
+    """
+    objs = list(objs)
+    connection = connections[using]
+    if not objs or connection.vendor != 'postgresql':
+        return model._default_manager.using(using).bulk_create(objs)
+
+    fields = [field for field in model._meta.concrete_fields if not (field.primary_key and field.db_returning)]
+    buffer = io.StringIO()
+    for obj in objs:
+        values = []
+        for field in fields:
+            value = field.pre_save(obj, add=True)
+            if isinstance(field, models.JSONField):
+                value = None if value is None else json.dumps(value, cls=field.encoder)
+            else:
+                value = field.get_db_prep_save(value, connection)
+            values.append(_copy_text(value))
+        buffer.write('\t'.join(values) + '\n')
+    buffer.seek(0)
+
+    quote_name = connection.ops.quote_name
+    sql = f"COPY {quote_name(model._meta.db_table)} ({', '.join(quote_name(f.column) for f in fields)}) FROM STDIN"
+    # Django does not translate driver errors of COPY, callers catch IntegrityError & co.
+    with connection.cursor() as cursor, connection.wrap_database_errors:
+        if hasattr(cursor, 'copy_expert'):
+            cursor.copy_expert(sql, buffer)
+        else:
+            # psycopg 3
+            with cursor.copy(sql) as copy:
+                copy.write(buffer.getvalue())
+
+    for obj in objs:
+        obj._state.adding = False
+        obj._state.db = using
+    return objs
@@ -0,0 +1,114 @@
+import json
+import os
+import random
+import re
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+#------------------------------------------------------------------------------------------------------------#
+# Query pattern recording
+#
+# QueryPatternMiddleware (in MIDDLEWARE only while QUERY_PATTERN_SAMPLE_RATE is above 0) samples
+# that share of the requests and appends every filtered or ordered SELECT they run to
+# QUERY_PATTERN_LOG, one JSON line each: the view (viewset class and action), the normalized
+# SQL and the type of each of its parameters. Parameter values are never written, the log
+# holds no user data; advise_indexes EXPLAINs the queries with representative values instead
+# (utils.index_advisor.representative_params).
+#------------------------------------------------------------------------------------------------------------#
+# a parameter, or a list of them: "IN (%s, %s, %s)" groups with "IN (%s)"
+PLACEHOLDER = re.compile(r'%%|IN \((?:%s, )*%s\)|%s')
+
+
+def pattern_log():
+    return getattr(settings, 'QUERY_PATTERN_LOG', os.path.join(settings.BASE_DIR, 'var', 'query_patterns.jsonl'))
+
+
+def normalize_sql(sql, params=()):
+    """``sql`` with parameter lists collapsed, and the type name of the value of each placeholder."""
+    params = list(params or ())
+    position, types = 0, []
+
+    def collapse(match):
+        nonlocal position
+        if match.group(0) == '%%':
+            return match.group(0)
+        count = match.group(0).count('%s')
+        values = params[position:position + count]
+        position += count
+        types.append(type(values[0]).__name__ if values else 'NoneType')
+        return '%s' if match.group(0) == '%s' else 'IN (%s)'
+
+    return PLACEHOLDER.sub(collapse, sql), types
+
+
+def view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return None
+    view = getattr(match.func, 'cls', None) or getattr(match.func, 'view_class', None)
+    if view is None:
+        return match.view_name
+    action = (getattr(match.func, 'actions', None) or {}).get(request.method.lower())
+    return f'{view.__name__}.{action}' if action else view.__name__
+
+
+def read_patterns(path=None):
+    """The recorded queries, grouped by SQL: {sql: {'calls', 'views', 'sql', 'types'}}."""
+    patterns = {}
+    path = path or pattern_log()
+    if not os.path.exists(path):
+        return patterns
+    with open(path) as log:
+        for line in log:
+            entry = json.loads(line)
+            pattern = patterns.setdefault(entry['sql'], {
+                'calls': 0, 'views': set(), 'sql': entry['sql'], 'types': entry['types'],
+            })
+            pattern['calls'] += 1
+            if entry['view']:
+                pattern['views'].add(entry['view'])
+    return patterns
+
+
+class QueryRecorder:
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        if not many and sql.startswith('SELECT') and (' WHERE ' in sql or ' ORDER BY ' in sql):
+            # normalized now, the values are not kept past the query
+            self.queries.append(normalize_sql(sql, params))
+        return execute(sql, params, many, context)
+
+    def save(self, view):
+        if not self.queries:
+            return
+        path = pattern_log()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        lines = ''.join(
+            json.dumps({'view': view, 'sql': sql, 'types': types}) + '\n'
+            for sql, types in self.queries
+        )
+        # one append per request, so lines from concurrent workers do not interleave
+        with open(path, 'a') as log:
+            log.write(lines)
+
+
+class QueryPatternMiddleware:
+    def __init__(self, get_response):
+        self.rate = getattr(settings, 'QUERY_PATTERN_SAMPLE_RATE', 0)
+        if not self.rate:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= self.rate:
+            return self.get_response(request)
+
+        recorder = QueryRecorder()
+        with connection.execute_wrapper(recorder):
+            response = self.get_response(request)
+        recorder.save(view_name(request))
+        return response
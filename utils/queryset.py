@@ -0,0 +1,91 @@
+from django.core.exceptions import FieldDoesNotExist
+from django.db.models import Prefetch
+from rest_framework import serializers
+from rest_framework.relations import ManyRelatedField, RelatedField
+
+
+def _get_field(model, name):
+    try:
+        return model._meta.get_field(name)
+    except FieldDoesNotExist:
+        return None
+
+
+def _ordered_queryset(model):
+    queryset = model._default_manager.all()
+    if model._meta.ordering:
+        queryset = queryset.order_by(*model._meta.ordering)
+    return queryset
+
+
+def _forward_path(model, attrs):
+    """Longest chain of forward FK/one-to-one attributes at the start of a dotted source."""
+    path = []
+    for attr in attrs:
+        field = _get_field(model, attr)
+        if field is None or not (field.many_to_one or field.one_to_one) or field.auto_created:
+            break
+        path.append(attr)
+        model = field.related_model
+    return path
+
+
+def _plan(model, serializer):
+    select, prefetch = set(), []
+
+    for field in serializer.fields.values():
+        if field.write_only or field.source == '*':
+            continue
+        attrs = field.source_attrs
+        model_field = _get_field(model, attrs[0])
+
+        if isinstance(field, serializers.ListSerializer) and model_field is not None:
+            child = field.child
+            queryset = _ordered_queryset(model_field.related_model)
+            if isinstance(child, serializers.BaseSerializer):
+                queryset = prefetch_for_serializer(queryset, child)
+            prefetch.append(Prefetch(attrs[0], queryset=queryset))
+
+        elif isinstance(field, ManyRelatedField) and model_field is not None:
+            prefetch.append(Prefetch(attrs[0], queryset=_ordered_queryset(model_field.related_model)))
+
+        elif isinstance(field, serializers.BaseSerializer) and model_field is not None:
+            select.add(attrs[0])
+            nested_select, nested_prefetch = _plan(model_field.related_model, field)
+            select.update(f'{attrs[0]}__{name}' for name in nested_select)
+            prefetch.extend(
+                Prefetch(f'{attrs[0]}__{lookup.prefetch_through}', queryset=lookup.queryset)
+                for lookup in nested_prefetch
+            )
+
+        elif isinstance(field, RelatedField) and len(attrs) == 1 and field.use_pk_only_optimization():
+            continue
+
+        elif len(attrs) == 1 and attrs[0] in getattr(model, 'property_relations', {}):
+            select.add(model.property_relations[attrs[0]])
+
+        else:
+            path = _forward_path(model, attrs)
+            if path and (len(path) < len(attrs) or isinstance(field, RelatedField)):
+                select.add('__'.join(path))
+
+    return select, prefetch
+
+
+def prefetch_for_serializer(queryset, serializer):
+    """
+    Add the select_related/prefetch_related a serializer tree needs, so rendering a page
+    costs a fixed number of queries whatever its size. Nested many-serializers become
+    Prefetch objects ordered by the related model's Meta.ordering.
+    """
+    if isinstance(serializer, type):
+        serializer = serializer()
+    if isinstance(serializer, serializers.ListSerializer):
+        serializer = serializer.child
+
+    select, prefetch = _plan(queryset.model, serializer)
+    if select:
+        queryset = queryset.select_related(*sorted(select))
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    return queryset
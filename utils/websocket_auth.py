@@ -0,0 +1,39 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+
+#------------------------------------------------------------------------------------------------------------#
+# WebSocket authentication
+#
+# Browsers cannot set headers on a WebSocket handshake, so the same access token the API takes
+# as "Authorization: Bearer <token>" comes as ?token=<token>; other clients may still send the
+# header. scope['user'] is the token's user, or AnonymousUser without a valid one.
+#------------------------------------------------------------------------------------------------------------#
+
+
+def _raw_token(scope):
+    token = parse_qs(scope.get('query_string', b'').decode()).get('token')
+    if token:
+        return token[0].encode()
+    header = dict(scope.get('headers', [])).get(b'authorization')
+    return header and JWTAuthentication().get_raw_token(header)
+
+
+@database_sync_to_async
+def _user(raw_token):
+    authentication = JWTAuthentication()
+    try:
+        return authentication.get_user(authentication.get_validated_token(raw_token))
+    except (InvalidToken, AuthenticationFailed):
+        return AnonymousUser()
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    async def __call__(self, scope, receive, send):
+        raw_token = _raw_token(scope)
+        scope = {**scope, 'user': await _user(raw_token) if raw_token else AnonymousUser()}
+        return await super().__call__(scope, receive, send)